@@ -0,0 +1,107 @@
+"""
+Search backends for NameRes.
+
+lookup() and reverse_lookup() in api/server.py handle validation, caching and the shape of the results; the search
+itself is done by a SearchBackend. Two backends are available, selected by the NAMERES_BACKEND environmental variable:
+- `solr` (the default): queries the name_lookup collection in Solr (see api/backends/solr.py).
+- `memory`: builds an inverted index from Babel synonym files in this process (see api/backends/memory.py). This is
+  intended for tests and small deployments that don't want to run Solr.
+"""
+import logging
+import os
+from typing import Dict, List, Optional, Tuple
+
+LOGGER = logging.getLogger(__name__)
+
+# Which backend to use: `solr` or `memory`.
+NAMERES_BACKEND = os.getenv("NAMERES_BACKEND", "solr")
+
+
+class SearchBackend:
+    """
+    The interface that every search backend implements.
+
+    Documents are dictionaries with the same fields as the Solr documents in the name_lookup collection (`id`,
+    `curie`, `preferred_name`, `names`, `types`, `taxa`, `clique_identifier_count` and so on).
+    """
+
+    # The name of this backend, as reported by /status.
+    name = ''
+
+    async def start(self):
+        """ Prepare this backend for use (e.g. by opening connections or loading an index). """
+
+    async def close(self):
+        """ Release any resources held by this backend. """
+
+    async def search(self, string_lc: str, autocomplete: bool, highlighting: bool, offset: int, limit: int,
+                     filter_args: tuple, fields: Optional[List[str]]) -> Tuple[List[Dict], Dict[str, Dict]]:
+        """
+        Search for documents matching a lowercased query string.
+
+        :param filter_args: Normalized filter arguments, as returned by normalize_filter_args().
+        :param fields: The document fields to return (which will include `id` and `curie`), or None for every stored
+            field. `score` is included if requested (or if fields is None).
+        :return: A list of matching documents in ranked order, and a dictionary of highlighting information keyed by
+            document `id`, which maps the names of matching fields to a list of highlighted values.
+        """
+        raise NotImplementedError()
+
+    async def fetch_documents(self, curies: List[str], fields: Optional[tuple] = None) -> Dict[str, Dict]:
+        """
+        Fetch the documents for a list of CURIEs.
+
+        :param fields: The fields to fetch, which must include `curie`. If None, all stored fields are fetched.
+        :return: A dictionary of documents keyed by CURIE. CURIEs that aren't in the index will be missing.
+        """
+        raise NotImplementedError()
+
+    async def index_status(self) -> Optional[Dict]:
+        """
+        Return information about the index: `message`, `startTime`, `numDocs`, `maxDoc`, `deletedDocs`, `version`,
+        `segmentCount`, `lastModified` and `size`. Returns None if the index could not be found.
+        """
+        raise NotImplementedError()
+
+    def stats(self) -> Optional[Dict]:
+        """ Return statistics about this backend for /status, or None if there aren't any. """
+        return None
+
+
+_backend: Optional[SearchBackend] = None
+
+
+def create_backend(name: str = NAMERES_BACKEND) -> SearchBackend:
+    """ Create the search backend with this name. """
+    if name == 'solr':
+        from .solr import SolrBackend
+        return SolrBackend()
+    if name == 'memory':
+        from .memory import MemoryBackend
+        return MemoryBackend()
+    raise ValueError(f"Unknown NAMERES_BACKEND '{name}': expected 'solr' or 'memory'.")
+
+
+async def start_backend():
+    """ Create and start the search backend. This should be called when the application starts. """
+    global _backend
+    if _backend is None:
+        _backend = create_backend()
+        LOGGER.info("Using the %s search backend.", _backend.name)
+    await _backend.start()
+
+
+async def close_backend():
+    """ Close the search backend. This should be called when the application shuts down. """
+    if _backend is not None:
+        await _backend.close()
+
+
+async def get_backend() -> SearchBackend:
+    """
+    Return the search backend, creating and starting it if needed (e.g. if the application was started without
+    running its lifespan, as the FastAPI TestClient does when it isn't used as a context manager).
+    """
+    if _backend is None:
+        await start_backend()
+    return _backend
@@ -0,0 +1,455 @@
+"""
+An in-process search backend, which indexes Babel synonym files in memory instead of querying Solr.
+
+This follows the Solr configuration in data-loading/setup-and-load-solr.sh as closely as it reasonably can:
+- `preferred_name` and `names` are tokenized and lowercased, and scored with BM25 (as Solr does by default).
+- `preferred_name_exactish` and `names_exactish` match the entire (lowercased) query string.
+- In autocomplete mode, every query token can also match the prefix of a token in `preferred_name` or `names`.
+- Scores are combined with the same field boosts as the edismax query in api/backends/solr.py, multiplied by
+  log(clique_identifier_count + 1), and ties are broken by `clique_identifier_count` and `curie_suffix`.
+
+Scores won't be identical to Solr's, but the ranking follows the same rules: exactish matches rank above token
+matches, preferred names above synonyms, and larger cliques above smaller ones.
+
+The index is built from the files listed in NAMERES_SYNONYMS_FILES when the backend starts. These can be Babel
+synonym files (one JSON object per line) or a JSON array of the same objects (like tests/data/test-synonyms.json),
+and may be gzipped.
+"""
+import asyncio
+import bisect
+import datetime
+import glob
+import gzip
+import hashlib
+import html
+import itertools
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from . import SearchBackend
+from ..metrics import observe_lookup_stage
+
+LOGGER = logging.getLogger(__name__)
+
+# A comma-separated list of synonym files (or glob patterns) to index.
+NAMERES_SYNONYMS_FILES = os.getenv("NAMERES_SYNONYMS_FILES", "")
+
+# An approximation of the Solr StandardTokenizer: runs of letters and digits, which may be joined by apostrophes or
+# full stops (e.g. "alzheimer's" or "3.4.23.46").
+TOKEN_RE = re.compile(r"\w+(?:['.]\w+)*")
+
+# The longest prefix indexed by the autocomplete field type (see the EdgeNGram filter in setup-and-load-solr.sh).
+MAX_AUTOCOMPLETE_PREFIX = 25
+
+# BM25 parameters (the Lucene defaults).
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Field boosts from the edismax query in api/backends/solr.py.
+QUERY_FIELD_BOOSTS = {
+    'preferred_name_exactish': 250,
+    'names_exactish': 100,
+    'preferred_name': 25,
+    'names': 10,
+    'preferred_name_autocomplete': 5,
+    'names_autocomplete': 2,
+}
+PHRASE_FIELD_BOOSTS = {
+    'preferred_name_exactish': 300,
+    'names_exactish': 200,
+    'preferred_name': 30,
+    'names': 20,
+}
+
+
+def tokenize(text: str) -> List[str]:
+    """ Split a string into lowercase tokens. """
+    return TOKEN_RE.findall(text.lower())
+
+
+class FieldIndex:
+    """
+    An inverted index for a single field: a postings list (document numbers and term frequencies) for every term,
+    the length of the field in every document, and a sorted list of terms for prefix searches.
+    """
+
+    def __init__(self):
+        self._building: Dict[str, Tuple[List[int], List[int]]] = {}
+        self.postings: Dict[str, Tuple[array, array]] = {}
+        self.lengths = array('I')
+        self.average_length = 0.0
+        self.terms: List[str] = []
+
+    def add(self, doc_number: int, terms: List[str]):
+        """ Add the terms for a document. Documents must be added in order. """
+        self.lengths.append(len(terms))
+        for term, count in Counter(terms).items():
+            doc_numbers, frequencies = self._building.setdefault(term, ([], []))
+            doc_numbers.append(doc_number)
+            frequencies.append(min(count, 0xFFFF))
+
+    def freeze(self):
+        """ Convert the postings into compact arrays once every document has been added. """
+        self.postings = {
+            term: (array('I', doc_numbers), array('H', frequencies))
+            for term, (doc_numbers, frequencies) in self._building.items()
+        }
+        self._building = {}
+        self.terms = sorted(self.postings)
+        self.average_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+
+    def idf(self, doc_frequency: int) -> float:
+        return math.log(1 + (len(self.lengths) - doc_frequency + 0.5) / (doc_frequency + 0.5))
+
+    def tf_norm(self, frequency: float, doc_number: int) -> float:
+        length_ratio = self.lengths[doc_number] / self.average_length if self.average_length else 1.0
+        return frequency / (frequency + BM25_K1 * (1 - BM25_B + BM25_B * length_ratio))
+
+    def term_scores(self, term: str) -> Dict[int, float]:
+        """ Return the BM25 score of this term in every document that contains it. """
+        if term not in self.postings:
+            return {}
+        doc_numbers, frequencies = self.postings[term]
+        idf = self.idf(len(doc_numbers))
+        return {
+            doc_number: idf * self.tf_norm(frequency, doc_number)
+            for doc_number, frequency in zip(doc_numbers, frequencies)
+        }
+
+    def prefix_scores(self, prefix: str) -> Dict[int, float]:
+        """
+        Return the BM25 score of a prefix in every document with a term starting with that prefix, as though every
+        prefix of every term had been indexed (as the autocomplete field type does).
+        """
+        if len(prefix) > MAX_AUTOCOMPLETE_PREFIX:
+            return self.term_scores(prefix)
+
+        frequencies: Dict[int, int] = {}
+        start = bisect.bisect_left(self.terms, prefix)
+        for term in itertools.takewhile(lambda t: t.startswith(prefix), itertools.islice(self.terms, start, None)):
+            for doc_number, frequency in zip(*self.postings[term]):
+                frequencies[doc_number] = frequencies.get(doc_number, 0) + frequency
+        idf = self.idf(len(frequencies))
+        return {
+            doc_number: idf * self.tf_norm(frequency, doc_number)
+            for doc_number, frequency in frequencies.items()
+        }
+
+
+class InMemoryIndex:
+    """ Babel synonym records and the indexes needed to search them. """
+
+    def __init__(self):
+        self.docs: List[Dict] = []
+        self.doc_numbers_by_curie: Dict[str, int] = {}
+        self.fields = {
+            'preferred_name': FieldIndex(),
+            'names': FieldIndex(),
+            # The exactish fields are indexed as a single lowercased term per name.
+            'preferred_name_exactish': FieldIndex(),
+            'names_exactish': FieldIndex(),
+        }
+        self.status: Dict = {}
+
+    def add(self, record: Dict):
+        """ Add a Babel synonym record to this index. """
+        doc_number = len(self.docs)
+        curie = record['curie']
+        doc = dict(record)
+        doc.setdefault('id', str(doc_number))
+        doc.setdefault('curie_prefix', curie.split(':', 1)[0])
+        doc.setdefault('names', [])
+        doc.setdefault('preferred_name', '')
+        doc.setdefault('types', [])
+        doc.setdefault('taxa', [])
+        doc.setdefault('clique_identifier_count', 0)
+        self.docs.append(doc)
+        self.doc_numbers_by_curie[curie] = doc_number
+
+        preferred_name = doc['preferred_name']
+        self.fields['preferred_name'].add(doc_number, tokenize(preferred_name))
+        self.fields['names'].add(doc_number, [token for name in doc['names'] for token in tokenize(name)])
+        self.fields['preferred_name_exactish'].add(doc_number, [preferred_name.lower()] if preferred_name else [])
+        self.fields['names_exactish'].add(doc_number, [name.lower() for name in doc['names']])
+
+    def freeze(self):
+        for field in self.fields.values():
+            field.freeze()
+
+    @classmethod
+    def load(cls, paths: List[str]) -> 'InMemoryIndex':
+        """ Build an index from a list of synonym files. """
+        start = time.perf_counter()
+        index = cls()
+        for path in paths:
+            for record in read_synonym_file(path):
+                index.add(record)
+        index.freeze()
+
+        stats = [os.stat(path) for path in paths]
+        fingerprint = hashlib.sha256()
+        for path, stat in zip(paths, stats):
+            fingerprint.update(f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode('utf-8'))
+        last_modified = max((stat.st_mtime for stat in stats), default=0)
+        index.status = {
+            'message': f"Reporting results from an in-memory index of {len(paths)} file(s).",
+            'startTime': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'numDocs': len(index.docs),
+            'maxDoc': len(index.docs),
+            'deletedDocs': 0,
+            'version': fingerprint.hexdigest()[:16],
+            'segmentCount': len(paths),
+            'lastModified': datetime.datetime.fromtimestamp(last_modified, datetime.timezone.utc).isoformat(),
+            'size': f"{sum(stat.st_size for stat in stats) / 1024 / 1024:.2f} MB (on disk)",
+        }
+        LOGGER.info("Indexed %d documents from %d file(s) in %.1f seconds.", len(index.docs), len(paths),
+                    time.perf_counter() - start)
+        return index
+
+    def phrase_scores(self, field_name: str, tokens: List[str], candidates: Iterable[int]) -> Dict[int, float]:
+        """ Return the BM25 score of a multi-token phrase in the candidate documents that contain it. """
+        field = self.fields[field_name]
+        idf = sum(field.idf(len(field.postings[token][0])) for token in set(tokens) if token in field.postings)
+        scores = {}
+        for doc_number in candidates:
+            doc = self.docs[doc_number]
+            values = doc['names'] if field_name == 'names' else [doc['preferred_name']]
+            frequency = 0
+            for value in values:
+                value_tokens = tokenize(value)
+                frequency += sum(
+                    1 for i in range(len(value_tokens) - len(tokens) + 1)
+                    if value_tokens[i:i + len(tokens)] == tokens
+                )
+            if frequency:
+                scores[doc_number] = idf * field.tf_norm(frequency, doc_number)
+        return scores
+
+    def search(self, string_lc: str, autocomplete: bool, filter_args: tuple) -> List[Tuple[int, float]]:
+        """
+        Search this index for a lowercased query string, and return the matching document numbers with their scores
+        in ranked order.
+        """
+        # The whole query, as matched by the exactish fields (see how the query is escaped in the Solr backend).
+        phrase = string_lc.replace('"', '').replace('\\', '')
+        tokens = tokenize(string_lc)
+
+        # The quoted phrase and each individual token are separate clauses. For each clause, the best-scoring field
+        # counts (as with the edismax query parser).
+        phrase_field_scores = {
+            'preferred_name_exactish': self.fields['preferred_name_exactish'].term_scores(phrase),
+            'names_exactish': self.fields['names_exactish'].term_scores(phrase),
+        }
+        token_clauses = []
+        for token in tokens:
+            field_scores = {
+                'preferred_name': self.fields['preferred_name'].term_scores(token),
+                'names': self.fields['names'].term_scores(token),
+            }
+            if autocomplete:
+                field_scores['preferred_name_autocomplete'] = self.fields['preferred_name'].prefix_scores(token)
+                field_scores['names_autocomplete'] = self.fields['names'].prefix_scores(token)
+            token_clauses.append(field_scores)
+
+        if len(tokens) == 1:
+            # A single-token phrase is just that token.
+            phrase_field_scores.update({
+                'preferred_name': token_clauses[0]['preferred_name'],
+                'names': token_clauses[0]['names'],
+            })
+        elif len(tokens) > 1:
+            # A multi-token phrase has to match documents that contain every token.
+            with_every_token = {
+                field_name: set.intersection(*[set(clause[field_name]) for clause in token_clauses])
+                for field_name in ('preferred_name', 'names')
+            }
+            for field_name, candidates in with_every_token.items():
+                phrase_field_scores[field_name] = self.phrase_scores(field_name, tokens, candidates)
+
+        scores: Dict[int, float] = {}
+        for field_scores in [phrase_field_scores] + token_clauses:
+            clause_scores: Dict[int, float] = {}
+            for field_name, doc_scores in field_scores.items():
+                boost = QUERY_FIELD_BOOSTS[field_name]
+                for doc_number, score in doc_scores.items():
+                    if score * boost > clause_scores.get(doc_number, 0.0):
+                        clause_scores[doc_number] = score * boost
+            for doc_number, score in clause_scores.items():
+                scores[doc_number] = scores.get(doc_number, 0.0) + score
+
+        # Phrase boosts (pf) only apply to queries with more than one token.
+        if len(tokens) > 1:
+            for field_name, boost in PHRASE_FIELD_BOOSTS.items():
+                for doc_number, score in phrase_field_scores.get(field_name, {}).items():
+                    scores[doc_number] += score * boost
+
+        biolink_types, only_prefixes, exclude_prefixes, only_taxa = filter_args
+        results = []
+        for doc_number, score in scores.items():
+            doc = self.docs[doc_number]
+            if biolink_types and not any(t in biolink_types for t in doc['types']):
+                continue
+            if only_prefixes and doc['curie_prefix'] not in only_prefixes:
+                continue
+            if exclude_prefixes and doc['curie_prefix'] in exclude_prefixes:
+                continue
+            if only_taxa and not any(taxon in only_taxa for taxon in doc['taxa']):
+                continue
+            results.append((doc_number, score * math.log10(doc['clique_identifier_count'] + 1)))
+
+        def sort_key(result):
+            doc_number, score = result
+            doc = self.docs[doc_number]
+            curie_suffix = doc.get('curie_suffix')
+            return (-score, -doc['clique_identifier_count'], curie_suffix is None, curie_suffix or 0, doc_number)
+
+        results.sort(key=sort_key)
+        return results
+
+    def highlight(self, doc_number: int, string_lc: str, autocomplete: bool) -> Dict[str, List[str]]:
+        """ Return highlighting information for a document in the same shape as Solr's unified highlighter. """
+        doc = self.docs[doc_number]
+        phrase = string_lc.replace('"', '').replace('\\', '')
+        tokens = set(tokenize(string_lc))
+
+        def token_matches(token: str) -> bool:
+            if token in tokens:
+                return True
+            return autocomplete and any(token.startswith(t) for t in tokens if len(t) <= MAX_AUTOCOMPLETE_PREFIX)
+
+        def highlight_tokens(value: str) -> Optional[str]:
+            parts = []
+            position = 0
+            for match in TOKEN_RE.finditer(value):
+                if token_matches(match.group(0).lower()):
+                    parts.append(html.escape(value[position:match.start()]))
+                    parts.append(f"<strong>{html.escape(match.group(0))}</strong>")
+                    position = match.end()
+            if not parts:
+                return None
+            parts.append(html.escape(value[position:]))
+            return ''.join(parts)
+
+        matches = {}
+        if doc['preferred_name'].lower() == phrase:
+            matches['preferred_name_exactish'] = [f"<strong>{html.escape(doc['preferred_name'])}</strong>"]
+        exact_names = [name for name in doc['names'] if name.lower() == phrase]
+        if exact_names:
+            matches['names_exactish'] = [f"<strong>{html.escape(exact_names[0])}</strong>"]
+        highlighted = highlight_tokens(doc['preferred_name'])
+        if highlighted:
+            matches['preferred_name'] = [highlighted]
+        # Like Solr, we only return one snippet per field.
+        highlighted_names = [highlighted for highlighted in map(highlight_tokens, doc['names']) if highlighted]
+        if highlighted_names:
+            matches['names'] = [max(highlighted_names, key=lambda value: value.count('<strong>'))]
+        return matches
+
+
+def read_synonym_file(path: str) -> Iterator[Dict]:
+    """ Read the records in a synonym file, which may be a JSON array or JSON Lines, and may be gzipped. """
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        if path.removesuffix('.gz').endswith('.json'):
+            yield from json.load(f)
+            return
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def synonym_file_paths(patterns: str) -> List[str]:
+    """ Expand a comma-separated list of files or glob patterns into a sorted list of files. """
+    paths = []
+    for pattern in filter(None, (p.strip() for p in patterns.split(','))):
+        matches = sorted(glob.glob(pattern))
+        if not matches:
+            raise FileNotFoundError(f"No synonym files found matching '{pattern}'.")
+        paths.extend(matches)
+    return paths
+
+
+def project(doc: Dict, score: float, fields: Optional[List[str]]) -> Dict:
+    """ Return the requested fields of a document, as Solr would with the `fields` parameter. """
+    if not fields:
+        return dict(doc, score=score)
+    projected = {field: doc[field] for field in fields if field in doc}
+    if 'score' in fields:
+        projected['score'] = score
+    return projected
+
+
+class MemoryBackend(SearchBackend):
+    """ Searches an in-memory index of Babel synonym files. """
+
+    name = 'memory'
+
+    def __init__(self, synonym_files: str = NAMERES_SYNONYMS_FILES):
+        self.synonym_files = synonym_files
+        self.index: Optional[InMemoryIndex] = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> InMemoryIndex:
+        # The index might be loaded from more than one event loop (e.g. by a TestClient), so we use a thread lock.
+        with self._lock:
+            if self.index is None:
+                paths = synonym_file_paths(self.synonym_files)
+                if not paths:
+                    raise ValueError("NAMERES_SYNONYMS_FILES must be set to use the memory backend.")
+                self.index = InMemoryIndex.load(paths)
+            return self.index
+
+    async def start(self):
+        # Building the index takes a while, so we do it in a thread to keep the event loop responsive.
+        await asyncio.to_thread(self._load)
+
+    def _search(self, string_lc: str, autocomplete: bool, highlighting: bool, offset: int, limit: int,
+                filter_args: tuple, fields: Optional[List[str]]) -> Tuple[List[Dict], Dict[str, Dict]]:
+        index = self._load()
+        stage_start = time.perf_counter()
+        results = index.search(string_lc, autocomplete, filter_args)[offset:offset + limit]
+        stage_start = observe_lookup_stage('index_search', stage_start)
+
+        docs = [project(index.docs[doc_number], score, fields) for doc_number, score in results]
+        highlights = {}
+        if highlighting:
+            for doc_number, _ in results:
+                highlights[index.docs[doc_number]['id']] = index.highlight(doc_number, string_lc, autocomplete)
+        observe_lookup_stage('document_loading', stage_start)
+        return docs, highlights
+
+    async def search(self, string_lc: str, autocomplete: bool, highlighting: bool, offset: int, limit: int,
+                     filter_args: tuple, fields: Optional[List[str]]) -> Tuple[List[Dict], Dict[str, Dict]]:
+        # Searches are CPU-bound, so we run them in a thread to keep the event loop responsive.
+        return await asyncio.to_thread(self._search, string_lc, autocomplete, highlighting, offset, limit,
+                                       filter_args, fields)
+
+    async def fetch_documents(self, curies: List[str], fields: Optional[tuple] = None) -> Dict[str, Dict]:
+        index = await asyncio.to_thread(self._load)
+        docs = {}
+        for curie in curies:
+            if curie in index.doc_numbers_by_curie:
+                doc = index.docs[index.doc_numbers_by_curie[curie]]
+                docs[curie] = {field: doc[field] for field in fields if field in doc} if fields else dict(doc)
+        return docs
+
+    async def index_status(self) -> Optional[Dict]:
+        index = await asyncio.to_thread(self._load)
+        return dict(index.status)
+
+    def stats(self) -> Optional[Dict]:
+        if self.index is None:
+            return {'loaded': False}
+        return {
+            'loaded': True,
+            'documents': len(self.index.docs),
+            'terms': {name: len(field.postings) for name, field in self.index.fields.items()},
+        }
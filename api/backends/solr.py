@@ -0,0 +1,402 @@
+"""
+The Solr search backend, which queries the name_lookup collection through the shared Solr client in api/solr.py.
+"""
+import functools
+import json
+import logging
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from . import SearchBackend
+from ..deadlines import DeadlineExceeded, remaining
+from ..metrics import observe_lookup_stage, SOLR_QTIME
+from ..profiling import record_stage, record_solr_query
+from ..solr import get_solr_client, start_solr_client, close_solr_client, solr_client_stats
+
+LOGGER = logging.getLogger(__name__)
+
+# The collection we search. This may be an alias for a versioned collection (e.g. name_lookup_2025sep1), which lets
+# a new index be swapped in without downtime (see solr-restore/swap-collection.sh).
+COLLECTION_NAME = "name_lookup"
+SELECT_PATH = f"/solr/{COLLECTION_NAME}/select"
+
+
+def time_allowed_params() -> Dict:
+    """
+    Tell Solr to stop searching when the current request's deadline passes (see api/deadlines.py), rather than
+    carrying on with a search that nobody will wait for.
+    """
+    time_remaining = remaining()
+    if time_remaining is None:
+        return {}
+    return {"timeAllowed": max(1, int(time_remaining * 1000))}
+
+
+def check_partial_results(response_header: Dict):
+    """
+    Raise DeadlineExceeded if Solr ran out of time (timeAllowed) and only returned partial results, which we must
+    not return or cache as if they were complete.
+    """
+    if response_header.get('partialResults'):
+        raise DeadlineExceeded("Solr could not finish this search before the deadline.")
+
+
+class SolrBackend(SearchBackend):
+    """ Searches the name_lookup collection in Solr. """
+
+    name = 'solr'
+
+    async def start(self):
+        await start_solr_client()
+
+    async def close(self):
+        await close_solr_client()
+
+    async def search(self, string_lc: str, autocomplete: bool, highlighting: bool, offset: int, limit: int,
+                     filter_args: tuple, fields: Optional[List[str]]) -> Tuple[List[Dict], Dict[str, Dict]]:
+        stage_start = time.perf_counter()
+
+        # For reasons I don't understand, we need to use backslash to escape characters (e.g. "\(") to remove the
+        # special significance of characters inside round brackets, but not inside double-quotes. So we escape them
+        # separately:
+        # - For a full exact search, we only remove double-quotes and slashes, leaving other special characters as-is.
+        string_lc_escape_groupings = string_lc.replace('"', '').replace('\\', '')
+
+        # - For a tokenized search, we escape all special characters with backslashes as well as other characters that
+        #   might mess up the search.
+        string_lc_escape_everything = re.sub(r'([!(){}\[\]^"~*?:/+-\\])', r'\\\g<0>', string_lc) \
+            .replace('&&', ' ').replace('||', ' ')
+
+        query = f'"{string_lc_escape_groupings}" OR ({string_lc_escape_everything})'
+
+        # qf = query fields, i.e. how should we boost these fields if they contain the same fields as the input.
+        # https://solr.apache.org/guide/solr/latest/query-guide/dismax-query-parser.html#qf-query-fields-parameter
+        query_fields = "preferred_name_exactish^250 names_exactish^100 preferred_name^25 names^10"
+
+        # If autocomplete mode is turned on, we also search the autocomplete fields, which index every prefix of every
+        # token, so that we can match incomplete terms without having Solr expand a wildcard over the entire index.
+        if autocomplete:
+            query_fields += " preferred_name_autocomplete^5 names_autocomplete^2"
+
+        # Apply filters as needed.
+        filters = list(solr_filters(*filter_args))
+
+        # Turn on highlighting if requested.
+        inner_params = time_allowed_params()
+        if highlighting:
+            inner_params.update({
+                # Highlighting
+                "hl": "true",
+                "hl.method": "unified",
+                "hl.encoder": "html",
+                "hl.tag.pre": "<strong>",
+                "hl.tag.post": "</strong>",
+                # "hl.usePhraseHighlighter": "true",
+                # "hl.highlightMultiTerm": "true",
+            })
+
+        params = {
+            "query": {
+                "edismax": {
+                    "query": query,
+                    "qf": query_fields,
+                    # pf = phrase fields, i.e. how should we boost these fields if they contain the entire search
+                    # phrase.
+                    # https://solr.apache.org/guide/solr/latest/query-guide/dismax-query-parser.html#pf-phrase-fields-parameter
+                    "pf": "preferred_name_exactish^300 names_exactish^200 preferred_name^30 names^20",
+                    # Boosts
+                    "bq": [],
+                    "boost": [
+                        # The boost is multiplied with score -- calculating the log() reduces how quickly this
+                        # increases the score for increasing clique identifier counts.
+                        "log(sum(clique_identifier_count, 1))"
+                    ],
+                },
+            },
+            "sort": "score DESC, clique_identifier_count DESC, curie_suffix ASC",
+            "limit": limit,
+            "offset": offset,
+            "filter": filters,
+            "fields": ",".join(fields) if fields else "*, score",
+            "params": inner_params,
+        }
+        # Formatting the query and response as JSON is expensive, so we only do it if we're going to log them.
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            LOGGER.debug(f"Query: {json.dumps(params, indent=2)}")
+        stage_start = observe_lookup_stage('query_construction', stage_start)
+
+        solr_client = await get_solr_client()
+        response = await solr_client.post(SELECT_PATH, json=params, hedge=True)
+        if response.status_code >= 300:
+            LOGGER.error("Solr REST error: %s", response.text)
+            response.raise_for_status()
+        stage_start = observe_lookup_stage('solr_request', stage_start)
+
+        response = response.json()
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            LOGGER.debug(f"Solr response: {json.dumps(response, indent=2)}")
+        observe_lookup_stage('json_decoding', stage_start)
+        if 'QTime' in response.get('responseHeader', {}):
+            SOLR_QTIME.observe(response['responseHeader']['QTime'] / 1000)
+        record_solr_query(SELECT_PATH, params, response.get('responseHeader', {}))
+        check_partial_results(response.get('responseHeader', {}))
+
+        return response['response']['docs'], response.get("highlighting", {})
+
+    async def fetch_documents(self, curies: List[str], fields: Optional[tuple] = None) -> Dict[str, Dict]:
+        params = {
+            # The terms query parser is much cheaper than a long `curie:"X" OR curie:"Y"` boolean query.
+            "query": "{!terms f=curie}" + ",".join(curies),
+            # Each CURIE should only be present in a single document.
+            "limit": len(curies),
+            "params": time_allowed_params(),
+        }
+        if fields:
+            params["fields"] = ",".join(fields)
+        start = time.perf_counter()
+        solr_client = await get_solr_client()
+        response = await solr_client.post(SELECT_PATH, json=params, hedge=True)
+        response.raise_for_status()
+        record_stage('solr_request', time.perf_counter() - start)
+
+        start = time.perf_counter()
+        response_json = response.json()
+        record_stage('json_decoding', time.perf_counter() - start)
+        record_solr_query(SELECT_PATH, params, response_json.get('responseHeader', {}))
+        check_partial_results(response_json.get('responseHeader', {}))
+        return {
+            doc["curie"]: doc
+            for doc in response_json["response"]["docs"]
+        }
+
+    async def index_status(self) -> Optional[Dict]:
+        collection = await resolve_collection()
+        cores, expected_shards = await collection_cores(collection)
+        if not cores:
+            return None
+
+        # Every replica of a shard has the same documents, so we count each shard once, from its leader if we know
+        # which one that is.
+        shards = {}
+        for core in cores:
+            if core['shard'] not in shards or core['leader']:
+                shards[core['shard']] = core
+        shard_cores = [shards[shard] for shard in sorted(shards, key=shard_sort_key)]
+        indexes = [core['status'].get('index', {}) for core in shard_cores]
+
+        # If we couldn't reach any replica of a shard, the document counts and sizes below leave it out.
+        missing_shards = sorted(set(expected_shards) - set(shards), key=shard_sort_key)
+
+        # The index version is used to tell when the index has changed, so with more than one shard we combine the
+        # versions of every shard.
+        if len(indexes) == 1:
+            version = indexes[0].get('version', '')
+        else:
+            version = ','.join(f"{core['shard']}:{index.get('version', '')}"
+                               for core, index in zip(shard_cores, indexes))
+
+        size_in_bytes = sum(index.get('sizeInBytes', 0) for index in indexes)
+        return {
+            'message': f'Reporting results from {len(shards)} shard(s) ({len(cores)} core(s)) of {collection}.',
+            'collection': collection,
+            # Versioned collections are named after the Babel version they were built from.
+            'babel_version': collection.removeprefix(f'{COLLECTION_NAME}_') if collection != COLLECTION_NAME else None,
+            'startTime': min(core['status']['startTime'] for core in shard_cores),
+            'numDocs': sum(index.get('numDocs', 0) for index in indexes),
+            'maxDoc': sum(index.get('maxDoc', 0) for index in indexes),
+            'deletedDocs': sum(index.get('deletedDocs', 0) for index in indexes),
+            'version': version,
+            'segmentCount': sum(index.get('segmentCount', 0) for index in indexes),
+            'lastModified': max((index.get('lastModified', '') for index in indexes), default=''),
+            'size': human_size(size_in_bytes) if len(indexes) > 1 else indexes[0].get('size', ''),
+            'sizeInBytes': size_in_bytes,
+            'shards': len(shards),
+            'missing_shards': missing_shards,
+            'cores': [{
+                'name': core['name'],
+                'shard': core['shard'],
+                'leader': core['leader'],
+                'numDocs': core['status'].get('index', {}).get('numDocs', ''),
+                'segmentCount': core['status'].get('index', {}).get('segmentCount', ''),
+                'size': core['status'].get('index', {}).get('size', ''),
+            } for core in cores],
+        }
+
+    def stats(self) -> Optional[Dict]:
+        return solr_client_stats()
+
+
+async def resolve_collection() -> str:
+    """ Return the name of the collection that COLLECTION_NAME is an alias for, or COLLECTION_NAME if it isn't one. """
+    solr_client = await get_solr_client()
+    response = await solr_client.get("/solr/admin/collections", params={'action': 'LISTALIASES'})
+    if response.status_code >= 300:
+        return COLLECTION_NAME
+    alias = response.json().get('aliases', {}).get(COLLECTION_NAME)
+    # An alias can point to several collections, but we only ever point it at one.
+    return alias.split(',')[0] if alias else COLLECTION_NAME
+
+
+async def collection_cores(collection: str) -> Tuple[List[Dict], List[str]]:
+    """
+    Return the status of every core of a collection that we could reach, as dictionaries with the core name, its
+    shard, whether it is the shard leader, and its status from the CoreAdmin API, along with the names of every shard
+    of the collection according to CLUSTERSTATUS (or an empty list if CLUSTERSTATUS isn't available).
+
+    In SolrCloud, the cores may be spread over several nodes, so we find them with CLUSTERSTATUS and ask each node
+    for the status of its cores. The node addresses in the cluster state often can't be reached from here (e.g. from
+    another container), so we skip any node we can't reach and look for its cores on the node we are connected to
+    instead. If CLUSTERSTATUS isn't available, we only look at the cores on the node we are connected to.
+    """
+    solr_client = await get_solr_client()
+
+    # Find the cores (and the nodes they are on) from the cluster state.
+    replicas = {}
+    response = await solr_client.get("/solr/admin/collections", params={
+        'action': 'CLUSTERSTATUS',
+        'collection': collection,
+    })
+    if response.status_code < 300:
+        cluster_state = response.json().get('cluster', {}).get('collections', {}).get(collection, {})
+        for shard_name, shard in cluster_state.get('shards', {}).items():
+            for replica in shard.get('replicas', {}).values():
+                # Newer versions of Solr only report the node name (e.g. 10.0.0.1:8983_solr) of each replica.
+                base_url = replica.get('base_url')
+                if not base_url and replica.get('node_name'):
+                    host_port, _, context = replica['node_name'].partition('_')
+                    base_url = f"http://{host_port}/{context or 'solr'}"
+                replicas[replica['core']] = {
+                    'shard': shard_name,
+                    'leader': replica.get('leader') == 'true',
+                    'base_url': base_url,
+                }
+    node_urls = sorted({replica['base_url'] for replica in replicas.values() if replica['base_url']}) or [None]
+
+    # Core names look like name_lookup_shard2_replica_n3.
+    core_name_re = re.compile(rf"^{re.escape(collection)}_(shard\d+)_replica_\w+$")
+    cores = []
+    for node_url in node_urls:
+        # With no base URL, we ask the node we are connected to.
+        statuses = await core_statuses(node_url)
+        if statuses is None:
+            continue
+        for name, status in statuses.items():
+            if replicas:
+                if name not in replicas or replicas[name]['base_url'] != node_url:
+                    continue
+                shard, leader = replicas[name]['shard'], replicas[name]['leader']
+            else:
+                match = core_name_re.match(name)
+                if not match:
+                    continue
+                shard, leader = match.group(1), False
+            cores.append({'name': name, 'shard': shard, 'leader': leader, 'status': status})
+
+    # Look for the cores on nodes we couldn't reach on the node we are connected to.
+    missing = set(replicas) - {core['name'] for core in cores}
+    if missing:
+        for name, status in (await core_statuses(None)).items():
+            if name in missing:
+                cores.append({'name': name, 'shard': replicas[name]['shard'], 'leader': replicas[name]['leader'],
+                              'status': status})
+    cores.sort(key=lambda core: (shard_sort_key(core['shard']), core['name']))
+    return cores, sorted({replica['shard'] for replica in replicas.values()}, key=shard_sort_key)
+
+
+async def core_statuses(node_url: Optional[str]) -> Optional[Dict[str, Dict]]:
+    """
+    Return the CoreAdmin status of every core on a Solr node, or on the node we are connected to if node_url is None.
+    Returns None if another node can't be reached or reports an error; errors from our own node are raised.
+    """
+    solr_client = await get_solr_client()
+    path = f"{node_url}/admin/cores" if node_url else "/solr/admin/cores"
+    try:
+        response = await solr_client.get(path, params={'action': 'STATUS'})
+    except httpx.TransportError as err:
+        if node_url is None:
+            raise
+        LOGGER.warning("Could not reach Solr node %s for core status: %s", node_url, err)
+        return None
+    if response.status_code >= 300:
+        LOGGER.error("Solr error on accessing %s?action=STATUS: %s", path, response.text)
+        if node_url is None:
+            response.raise_for_status()
+        return None
+    return response.json().get('status', {})
+
+
+def shard_sort_key(shard: str) -> Tuple[int, str]:
+    """ Sort shards numerically (shard2 before shard10). """
+    digits = re.sub(r'\D', '', shard)
+    return int(digits) if digits else 0, shard
+
+
+def human_size(size_in_bytes: int) -> str:
+    """ Format a size in bytes in the same way as the CoreAdmin API. """
+    size = float(size_in_bytes)
+    for unit in ('bytes', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == 'bytes' else f"{size:.2f} {unit}"
+        size /= 1024
+    return f"{size:.2f} TB"
+
+
+def solr_term(field: str, value: str) -> str:
+    """
+    Return a Solr query for documents with exactly this value in a string field. The value comes from the request, so
+    we escape the characters that would otherwise end the quoted term early.
+    """
+    escaped = value.replace('\\', '\\\\').replace('"', '\\"')
+    return f'{field}:"{escaped}"'
+
+
+@functools.lru_cache(maxsize=1024)
+def solr_filter_clause(field: str, values: tuple) -> str:
+    """
+    Return a Solr filter query matching documents with any of these values in this field.
+
+    Each value is wrapped in its own filter(), so that Solr caches it as a separate filterCache entry that can be
+    shared with every other request that filters on it (e.g. `types:"Disease"`), regardless of what it's combined
+    with. The combination itself isn't worth caching.
+    """
+    if len(values) == 1:
+        return solr_term(field, values[0])
+    return "{!cache=false}" + " OR ".join(f'filter({solr_term(field, value)})' for value in values)
+
+
+@functools.lru_cache(maxsize=1024)
+def solr_filters(biolink_types: tuple, only_prefixes: tuple, exclude_prefixes: tuple, only_taxa: tuple) -> tuple:
+    """
+    Return the Solr filter queries for a set of normalized filter arguments (see normalize_filter_args()).
+    """
+    filters = []
+
+    # Biolink type filter
+    if biolink_types:
+        filters.append(solr_filter_clause("types", biolink_types))
+
+    # Prefix: only filter
+    # (curie_prefix is an indexed string field containing the part of the CURIE before the first colon, so we can
+    # filter on exact terms rather than running a regular expression over every CURIE.)
+    if only_prefixes:
+        filters.append(solr_filter_clause("curie_prefix", only_prefixes))
+
+    # Taxa filter.
+    # only_taxa is like: 'NCBITaxon:9606|NCBITaxon:10090|NCBITaxon:10116|NCBITaxon:7955'
+    if only_taxa:
+        filters.append(solr_filter_clause("taxa", only_taxa))
+
+    # Prefix: exclude filter
+    # Exclusions match most of the index, so caching them would be expensive and rarely useful. Solr runs uncached
+    # filters in order of cost, stepping through each one's matches alongside the main query and the other filters,
+    # so a high cost means that it is run last. (This isn't a PostFilter, since only a few query parsers support
+    # those: it still steps through the documents it matches rather than checking each candidate document.)
+    if exclude_prefixes:
+        filters.append("{!cache=false cost=200}*:* " + " ".join(
+            f'-{solr_term("curie_prefix", prefix)}' for prefix in exclude_prefixes
+        ))
+
+    return tuple(filters)
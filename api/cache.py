@@ -0,0 +1,218 @@
+"""
+In-process result caches for NameRes, and coalescing of identical requests that are in progress at the same time.
+
+NameRes traffic is very repetitive, so we keep small in-process caches of recent results. Every cache is
+bounded in size (evicting the least recently used entry when full) and in time (entries expire after a TTL).
+
+Since cached results are only valid for a particular Solr index, every cache registers itself here, and all
+of them are cleared whenever the index status poller sees a different index. A search that was started against the
+old index can finish after that, so callers capture the cache's generation before searching and pass it to set(),
+which discards results from an earlier generation.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+LOGGER = logging.getLogger(__name__)
+
+# All the caches that need to be cleared when the Solr index changes.
+CACHES: List['ResultCache'] = []
+
+# Every SingleFlight, so that we can report how many requests each one has coalesced.
+SINGLE_FLIGHTS: List['SingleFlight'] = []
+
+
+class ResultCache:
+    """
+    A size-bounded LRU cache whose entries expire after a TTL.
+
+    A max_size of zero or less disables the cache: nothing will be stored and every lookup will be a miss.
+    """
+
+    def __init__(self, name: str, max_size: int, ttl: float):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        # Maps keys to (expiry time, value) tuples, from least to most recently used.
+        self.entries: OrderedDict = OrderedDict()
+
+        # Counters for stats().
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stale = 0
+
+        # Incremented every time the cache is cleared.
+        self.generation = 0
+
+        CACHES.append(self)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """ Return the cached value for a key, or default if it isn't cached or has expired. """
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self.entries[key]
+            self.misses += 1
+            return default
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, generation: Optional[int] = None):
+        """
+        Store a value in the cache, evicting the least recently used entries if needed.
+
+        If generation is given, it should be the cache's generation from before the value was computed; if the cache
+        has been cleared since then, the value is out of date and isn't stored.
+        """
+        if not self.enabled:
+            return
+        if generation is not None and generation != self.generation:
+            self.stale += 1
+            return
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        """ Remove all entries from this cache. """
+        self.entries.clear()
+        self.invalidations += 1
+        self.generation += 1
+
+    def stats(self) -> Dict:
+        """ Return statistics on this cache. """
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'max_size': self.max_size,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits / lookups) if lookups else 0.0,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'stale': self.stale,
+        }
+
+
+class SingleFlight:
+    """
+    Coalesces identical requests that are in progress at the same time.
+
+    A cache only helps once a result has been stored, so when many clients ask for the same thing at the same moment
+    (e.g. a trending term, or the same autocomplete prefix) they would all miss the cache and query the search backend.
+    Instead, the first request starts a task that does the work, and identical requests that arrive while that task is
+    running wait for its result.
+
+    A single task can be registered under several keys (e.g. a chunk of CURIEs being fetched together). Waiters
+    await the task through asyncio.shield(), so a waiter that is cancelled (e.g. because its client disconnected)
+    doesn't cancel the work for the others; the task is only cancelled once every waiter has been.
+
+    When the search index changes, detach() forgets the tasks in progress, so that new requests start their own
+    search against the new index instead of waiting for a result from the old one.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.in_flight: Dict[Hashable, asyncio.Task] = {}
+        self.waiters: Dict[asyncio.Task, int] = {}
+        self.started = 0
+        self.coalesced = 0
+        self.cancelled = 0
+        SINGLE_FLIGHTS.append(self)
+
+    def get(self, key: Hashable) -> Optional[asyncio.Task]:
+        """ Return the task that is already working on this key, if there is one. """
+        task = self.in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        return task
+
+    def start(self, keys: List[Hashable], coroutine: Awaitable) -> asyncio.Task:
+        """ Run a coroutine in a task that identical requests for any of these keys can wait for. """
+        task = asyncio.ensure_future(coroutine)
+        self.started += 1
+        for key in keys:
+            self.in_flight[key] = task
+
+        def finished(_):
+            for key in keys:
+                if self.in_flight.get(key) is task:
+                    del self.in_flight[key]
+        task.add_done_callback(finished)
+        return task
+
+    async def run(self, key: Hashable, coroutine_function: Callable[[], Awaitable]) -> Any:
+        """ Return the result of coroutine_function(), or of an identical request that is already in progress. """
+        task = self.get(key)
+        if task is None:
+            task = self.start([key], coroutine_function())
+        return await self.wait(task)
+
+    async def wait(self, task: asyncio.Task) -> Any:
+        """ Wait for a task from start(), cancelling it if every request waiting for it is cancelled. """
+        self.waiters[task] = self.waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self.waiters[task] == 1 and not task.done():
+                task.cancel()
+                self.cancelled += 1
+            raise
+        finally:
+            self.waiters[task] -= 1
+            if self.waiters[task] == 0:
+                del self.waiters[task]
+
+    def detach(self):
+        """ Stop handing the tasks in progress to new requests. Requests already waiting for them are unaffected. """
+        self.in_flight.clear()
+
+    def stats(self) -> Dict:
+        return {
+            'in_flight': len(set(self.in_flight.values())),
+            'started': self.started,
+            'coalesced': self.coalesced,
+            'cancelled': self.cancelled,
+        }
+
+
+def invalidate_caches(previous: Optional[Dict], current: Dict):
+    """
+    Clear every cache when the search index changes. This is subscribed to the index status poller (see
+    api/index_status.py), which calls it with the previous and current index status.
+    """
+    if previous is None:
+        # This is the first index we've seen, so nothing has been cached from a different one.
+        return
+    LOGGER.info("Search index changed, clearing %d caches.", len(CACHES))
+    for cache in CACHES:
+        cache.clear()
+    for single_flight in SINGLE_FLIGHTS:
+        single_flight.detach()
+
+
+def cache_stats() -> Dict[str, Dict]:
+    """ Return statistics on every registered cache, keyed by cache name. """
+    return {cache.name: cache.stats() for cache in CACHES}
+
+
+def single_flight_stats() -> Dict[str, Dict]:
+    """ Return statistics on every SingleFlight, keyed by name. """
+    return {single_flight.name: single_flight.stats() for single_flight in SINGLE_FLIGHTS}
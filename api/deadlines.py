@@ -0,0 +1,93 @@
+"""
+Request deadlines for NameRes.
+
+Every request to a lookup endpoint gets a deadline (configured per endpoint), which is stored in a context variable so
+that it is shared by every task working on that request. The Solr client never waits longer than the time remaining
+(for a connection, a place in the queue or a response), Solr is told to give up at the same time with `timeAllowed`,
+and no new Solr requests are sent once the deadline has passed. A request that misses its deadline gets an
+HTTP 504 response, rather than every client waiting until it times out when Solr slows down.
+"""
+import asyncio
+import contextvars
+import logging
+import os
+import time
+from typing import Optional
+
+from .metrics import DEADLINES_EXCEEDED
+
+LOGGER = logging.getLogger(__name__)
+
+# The deadline (in seconds) for requests to each endpoint. Set a deadline to 0 to turn it off. /reverse_lookup is the
+# older form of /synonyms, so it has the same deadline unless REVERSE_LOOKUP_DEADLINE is set.
+SYNONYMS_DEADLINE = os.getenv("SYNONYMS_DEADLINE", "30")
+REQUEST_DEADLINES = {
+    '/lookup': float(os.getenv("LOOKUP_DEADLINE", "10")),
+    '/bulk-lookup': float(os.getenv("BULK_LOOKUP_DEADLINE", "60")),
+    '/synonyms': float(SYNONYMS_DEADLINE),
+    '/reverse_lookup': float(os.getenv("REVERSE_LOOKUP_DEADLINE", SYNONYMS_DEADLINE)),
+}
+
+# How long (in seconds) to give a request after its deadline to report the error itself (e.g. a bulk lookup
+# returning the results it has), before DeadlineMiddleware cancels it.
+DEADLINE_GRACE = 0.5
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar('deadline', default=None)
+
+
+class DeadlineExceeded(Exception):
+    """ Raised when the deadline for the current request has passed. """
+
+
+def remaining() -> Optional[float]:
+    """ The number of seconds until the deadline for the current request, or None if it doesn't have one. """
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def check_deadline():
+    """ Raise DeadlineExceeded if the deadline for the current request has passed. """
+    time_remaining = remaining()
+    if time_remaining is not None and time_remaining <= 0:
+        raise DeadlineExceeded("The deadline for this request has passed.")
+
+
+class DeadlineMiddleware:
+    """
+    ASGI middleware that sets the deadline for requests to the lookup endpoints, and responds with HTTP 504 if a
+    request misses its deadline.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        deadline = REQUEST_DEADLINES.get(scope['path']) if scope['type'] == 'http' else None
+        if not deadline:
+            await self.app(scope, receive, send)
+            return
+
+        response_started = False
+
+        async def send_wrapper(message):
+            nonlocal response_started
+            if message['type'] == 'http.response.start':
+                response_started = True
+            await send(message)
+
+        token = _deadline.set(time.monotonic() + deadline)
+        try:
+            await asyncio.wait_for(self.app(scope, receive, send_wrapper), deadline + DEADLINE_GRACE)
+        except (asyncio.TimeoutError, DeadlineExceeded):
+            DEADLINES_EXCEEDED.labels(scope['path']).inc()
+            if response_started:
+                raise
+            LOGGER.warning("Request to %s did not finish within its deadline of %.1f seconds.", scope['path'], deadline)
+            await send({'type': 'http.response.start', 'status': 504,
+                        'headers': [(b'content-type', b'application/json')]})
+            await send({'type': 'http.response.body',
+                        'body': b'{"detail":"The request did not finish within its deadline."}'})
+        finally:
+            _deadline.reset(token)
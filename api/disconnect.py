@@ -0,0 +1,81 @@
+"""
+Cancelling lookups when the client disconnects.
+
+Autocomplete clients drop requests all the time, since each keystroke replaces the previous request. Starlette keeps
+running a handler until it returns even if the client has gone away, so we would wait for Solr, parse its response
+and build results that nobody will read. CancelOnDisconnectMiddleware listens for the client disconnecting while a
+lookup is in progress, and cancels the handler: this cancels any outstanding Solr requests (returning their
+connections to the pool), and stops a bulk lookup from sending any more queries.
+
+Lookups that are shared with identical requests (see SingleFlight in api/cache.py) are only cancelled once every
+request waiting for them has gone.
+"""
+import asyncio
+import logging
+
+from .metrics import CANCELLED_REQUESTS
+
+LOGGER = logging.getLogger(__name__)
+
+# The paths whose handlers are cancelled when the client disconnects.
+CANCELLABLE_PATHS = {'/lookup', '/bulk-lookup'}
+
+# The status code we record for requests that were cancelled (following nginx's "client closed request").
+CLIENT_CLOSED_REQUEST = 499
+
+
+class CancelOnDisconnectMiddleware:
+    """
+    ASGI middleware that cancels requests to the lookup endpoints if the client disconnects before they are answered.
+
+    This should be the innermost middleware, so that the other middleware see the 499 response we send in place of
+    the cancelled one.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] not in CANCELLABLE_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        # We read every message from the client ourselves, and pass the request body on to the application.
+        messages = asyncio.Queue()
+        response_started = False
+        disconnected = False
+
+        async def send_wrapper(message):
+            nonlocal response_started
+            if message['type'] == 'http.response.start':
+                response_started = True
+            await send(message)
+
+        app_task = asyncio.create_task(self.app(scope, messages.get, send_wrapper))
+
+        async def listen_for_disconnect():
+            nonlocal disconnected
+            while True:
+                message = await receive()
+                await messages.put(message)
+                if message['type'] == 'http.disconnect':
+                    if not response_started:
+                        disconnected = True
+                        app_task.cancel()
+                    return
+
+        listener = asyncio.create_task(listen_for_disconnect())
+        try:
+            await app_task
+        except asyncio.CancelledError:
+            if not disconnected:
+                raise
+            CANCELLED_REQUESTS.labels(scope['path']).inc()
+            LOGGER.debug("Cancelled %s after the client disconnected.", scope['path'])
+            # Nobody will receive this, but it lets the outer middleware record what happened to the request.
+            await send({'type': 'http.response.start', 'status': CLIENT_CLOSED_REQUEST, 'headers': []})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            listener.cancel()
+            # If we were cancelled ourselves (e.g. because the server is shutting down), so is the application.
+            app_task.cancel()
@@ -0,0 +1,312 @@
+"""
+A memory-mapped table of exact name matches.
+
+Much of the traffic to /lookup comes from entity linkers, which look up complete names (autocomplete=false) that
+exactly match a name or preferred name in Babel. This module builds a table from the Babel synonym files that maps a
+hash of every lowercased name to the documents with that name, ranked by an approximation of the search backend's
+scoring (see exact_match_score()). lookup() can then answer these queries from the table without running a search.
+
+The table is a single read-only file that is memory-mapped, so the operating system shares one copy of it between
+every worker process on a machine. It is laid out as:
+- A header: MAGIC, the format version, the length of the metadata, the number of names, and the offsets of each of
+  the following sections.
+- The metadata, as JSON: the collection and Babel version that the table was built for, if they were given.
+- The 64-bit hashes of every name, sorted so that they can be binary-searched.
+- For every hash, the offset of its entry.
+- The entries: the number of documents with that name, followed by the offset and score of each document in
+  ranked order.
+- The documents: the length of each document, followed by the document as JSON.
+
+A table only gives the same results as the search backend while the backend is serving the index it was built from,
+so the table is only used while the collection and Babel version reported by the index status poller match its
+metadata (see check_index()).
+
+To build a table:
+    python -m api.exact_match exact-match.bin "data/synonyms/*.txt" --collection name_lookup_2025sep1 \
+        --babel-version 2025sep1
+"""
+import argparse
+import bisect
+import hashlib
+import json
+import logging
+import math
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import time
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+from .backends.memory import QUERY_FIELD_BOOSTS, PHRASE_FIELD_BOOSTS, read_synonym_file, synonym_file_paths, \
+    tokenize
+
+LOGGER = logging.getLogger(__name__)
+
+MAGIC = b'NREXACT1'
+VERSION = 2
+
+# MAGIC, version, metadata length, number of names, and the offsets of the hash, entry offset, entry and document
+# sections.
+HEADER = struct.Struct('<8sIIQQQQQ')
+# The number of documents in an entry.
+ENTRY_COUNT = struct.Struct('<I')
+# The offset (from the start of the document section) and score of a document in an entry.
+ENTRY_DOC = struct.Struct('<Qd')
+# The length of a document.
+DOC_LENGTH = struct.Struct('<I')
+# A name as recorded while building: its hash, the sort key of the document (score, number of synonyms,
+# clique_identifier_count, curie_suffix and load order), and the document offset.
+BUILD_RECORD = struct.Struct('<QdqqqQQ')
+
+# The number of temporary bucket files to sort names into while building a table, by the top bits of their hashes.
+BUILD_BUCKET_BITS = 8
+
+# The fields that we store for each document.
+DOC_FIELDS = ['curie', 'preferred_name', 'names', 'types', 'taxa', 'clique_identifier_count']
+
+# The fields of the index status (see api/index_status.py) that must match the table's metadata for it to be used.
+INDEX_FIELDS = ['collection', 'babel_version']
+
+
+def name_hash(name_lc: str) -> int:
+    """ Return the 64-bit hash of a lowercased name. """
+    return int.from_bytes(hashlib.blake2b(name_lc.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def exact_match_score(in_preferred_name: bool, in_names: bool, token_count: int, clique_identifier_count: int) -> float:
+    """
+    Return a score for a document whose preferred name and/or synonyms exactly match a query.
+
+    This uses the exactish field boosts from the edismax query (the whole query matches a single field, and the
+    phrase boosts only apply to queries with more than one token) and the same clique_identifier_count boost. This
+    matches the ranking of the in-memory backend (see tests/test_exact_match.py), but it is only an approximation of
+    Solr's: Solr scores each field with BM25 and per-document length norms, and its token fields and phrase boosts
+    also score documents that don't match the name exactly, so a partial match with a high clique_identifier_count
+    can outrank the exact matches (and will never be returned from the table). The scores are not Solr's either.
+    """
+    score = QUERY_FIELD_BOOSTS['preferred_name_exactish'] if in_preferred_name else QUERY_FIELD_BOOSTS['names_exactish']
+    if token_count > 1:
+        if in_preferred_name:
+            score += PHRASE_FIELD_BOOSTS['preferred_name_exactish']
+        if in_names:
+            score += PHRASE_FIELD_BOOSTS['names_exactish']
+    return score * math.log10(clique_identifier_count + 1)
+
+
+class ExactMatchTable:
+    """ A memory-mapped exact match table built by build_table(). """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, metadata_length, self.name_count, hashes_offset, entry_offsets_offset, self.entries_offset, \
+            self.docs_offset = HEADER.unpack_from(self.mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} exact match table.")
+        self.metadata = json.loads(self.mmap[HEADER.size:HEADER.size + metadata_length])
+        # A table that records which index it was built for isn't used until we've checked that index is being served.
+        self.index_metadata = {field: self.metadata[field] for field in INDEX_FIELDS if self.metadata.get(field)}
+        self.enabled = not self.index_metadata
+        self.hashes = memoryview(self.mmap)[hashes_offset:hashes_offset + 8 * self.name_count].cast('Q')
+        self.entry_offsets = memoryview(self.mmap)[
+            entry_offsets_offset:entry_offsets_offset + 8 * self.name_count].cast('Q')
+
+    def lookup(self, name_lc: str) -> Optional[List[Tuple[Dict, float]]]:
+        """
+        Return the documents with this lowercased name and their scores in ranked order, or None if there aren't any.
+        """
+        hash_value = name_hash(name_lc)
+        index = bisect.bisect_left(self.hashes, hash_value)
+        if index == len(self.hashes) or self.hashes[index] != hash_value:
+            return None
+
+        position = self.entries_offset + self.entry_offsets[index]
+        (count,) = ENTRY_COUNT.unpack_from(self.mmap, position)
+        position += ENTRY_COUNT.size
+        results = []
+        for _ in range(count):
+            doc_offset, score = ENTRY_DOC.unpack_from(self.mmap, position)
+            position += ENTRY_DOC.size
+            results.append((self.read_doc(doc_offset), score))
+
+        # A different name might have the same hash, so we check that we've found the right one.
+        results = [
+            (doc, score) for doc, score in results
+            if doc['preferred_name'].lower() == name_lc or name_lc in (name.lower() for name in doc['names'])
+        ]
+        return results or None
+
+    def check_index(self, previous: Optional[Dict], current: Dict):
+        """
+        Only use this table while the search index is the one it was built for. This is subscribed to the index
+        status poller (see api/index_status.py), which calls it with the previous and current index status.
+        """
+        mismatches = [f"{field} {current.get(field)} (expected {value})"
+                      for field, value in self.index_metadata.items() if current.get(field) != value]
+        enabled = not mismatches
+        if enabled != self.enabled:
+            if enabled:
+                LOGGER.info("The search index matches the exact match table at %s, so it will be used.", self.path)
+            else:
+                LOGGER.warning("Not using the exact match table at %s, since the search index has %s.", self.path,
+                               ', '.join(mismatches))
+        self.enabled = enabled
+
+    def read_doc(self, doc_offset: int) -> Dict:
+        position = self.docs_offset + doc_offset
+        (length,) = DOC_LENGTH.unpack_from(self.mmap, position)
+        position += DOC_LENGTH.size
+        return json.loads(self.mmap[position:position + length])
+
+    def close(self):
+        self.hashes.release()
+        self.entry_offsets.release()
+        self.mmap.close()
+
+
+def build_table(output_path: str, synonym_files: List[str], metadata: Optional[Dict] = None):
+    """
+    Build an exact match table from a list of synonym files. The metadata should record the collection and Babel
+    version that the table will be used with (see INDEX_FIELDS).
+
+    Names are first written to temporary bucket files by the top bits of their hashes, so that each bucket can be
+    sorted in memory and the whole table never needs to be.
+    """
+    start = time.perf_counter()
+    bucket_count = 1 << BUILD_BUCKET_BITS
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(output_path))) as tempdir:
+        docs_path = os.path.join(tempdir, 'docs')
+        buckets = [open(os.path.join(tempdir, f'bucket-{i}'), 'wb') for i in range(bucket_count)]
+        doc_count = 0
+        with open(docs_path, 'wb') as docs_file:
+            doc_offset = 0
+            for path in synonym_files:
+                for record in read_synonym_file(path):
+                    doc = {field: record.get(field) for field in DOC_FIELDS}
+                    doc['id'] = record['curie']
+                    doc['names'] = doc['names'] or []
+                    doc['preferred_name'] = doc['preferred_name'] or ''
+                    doc['types'] = doc['types'] or []
+                    doc['taxa'] = doc['taxa'] or []
+                    doc['clique_identifier_count'] = doc['clique_identifier_count'] or 0
+                    doc_json = json.dumps(doc, separators=(',', ':')).encode('utf-8')
+                    docs_file.write(DOC_LENGTH.pack(len(doc_json)))
+                    docs_file.write(doc_json)
+
+                    preferred_name_lc = doc['preferred_name'].lower()
+                    names_lc = {name.lower() for name in doc['names']}
+                    curie_suffix = record.get('curie_suffix')
+                    for name_lc in names_lc | ({preferred_name_lc} if preferred_name_lc else set()):
+                        score = exact_match_score(name_lc == preferred_name_lc, name_lc in names_lc,
+                                                  len(tokenize(name_lc)), doc['clique_identifier_count'])
+                        hash_value = name_hash(name_lc)
+                        buckets[hash_value >> (64 - BUILD_BUCKET_BITS)].write(BUILD_RECORD.pack(
+                            hash_value,
+                            score,
+                            len(names_lc),
+                            doc['clique_identifier_count'],
+                            # Documents without a curie_suffix are sorted last.
+                            curie_suffix if curie_suffix is not None else 2 ** 63 - 1,
+                            doc_count,
+                            doc_offset,
+                        ))
+                    doc_offset += DOC_LENGTH.size + len(doc_json)
+                    doc_count += 1
+        for bucket in buckets:
+            bucket.close()
+        LOGGER.info("Wrote %d documents in %.1f seconds.", doc_count, time.perf_counter() - start)
+
+        # Sort each bucket and write out its hashes and entries.
+        hashes_path = os.path.join(tempdir, 'hashes')
+        entry_offsets_path = os.path.join(tempdir, 'entry_offsets')
+        entries_path = os.path.join(tempdir, 'entries')
+        name_count = 0
+        with open(hashes_path, 'wb') as hashes_file, open(entry_offsets_path, 'wb') as entry_offsets_file, \
+                open(entries_path, 'wb') as entries_file:
+            entry_offset = 0
+            for i in range(bucket_count):
+                bucket_path = os.path.join(tempdir, f'bucket-{i}')
+                with open(bucket_path, 'rb') as bucket:
+                    records = list(BUILD_RECORD.iter_unpack(bucket.read()))
+                os.remove(bucket_path)
+
+                # The ranking of the in-memory backend: score, then clique_identifier_count, then curie_suffix (and
+                # then the order in which the documents were loaded). Where the scores are equal, documents with fewer
+                # synonyms come first, since the search backends normalize scores by field length.
+                records.sort(key=lambda r: (r[0], -r[1], r[2], -r[3], r[4], r[5]))
+                hashes = array('Q')
+                entry_offsets = array('Q')
+                record_index = 0
+                while record_index < len(records):
+                    hash_value = records[record_index][0]
+                    end = record_index
+                    while end < len(records) and records[end][0] == hash_value:
+                        end += 1
+                    hashes.append(hash_value)
+                    entry_offsets.append(entry_offset)
+                    entry = ENTRY_COUNT.pack(end - record_index) + b''.join(
+                        ENTRY_DOC.pack(r[6], r[1]) for r in records[record_index:end])
+                    entries_file.write(entry)
+                    entry_offset += len(entry)
+                    record_index = end
+                hashes.tofile(hashes_file)
+                entry_offsets.tofile(entry_offsets_file)
+                name_count += len(hashes)
+
+        # Assemble the table.
+        metadata_json = json.dumps(metadata or {}).encode('utf-8')
+        hashes_offset = HEADER.size + len(metadata_json)
+        entry_offsets_offset = hashes_offset + 8 * name_count
+        entries_offset = entry_offsets_offset + 8 * name_count
+        docs_offset = entries_offset + os.path.getsize(entries_path)
+        temp_output_path = os.path.join(tempdir, 'table')
+        with open(temp_output_path, 'wb') as output:
+            output.write(HEADER.pack(MAGIC, VERSION, len(metadata_json), name_count, hashes_offset,
+                                     entry_offsets_offset, entries_offset, docs_offset))
+            output.write(metadata_json)
+            for path in (hashes_path, entry_offsets_path, entries_path, docs_path):
+                with open(path, 'rb') as f:
+                    shutil.copyfileobj(f, output)
+        os.replace(temp_output_path, output_path)
+
+    LOGGER.info("Built an exact match table of %d names and %d documents at %s in %.1f seconds.", name_count,
+                doc_count, output_path, time.perf_counter() - start)
+
+
+def open_table(path: str) -> Optional[ExactMatchTable]:
+    """ Open the exact match table at this path, or return None if no path is set. """
+    if not path:
+        return None
+    table = ExactMatchTable(path)
+    LOGGER.info("Using the exact match table at %s (%d names).", path, table.name_count)
+    if not table.index_metadata:
+        LOGGER.warning("The exact match table at %s doesn't record the collection or Babel version it was built for, "
+                       "so it will be used with any search index.", path)
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build an exact match table from Babel synonym files.")
+    parser.add_argument('output', help="The table file to write.")
+    parser.add_argument('synonym_files', nargs='+',
+                        help="Synonym files (or glob patterns) in JSON Lines format, or JSON arrays of the same "
+                             "records. These may be gzipped.")
+    parser.add_argument('--collection',
+                        help="The Solr collection that the synonym files were loaded into (e.g. name_lookup_2025sep1). "
+                             "The table will only be used while NameRes is serving this collection.")
+    parser.add_argument('--babel-version',
+                        help="The Babel version that the synonym files are from (e.g. 2025sep1). The table will only "
+                             "be used while NameRes is serving an index of this version.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    metadata = {'collection': args.collection, 'babel_version': args.babel_version}
+    build_table(args.output, synonym_file_paths(','.join(args.synonym_files)), metadata)
+
+
+if __name__ == '__main__':
+    main()
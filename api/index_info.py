@@ -0,0 +1,62 @@
+"""
+The search index that NameRes is currently serving results from.
+
+With Solr, `name_lookup` may be an alias that is switched from one versioned collection to another (see
+solr-restore/swap-collection.sh), so we record the collection and Babel version whenever the index status poller
+sees a new index, and report them on every response in the X-NameRes-Collection and X-Babel-Version headers.
+
+Since these are only updated when the poller next runs, the headers can name the previous collection for up to
+STATUS_POLL_INTERVAL seconds after the alias is switched.
+"""
+import os
+from typing import Dict, Optional
+
+# The Babel version and version URL that this instance was deployed with. A versioned collection knows its own Babel
+# version, which takes precedence over these.
+BABEL_VERSION = os.getenv("BABEL_VERSION", "unknown")
+BABEL_VERSION_URL = os.getenv("BABEL_VERSION_URL", "")
+
+_current_index = {
+    'collection': None,
+    'babel_version': BABEL_VERSION,
+}
+
+
+def update_index_info(collection: Optional[str], babel_version: Optional[str]) -> Dict:
+    """ Record the collection we are serving results from and its Babel version, and return them. """
+    _current_index['collection'] = collection
+    _current_index['babel_version'] = babel_version or BABEL_VERSION
+    return dict(_current_index)
+
+
+def record_index_info(previous: Optional[Dict], current: Dict):
+    """ Record the collection and Babel version of a new index (subscribed to the index status poller). """
+    update_index_info(current.get('collection'), current.get('babel_version'))
+
+
+def current_index_info() -> Dict:
+    """ Return the collection and Babel version that we last saw. """
+    return dict(_current_index)
+
+
+class IndexHeadersMiddleware:
+    """ ASGI middleware that adds the current collection and Babel version to the headers of every response. """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                headers = list(message.get('headers', []))
+                if _current_index['collection']:
+                    headers.append((b'x-nameres-collection', _current_index['collection'].encode('latin-1')))
+                headers.append((b'x-babel-version', _current_index['babel_version'].encode('latin-1')))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
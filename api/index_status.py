@@ -0,0 +1,158 @@
+"""
+Background polling of the search index status.
+
+Checking the status of a Solr core means walking its index metadata, and Kubernetes probes and dashboards call
+/status constantly. So instead of asking Solr on every request, a background task polls the index status every
+STATUS_POLL_INTERVAL seconds, and /status reports the latest result (along with how old it is) from memory. If the
+last poll failed, or there hasn't been one for STATUS_MAX_AGE_INTERVALS intervals, /status reports it as degraded.
+
+Whenever the poller sees a different index -- a different collection, Babel version, index version or number of
+documents -- it calls every subscriber with the previous and current index status, so that e.g. caches can be cleared
+and warmed up again. Subscribers are also called the first time the index is seen, with `previous` set to None.
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+from .backends import get_backend
+
+LOGGER = logging.getLogger(__name__)
+
+# How often (in seconds) to poll the index status. If this is zero, the index status is checked on every /status
+# request instead. (INDEX_VERSION_CHECK_INTERVAL is the older name for this setting.)
+STATUS_POLL_INTERVAL = float(os.getenv("STATUS_POLL_INTERVAL", os.getenv("INDEX_VERSION_CHECK_INTERVAL", "60")))
+
+# /status reports a degraded status if the index status hasn't been updated for this many polling intervals.
+STATUS_MAX_AGE_INTERVALS = float(os.getenv("STATUS_MAX_AGE_INTERVALS", "3"))
+
+# The fields of the index status that identify a particular version of the index.
+INDEX_VERSION_FIELDS = ('collection', 'babel_version', 'version', 'numDocs')
+
+# A subscriber is called with the previous index status (or None) and the current one.
+IndexChangeCallback = Callable[[Optional[Dict], Dict], None]
+
+
+def index_version(index: Dict) -> tuple:
+    """ Return the values that identify the version of the index described by an index status. """
+    return tuple(index.get(field) for field in INDEX_VERSION_FIELDS)
+
+
+class IndexStatusPoller:
+    """ Polls the search backend for the index status, and tells subscribers when the index changes. """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.subscribers: List[IndexChangeCallback] = []
+        self.task: Optional[asyncio.Task] = None
+
+        # The latest index status (None if the index wasn't found), and when we got it.
+        self.index: Optional[Dict] = None
+        self.checked_at: Optional[float] = None
+        self.checked_at_time: Optional[datetime] = None
+        # The last index we saw, which may be older than self.index if the index has since gone missing.
+        self.last_seen: Optional[Dict] = None
+
+        self.polls = 0
+        self.errors = 0
+        self.changes = 0
+        self.last_error: Optional[str] = None
+
+    def subscribe(self, callback: IndexChangeCallback):
+        """ Call this function whenever the index changes. """
+        self.subscribers.append(callback)
+
+    async def poll(self):
+        """ Get the index status from the search backend, and tell our subscribers if the index has changed. """
+        try:
+            backend = await get_backend()
+            index = await backend.index_status()
+        except Exception as err:
+            self.errors += 1
+            self.last_error = str(err) or type(err).__name__
+            LOGGER.warning("Could not get the search index status: %s", self.last_error)
+            return
+
+        self.polls += 1
+        self.last_error = None
+        self.index = index
+        self.checked_at = time.monotonic()
+        self.checked_at_time = datetime.now(timezone.utc)
+        if index is None:
+            return
+
+        previous = self.last_seen
+        self.last_seen = index
+        if previous is not None and index_version(previous) == index_version(index):
+            return
+        if previous is not None:
+            self.changes += 1
+            LOGGER.info("Search index changed from %s to %s.", index_version(previous), index_version(index))
+        for callback in self.subscribers:
+            try:
+                callback(previous, index)
+            except Exception:
+                LOGGER.exception("Index change subscriber %s failed.", callback)
+
+    async def latest(self) -> Optional[Dict]:
+        """
+        Return the latest index status. If we aren't polling in the background (e.g. if the polling interval is zero
+        or the application hasn't been started up), this checks the index status itself when it is out of date.
+        """
+        if self.task is None and (self.checked_at is None or self.age() >= self.interval):
+            await self.poll()
+        return self.index
+
+    def age(self) -> Optional[float]:
+        """ How long ago (in seconds) we last got the index status. """
+        if self.checked_at is None:
+            return None
+        return time.monotonic() - self.checked_at
+
+    def degraded(self) -> Optional[str]:
+        """
+        Return the reason that the latest index status can't be trusted to be current and complete -- because the
+        last poll failed, we haven't managed to poll for several intervals, or some shards couldn't be reached -- or
+        None if it can be.
+        """
+        if self.last_error is not None:
+            return f"The last index status check failed: {self.last_error}"
+        if self.index and self.index.get('missing_shards'):
+            return f"No replica of {', '.join(self.index['missing_shards'])} could be reached, so the document " \
+                   f"counts leave them out."
+        age = self.age()
+        if self.interval > 0 and age is not None and age > STATUS_MAX_AGE_INTERVALS * self.interval:
+            return f"The index status was last checked {age:.0f} seconds ago."
+        return None
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.poll()
+
+    def start(self):
+        """ Start polling in the background (unless the polling interval is zero). """
+        if self.interval > 0 and self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def stats(self) -> Dict:
+        age = self.age()
+        return {
+            'interval': self.interval,
+            'age': round(age, 3) if age is not None else None,
+            'checked_at': self.checked_at_time.isoformat() if self.checked_at_time else None,
+            'polls': self.polls,
+            'errors': self.errors,
+            'changes': self.changes,
+            'last_error': self.last_error,
+        }
+
+
+INDEX_STATUS = IndexStatusPoller(STATUS_POLL_INTERVAL)
@@ -0,0 +1,196 @@
+"""
+Prometheus metrics for NameRes.
+
+These are served in the Prometheus text format from the /metrics endpoint. They include:
+- Request counts and latency histograms for every endpoint (recorded by PrometheusMiddleware).
+- The time spent in each stage of lookup(), the query time reported by Solr and the number of results returned.
+- Gauges and counters for the shared Solr client (and each of its Solr nodes), for every in-process cache and for
+  the number of requests that were coalesced with identical requests, which are read when the metrics are collected.
+"""
+import time
+from typing import Callable, Dict, Optional
+
+from prometheus_client import Counter, Histogram, REGISTRY
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from .profiling import record_stage
+
+# Latency buckets (in seconds), from sub-millisecond cache hits up to very slow Solr queries.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+REQUEST_COUNT = Counter(
+    'nameres_requests_total',
+    'Number of HTTP requests handled by NameRes.',
+    ['method', 'endpoint', 'status'],
+)
+REQUEST_LATENCY = Histogram(
+    'nameres_request_duration_seconds',
+    'Time taken to handle an HTTP request.',
+    ['method', 'endpoint'],
+    buckets=LATENCY_BUCKETS,
+)
+LOOKUP_STAGE_LATENCY = Histogram(
+    'nameres_lookup_stage_duration_seconds',
+    'Time spent in each stage of a lookup: query construction, the Solr round-trip, JSON decoding and '
+    'result building.',
+    ['stage'],
+    buckets=LATENCY_BUCKETS,
+)
+SOLR_QTIME = Histogram(
+    'nameres_solr_qtime_seconds',
+    'Query time reported by Solr (QTime) for lookup queries.',
+    buckets=LATENCY_BUCKETS,
+)
+LOOKUP_RESULTS = Histogram(
+    'nameres_lookup_results',
+    'Number of results returned by a lookup.',
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+)
+
+EXACT_MATCH_LOOKUPS = Counter(
+    'nameres_exact_match_lookups_total',
+    'Lookups checked against the exact match table, by whether they were answered from it (hit), had no exact '
+    'matches (miss) or had too few exact matches to fill the requested page (incomplete).',
+    ['result'],
+)
+
+CANCELLED_REQUESTS = Counter(
+    'nameres_cancelled_requests_total',
+    'Requests that were cancelled because the client disconnected before they were answered.',
+    ['endpoint'],
+)
+
+DEADLINES_EXCEEDED = Counter(
+    'nameres_deadlines_exceeded_total',
+    'Requests that did not finish within their deadline.',
+    ['endpoint'],
+)
+
+
+def observe_lookup_stage(stage: str, start: float) -> float:
+    """
+    Record the time spent in a stage of lookup(), both in Prometheus and in the timing for the current request.
+
+    :param stage: The name of the stage.
+    :param start: The time.perf_counter() value at the start of the stage.
+    :return: The current time.perf_counter() value, which can be used as the start of the next stage.
+    """
+    now = time.perf_counter()
+    LOOKUP_STAGE_LATENCY.labels(stage).observe(now - start)
+    record_stage(stage, now - start)
+    return now
+
+
+class PrometheusMiddleware:
+    """
+    ASGI middleware that counts HTTP requests and records their latency, labelled by the path of the matched route
+    (e.g. `/lookup`) rather than the requested URL, so that the number of label values stays small.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get('route')
+            endpoint = getattr(route, 'path', 'unmatched')
+            method = scope.get('method', '')
+            REQUEST_COUNT.labels(method, endpoint, str(status_code)).inc()
+            REQUEST_LATENCY.labels(method, endpoint).observe(time.perf_counter() - start)
+
+
+class StatsCollector:
+    """
+    A Prometheus collector that reports statistics from the Solr client, the in-process caches and request
+    coalescing.
+
+    These statistics are kept by the components themselves, so we read them when the metrics are collected rather
+    than updating Prometheus gauges on every request.
+    """
+
+    def __init__(self, solr_client_stats: Callable[[], Optional[Dict]], cache_stats: Callable[[], Dict[str, Dict]],
+                 single_flight_stats: Callable[[], Dict[str, Dict]]):
+        self.solr_client_stats = solr_client_stats
+        self.cache_stats = cache_stats
+        self.single_flight_stats = single_flight_stats
+
+    def collect(self):
+        solr_stats = self.solr_client_stats()
+        if solr_stats is not None:
+            connections = GaugeMetricFamily('nameres_solr_connections', 'Connections to Solr in the connection pool.',
+                                            labels=['state'])
+            connections.add_metric(['idle'], solr_stats['idle_connections'])
+            connections.add_metric(['active'], solr_stats['connections'] - solr_stats['idle_connections'])
+            yield connections
+            yield GaugeMetricFamily('nameres_solr_requests_in_flight', 'Solr requests currently in progress.',
+                                    value=solr_stats['in_flight'])
+            yield CounterMetricFamily('nameres_solr_requests', 'Requests sent to Solr.', value=solr_stats['requests'])
+            yield CounterMetricFamily('nameres_solr_retries', 'Solr requests that were retried.',
+                                      value=solr_stats['retries'])
+            errors = CounterMetricFamily('nameres_solr_errors', 'Solr requests that failed.', labels=['type'])
+            errors.add_metric(['transport'], solr_stats['errors'])
+            errors.add_metric(['http'], solr_stats['http_errors'])
+            yield errors
+            hedges = CounterMetricFamily('nameres_solr_hedged_requests',
+                                         'Solr searches that were also sent to a second node (sent), those where the '
+                                         'second node answered first (won), and those that were not hedged because '
+                                         'Solr was at SOLR_MAX_CONCURRENT_REQUESTS (skipped).', labels=['result'])
+            hedges.add_metric(['sent'], solr_stats['hedged_requests'])
+            hedges.add_metric(['won'], solr_stats['hedges_won'])
+            hedges.add_metric(['skipped'], solr_stats['hedges_skipped'])
+            yield hedges
+            yield GaugeMetricFamily('nameres_solr_requests_queued', 'Solr requests waiting for one of the '
+                                    'SOLR_MAX_CONCURRENT_REQUESTS slots.', value=solr_stats['queued'])
+            yield CounterMetricFamily('nameres_solr_requests_shed', 'Solr requests that were rejected because the '
+                                      'queue was full.', value=solr_stats['shed'])
+            healthy = GaugeMetricFamily('nameres_solr_endpoint_healthy', 'Whether a Solr node passed its last health '
+                                        'check.', labels=['endpoint'])
+            outstanding = GaugeMetricFamily('nameres_solr_endpoint_outstanding', 'Requests in progress on a Solr node.',
+                                            labels=['endpoint'])
+            for endpoint in solr_stats['endpoints']:
+                healthy.add_metric([endpoint['base_url']], 1 if endpoint['healthy'] else 0)
+                outstanding.add_metric([endpoint['base_url']], endpoint['outstanding'])
+            yield healthy
+            yield outstanding
+
+        entries = GaugeMetricFamily('nameres_cache_entries', 'Entries in an in-process cache.', labels=['cache'])
+        hits = CounterMetricFamily('nameres_cache_hits', 'In-process cache hits.', labels=['cache'])
+        misses = CounterMetricFamily('nameres_cache_misses', 'In-process cache misses.', labels=['cache'])
+        evictions = CounterMetricFamily('nameres_cache_evictions', 'In-process cache evictions.', labels=['cache'])
+        for name, stats in self.cache_stats().items():
+            entries.add_metric([name], stats['size'])
+            hits.add_metric([name], stats['hits'])
+            misses.add_metric([name], stats['misses'])
+            evictions.add_metric([name], stats['evictions'])
+        yield entries
+        yield hits
+        yield misses
+        yield evictions
+
+        coalesced = CounterMetricFamily('nameres_coalesced_requests', 'Requests that waited for an identical request '
+                                        'that was already in progress.', labels=['type'])
+        for name, stats in self.single_flight_stats().items():
+            coalesced.add_metric([name], stats['coalesced'])
+        yield coalesced
+
+
+def register_stats_collector(solr_client_stats: Callable[[], Optional[Dict]],
+                             cache_stats: Callable[[], Dict[str, Dict]],
+                             single_flight_stats: Callable[[], Dict[str, Dict]]):
+    """ Register a StatsCollector with the default Prometheus registry. """
+    REGISTRY.register(StatsCollector(solr_client_stats, cache_stats, single_flight_stats))
@@ -0,0 +1,225 @@
+"""
+Per-request timing and debugging for NameRes.
+
+Every request to a lookup endpoint gets a RequestTiming object (stored in a context variable, so that it is shared
+by every task working on that request). The lookup code records how long it spends in each stage, and
+ServerTimingMiddleware reports those stages in a `Server-Timing` response header.
+
+If the NAMERES_DEBUG_TOKEN environmental variable is set, a client that sends the same token in an
+`X-NameRes-Debug` header will get a debug report along with its results: the queries sent to Solr, the query time
+Solr reported for each one, and a sampled profile of the Python stacks that ran while the request was being handled.
+Only one request can be profiled at a time, so this can be left enabled in production.
+"""
+import contextvars
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+# The token that clients need to send in the X-NameRes-Debug header to get a debug report. Debugging is turned
+# off if this isn't set.
+NAMERES_DEBUG_TOKEN = os.getenv("NAMERES_DEBUG_TOKEN", "")
+
+# How often (in seconds) the profiler should sample the Python stack, and how many stacks to report.
+NAMERES_PROFILE_INTERVAL = float(os.getenv("NAMERES_PROFILE_INTERVAL", "0.005"))
+NAMERES_PROFILE_TOP_STACKS = int(os.getenv("NAMERES_PROFILE_TOP_STACKS", "20"))
+
+# The paths that we report timings for.
+TIMED_PATHS = {'/lookup', '/bulk-lookup', '/synonyms'}
+
+DEBUG_HEADER = b'x-nameres-debug'
+
+
+class RequestTiming:
+    """ The time spent in each stage of a single request, and (if debugging) the Solr queries it made. """
+
+    def __init__(self, debug: bool = False):
+        self.start = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.debug = debug
+        self.solr_queries: List[Dict] = []
+
+    def record_stage(self, stage: str, duration: float):
+        # Stages can happen more than once in a request (e.g. in a bulk lookup), so we add them up.
+        self.stages[stage] = self.stages.get(stage, 0.0) + duration
+
+    def server_timing(self) -> str:
+        """ Return the value of a Server-Timing header for this request. """
+        entries = [f"{stage};dur={duration * 1000:.2f}" for stage, duration in self.stages.items()]
+        entries.append(f"total;dur={(time.perf_counter() - self.start) * 1000:.2f}")
+        return ", ".join(entries)
+
+
+_request_timing: contextvars.ContextVar[Optional[RequestTiming]] = contextvars.ContextVar(
+    'request_timing', default=None)
+
+
+def record_stage(stage: str, duration: float):
+    """ Record the time spent in a stage of the current request, if we're timing it. """
+    timing = _request_timing.get()
+    if timing is not None:
+        timing.record_stage(stage, duration)
+
+
+def debugging() -> bool:
+    """ Returns True if the current request has asked for a debug report. """
+    timing = _request_timing.get()
+    return timing is not None and timing.debug
+
+
+def record_solr_query(path: str, params: Dict, response_header: Dict):
+    """ Record a Solr query made by the current request, if it has asked for a debug report. """
+    timing = _request_timing.get()
+    if timing is not None and timing.debug:
+        timing.solr_queries.append({
+            'path': path,
+            'request': params,
+            'QTime': response_header.get('QTime'),
+            'status': response_header.get('status'),
+        })
+
+
+class SamplingProfiler:
+    """
+    A sampling profiler for a single thread.
+
+    A background thread periodically samples the Python stack of the profiled thread and counts how often each
+    stack is seen. Since NameRes runs on a single event loop thread, the profile includes everything the event loop
+    did while the request was being handled, including other requests.
+    """
+
+    # Only one request can be profiled at a time.
+    lock = threading.Lock()
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='nameres-profiler', daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self) -> Dict:
+        """ Stop profiling and return the most common stacks. """
+        self.stopped.set()
+        self.thread.join()
+        total = sum(self.samples.values())
+        return {
+            'interval_seconds': self.interval,
+            'samples': total,
+            'stacks': [
+                {'stack': stack, 'samples': count, 'fraction': count / total}
+                for stack, count in self.samples.most_common(NAMERES_PROFILE_TOP_STACKS)
+            ],
+        }
+
+
+def debug_requested(headers: List) -> bool:
+    """ Returns True if these ASGI request headers include the correct debug token. """
+    if not NAMERES_DEBUG_TOKEN:
+        return False
+    for name, value in headers:
+        if name.lower() == DEBUG_HEADER:
+            return hmac.compare_digest(value, NAMERES_DEBUG_TOKEN.encode('utf-8'))
+    return False
+
+
+class ServerTimingMiddleware:
+    """
+    ASGI middleware that times requests to the lookup endpoints, adds a Server-Timing header to their responses
+    and, if a debug report was requested, wraps the response body as `{"results": ..., "debug": ...}`.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] not in TIMED_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        timing = RequestTiming(debug=debug_requested(scope.get('headers', [])))
+        token = _request_timing.set(timing)
+        try:
+            if timing.debug:
+                await self.debug(scope, receive, send, timing)
+            else:
+                await self.time(scope, receive, send, timing)
+        finally:
+            _request_timing.reset(token)
+
+    async def time(self, scope, receive, send, timing: RequestTiming):
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                headers = list(message.get('headers', []))
+                headers.append((b'server-timing', timing.server_timing().encode('latin-1')))
+                headers.append((b'timing-allow-origin', b'*'))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+    async def debug(self, scope, receive, send, timing: RequestTiming):
+        # We need the whole response body to wrap it, so we hold on to the response until it is complete.
+        response_start = None
+        body = []
+
+        async def send_wrapper(message):
+            nonlocal response_start
+            if message['type'] == 'http.response.start':
+                response_start = message
+            elif message['type'] == 'http.response.body':
+                body.append(message.get('body', b''))
+
+        profiler = None
+        if SamplingProfiler.lock.acquire(blocking=False):
+            profiler = SamplingProfiler(threading.get_ident(), NAMERES_PROFILE_INTERVAL)
+            profiler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profile = None
+            if profiler is not None:
+                profile = profiler.stop()
+                SamplingProfiler.lock.release()
+
+        content = b''.join(body)
+        try:
+            results = json.loads(content) if content else None
+        except ValueError:
+            results = content.decode('utf-8', errors='replace')
+        debug_body = json.dumps({
+            'results': results,
+            'debug': {
+                'stages_ms': {stage: duration * 1000 for stage, duration in timing.stages.items()},
+                'total_ms': (time.perf_counter() - timing.start) * 1000,
+                'solr_queries': timing.solr_queries,
+                'profile': profile if profile is not None else 'Another request is being profiled.',
+            },
+        }).encode('utf-8')
+
+        headers = [(name, value) for name, value in response_start.get('headers', [])
+                   if name.lower() not in (b'content-length', b'content-type')]
+        headers.append((b'content-type', b'application/json'))
+        headers.append((b'content-length', str(len(debug_body)).encode('latin-1')))
+        headers.append((b'server-timing', timing.server_timing().encode('latin-1')))
+        headers.append((b'timing-allow-origin', b'*'))
+        await send(dict(response_start, headers=headers))
+        await send({'type': 'http.response.body', 'body': debug_body})
@@ -0,0 +1,32 @@
+"""
+Fast JSON responses for NameRes.
+
+By default, FastAPI validates the value returned by an endpoint against its response_model and then encodes it
+with the standard json module. For large lookups this costs more than the Solr query itself, so our lookup
+endpoints build plain dictionaries and return them in a FastJSONResponse, which skips the validation step and
+encodes them with orjson if it is installed. The response_model on each endpoint is still used to generate the
+OpenAPI schema.
+"""
+import json
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONResponse(JSONResponse):
+    """ A JSON response that is encoded with orjson where available, falling back to the json module. """
+
+    def render(self, content: Any) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content)
+        return json.dumps(
+            content,
+            ensure_ascii=False,
+            allow_nan=False,
+            separators=(",", ":"),
+        ).encode("utf-8")
@@ -7,25 +7,101 @@
   * The curie with the shortest match is first, etc.
   * Matching names are returned first, followed by non-matching names
 """
-import json
+import asyncio
 import logging, warnings
 import os
 import re
-from typing import Dict, List, Union, Annotated, Optional
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Literal, Tuple, Union, Annotated, Optional
 
 from fastapi import Body, FastAPI, Query
-from fastapi.responses import RedirectResponse
-import httpx
+from fastapi.responses import RedirectResponse, Response
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 from pydantic import BaseModel, conint, Field
 from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request as StarletteRequest
 
 from .apidocs import get_app_info, construct_open_api_schema
+from .responses import FastJSONResponse
+from .cache import ResultCache, SingleFlight, cache_stats, invalidate_caches, single_flight_stats
+from .metrics import (PrometheusMiddleware, observe_lookup_stage, register_stats_collector, LOOKUP_RESULTS,
+                      EXACT_MATCH_LOOKUPS)
+from .profiling import ServerTimingMiddleware, debugging
+from .solr import solr_client_stats, SolrOverloaded, SOLR_OVERLOAD_RETRY_AFTER
+from .backends import get_backend, start_backend, close_backend
+from .exact_match import open_table
+from .index_info import IndexHeadersMiddleware, current_index_info, record_index_info, BABEL_VERSION_URL
+from .index_status import INDEX_STATUS
+from .disconnect import CancelOnDisconnectMiddleware
+from .deadlines import DeadlineExceeded, DeadlineMiddleware
+from .warmup import WARM_UP, QUERY_LOG, flush_query_log_periodically, record_lookup
 
 LOGGER = logging.getLogger(__name__)
-SOLR_HOST = os.getenv("SOLR_HOST", "localhost")
-SOLR_PORT = os.getenv("SOLR_PORT", "8983")
 
-app = FastAPI(**get_app_info())
+# The maximum number of lookups to run against Solr at the same time for a single /bulk-lookup request.
+BULK_LOOKUP_CONCURRENCY = int(os.getenv("BULK_LOOKUP_CONCURRENCY", "10"))
+
+# Cache of recent lookup() results. Set LOOKUP_CACHE_SIZE to 0 to turn this off.
+LOOKUP_CACHE = ResultCache(
+    "lookup",
+    max_size=int(os.getenv("LOOKUP_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("LOOKUP_CACHE_TTL", "3600")),
+)
+
+# Identical lookups that arrive while one is already being searched for wait for its results.
+LOOKUP_FLIGHTS = SingleFlight("lookup")
+
+# An optional memory-mapped table of exact name matches (see api/exact_match.py), which is used to answer lookups for
+# complete names without filters without running a search.
+EXACT_MATCH_TABLE = open_table(os.getenv("EXACT_MATCH_TABLE", ""))
+
+# If there are fewer exact matches than the number of results requested, should we return just the exact matches?
+# By default, we run a full search instead, so that token matches can fill in the rest of the results.
+EXACT_MATCH_SHORT_RESULTS = os.getenv("EXACT_MATCH_SHORT_RESULTS", "false") == "true"
+
+# Cache of Solr documents for individual CURIEs, as returned by reverse_lookup().
+SYNONYMS_CACHE = ResultCache(
+    "synonyms",
+    max_size=int(os.getenv("SYNONYMS_CACHE_SIZE", "50000")),
+    ttl=float(os.getenv("SYNONYMS_CACHE_TTL", "3600")),
+)
+
+# Requests for CURIEs that are already being fetched from Solr wait for those fetches.
+SYNONYMS_FLIGHTS = SingleFlight("synonyms")
+
+# reverse_lookup() fetches uncached CURIEs from Solr in concurrent chunks of this size.
+SYNONYMS_CHUNK_SIZE = int(os.getenv("SYNONYMS_CHUNK_SIZE", "100"))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """ Set up the search backend when the application starts, and close it when the application shuts down. """
+    await start_backend()
+    # Find out which index we are serving, and keep checking in the background.
+    await INDEX_STATUS.poll()
+    INDEX_STATUS.start()
+
+    # Replay frequent lookups from the query log (if there is one) to warm up Solr and our caches; /ready reports
+    # whether this has finished.
+    WARM_UP.start(lookup, 'startup')
+    flush_task = asyncio.create_task(flush_query_log_periodically())
+    yield
+    INDEX_STATUS.stop()
+    flush_task.cancel()
+    WARM_UP.cancel()
+    await asyncio.to_thread(QUERY_LOG.flush)
+    await close_backend()
+
+
+app = FastAPI(lifespan=lifespan, **get_app_info())
+
+# Cancel lookups whose clients have disconnected. (Middleware added first runs innermost, so the other middleware
+# record these requests as cancelled.)
+app.add_middleware(CancelOnDisconnectMiddleware)
+
+# Give up on lookups that don't finish within their deadlines.
+app.add_middleware(DeadlineMiddleware)
 
 app.add_middleware(
     CORSMiddleware,
@@ -35,6 +111,39 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Record Prometheus metrics for every request, and report statistics from the Solr client and caches.
+app.add_middleware(PrometheusMiddleware)
+
+# Report the time spent in each stage of a lookup in a Server-Timing header, and produce debug reports on request.
+app.add_middleware(ServerTimingMiddleware)
+
+# Report the collection and Babel version that results come from on every response.
+app.add_middleware(IndexHeadersMiddleware)
+register_stats_collector(solr_client_stats, cache_stats, single_flight_stats)
+
+
+def warm_up_new_index(previous: Optional[Dict], current: Dict):
+    """ Warm up our caches in the background when the index changes. """
+    if previous is not None:
+        WARM_UP.start(lookup, 'index changed')
+
+
+# When the index changes, record it for our response headers, clear our caches and warm them up again.
+INDEX_STATUS.subscribe(record_index_info)
+INDEX_STATUS.subscribe(invalidate_caches)
+INDEX_STATUS.subscribe(warm_up_new_index)
+# Only use the exact match table while the index it was built for is being served.
+if EXACT_MATCH_TABLE is not None:
+    INDEX_STATUS.subscribe(EXACT_MATCH_TABLE.check_index)
+
+@app.exception_handler(SolrOverloaded)
+async def solr_overloaded_handler(request: StarletteRequest, err: SolrOverloaded) -> FastJSONResponse:
+    """ Tell clients to come back later when too many requests are already waiting for Solr. """
+    LOGGER.warning("Rejecting request to %s: %s", request.url.path, err)
+    return FastJSONResponse({'detail': "NameRes is overloaded, please try again later."}, status_code=503,
+                            headers={'Retry-After': str(SOLR_OVERLOAD_RETRY_AFTER)})
+
+
 # ENDPOINT /
 # If someone tries accessing /, we should redirect them to the Swagger interface.
 @app.get("/", include_in_schema=False)
@@ -45,10 +154,43 @@ async def docs_redirect():
     return RedirectResponse(url='/docs')
 
 
+# ENDPOINT /metrics
+# Prometheus metrics for this NameRes instance.
+@app.get("/metrics", include_in_schema=False)
+async def metrics_get():
+    """
+    Return Prometheus metrics for this NameRes instance.
+    """
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/health",
+         summary="Check whether this NameRes instance is running.",
+         description="Returns HTTP 200 as long as this instance can answer requests at all, without checking Solr. "
+                     "This is intended for use as a liveness probe.",
+         )
+async def health_get() -> Dict:
+    """ Report that we are running. """
+    return {'status': 'ok'}
+
+
+@app.get("/ready",
+         summary="Check whether this NameRes instance is ready to receive traffic.",
+         description="Returns HTTP 200 once this instance has finished warming up from its query log when it started "
+                     "up, and HTTP 503 until then. This is intended for use as a readiness probe.",
+         responses={503: {"description": "This instance is still warming up."}},
+         )
+async def ready_get() -> FastJSONResponse:
+    """ Report whether we have finished warming up. """
+    stats = WARM_UP.stats()
+    return FastJSONResponse(stats, status_code=200 if stats['ready'] else 503)
+
+
 @app.get("/status",
          summary="Get status and counts for this NameRes instance.",
          description="This endpoint will return status information and a list of counts from the underlying Solr "
-                     "instance for this NameRes instance."
+                     "instance for this NameRes instance. The Solr status is checked in the background, and "
+                     "`status_age` reports how long ago (in seconds) it was last checked."
          )
 async def status_get() -> Dict:
     """ Return status and count information from the underyling Solr instance. """
@@ -56,35 +198,22 @@ async def status_get() -> Dict:
 
 
 async def status() -> Dict:
-    """ Return a dictionary containing status and count information for the underlying Solr instance. """
-    query_url = f"http://{SOLR_HOST}:{SOLR_PORT}/solr/admin/cores"
-    async with httpx.AsyncClient(timeout=None) as client:
-        response = await client.get(query_url, params={
-            'action': 'STATUS'
-        })
-    if response.status_code >= 300:
-        LOGGER.error("Solr error on accessing /solr/admin/cores?action=STATUS: %s", response.text)
-        response.raise_for_status()
-    result = response.json()
-
-    # Do we know the Babel version and version URL? It will be stored in an environmental variable if we do.
-    babel_version = os.environ.get("BABEL_VERSION", "unknown")
-    babel_version_url = os.environ.get("BABEL_VERSION_URL", "")
-
-    # We should have a status for name_lookup_shard1_replica_n1.
-    if 'status' in result and 'name_lookup_shard1_replica_n1' in result['status']:
-        core = result['status']['name_lookup_shard1_replica_n1']
-
-        index = {}
-        if 'index' in core:
-            index = core['index']
-
+    """ Return a dictionary containing status and count information for the underlying search index. """
+    backend = await get_backend()
+    index = await INDEX_STATUS.latest()
+    poller_stats = INDEX_STATUS.stats()
+
+    if index is not None:
+        index_info = current_index_info()
+        # If we couldn't check the index status recently, we report the last one we saw as degraded.
+        degraded = INDEX_STATUS.degraded()
         return {
-            'status': 'ok',
-            'message': 'Reporting results from primary core.',
-            'babel_version': babel_version,
-            'babel_version_url': babel_version_url,
-            'startTime': core['startTime'],
+            'status': 'degraded' if degraded else 'ok',
+            'message': f"{degraded} {index['message']}" if degraded else index['message'],
+            'babel_version': index_info['babel_version'],
+            'babel_version_url': BABEL_VERSION_URL,
+            'collection': index_info['collection'],
+            'startTime': index['startTime'],
             'numDocs': index.get('numDocs', ''),
             'maxDoc': index.get('maxDoc', ''),
             'deletedDocs': index.get('deletedDocs', ''),
@@ -92,11 +221,28 @@ async def status() -> Dict:
             'segmentCount': index.get('segmentCount', ''),
             'lastModified': index.get('lastModified', ''),
             'size': index.get('size', ''),
+            'shards': index.get('shards', 1),
+            'missing_shards': index.get('missing_shards', []),
+            'cores': index.get('cores', []),
+            'status_age': poller_stats['age'],
+            'status_poller': poller_stats,
+            'backend': backend.name,
+            'solr_client': backend.stats() if backend.name == 'solr' else None,
+            'caches': cache_stats(),
+            'coalescing': single_flight_stats(),
+            'warmup': WARM_UP.stats(),
         }
     else:
         return {
             'status': 'error',
-            'message': 'Expected core not found.'
+            'message': poller_stats['last_error'] or 'Expected core not found.',
+            'status_age': poller_stats['age'],
+            'status_poller': poller_stats,
+            'backend': backend.name,
+            'solr_client': backend.stats() if backend.name == 'solr' else None,
+            'caches': cache_stats(),
+            'coalescing': single_flight_stats(),
+            'warmup': WARM_UP.stats(),
         }
 
 
@@ -106,9 +252,25 @@ class Request(BaseModel):
     """Reverse-lookup request body."""
     curies: List[str]
 
+# The stored Solr fields that can be requested from /synonyms.
+SynonymsField = Literal['id', 'curie', 'curie_prefix', 'curie_suffix', 'preferred_name', 'names', 'names_exactish',
+                        'types', 'taxa', 'shortest_name_length', 'clique_identifier_count']
+
+
 class SynonymsRequest(BaseModel):
     """ Synonyms search request body. """
     preferred_curies: List[str]
+    fields: Optional[List[SynonymsField]] = Field(
+        None,
+        description="The Solr fields to return for each CURIE, e.g. `preferred_name` and `types`. The `curie` field "
+                    "is always returned. All fields are returned if none are specified."
+    )
+    max_synonyms: Optional[int] = Field(
+        None,
+        description="The maximum number of synonyms (`names`) to return for each CURIE. All synonyms are returned "
+                    "if not specified.",
+        ge=0
+    )
 
 @app.get(
     "/reverse_lookup",
@@ -123,9 +285,9 @@ async def reverse_lookup_get(
             example=["MONDO:0005737", "MONDO:0009757"],
             description="A list of CURIEs to look up synonyms for."
         )
-) -> Dict[str, Dict]:
+) -> FastJSONResponse:
     """Returns a list of synonyms for a particular CURIE."""
-    return await reverse_lookup(curies)
+    return FastJSONResponse(await reverse_lookup(curies))
 
 
 @app.get(
@@ -139,10 +301,21 @@ async def lookup_names_get(
         preferred_curies: List[str]= Query(
             example=["MONDO:0005737", "MONDO:0009757"],
             description="A list of CURIEs to look up synonyms for."
+        ),
+        fields: Union[List[SynonymsField], None] = Query(
+            None,
+            description="The Solr fields to return for each CURIE, e.g. `preferred_name` and `types`. The `curie` "
+                        "field is always returned. All fields are returned if none are specified."
+        ),
+        max_synonyms: Union[int, None] = Query(
+            None,
+            description="The maximum number of synonyms (`names`) to return for each CURIE. All synonyms are "
+                        "returned if not specified.",
+            ge=0
         )
-) -> Dict[str, Dict]:
+) -> FastJSONResponse:
     """Returns a list of synonyms for a particular CURIE."""
-    return await reverse_lookup(preferred_curies)
+    return FastJSONResponse(await reverse_lookup(preferred_curies, fields, max_synonyms))
 
 
 @app.post(
@@ -157,9 +330,9 @@ async def lookup_names_post(
         request: Request = Body(..., example={
             "curies": ["MONDO:0005737", "MONDO:0009757"],
         }),
-) -> Dict[str, Dict]:
+) -> FastJSONResponse:
     """Returns a list of synonyms for a particular CURIE."""
-    return await reverse_lookup(request.curies)
+    return FastJSONResponse(await reverse_lookup(request.curies))
 
 
 @app.post(
@@ -173,43 +346,116 @@ async def lookup_names_post(
         request: SynonymsRequest = Body(..., example={
             "preferred_curies": ["MONDO:0005737", "MONDO:0009757"],
         }),
-) -> Dict[str, Dict]:
+) -> FastJSONResponse:
     """Returns a list of synonyms for a particular CURIE."""
-    return await reverse_lookup(request.preferred_curies)
+    return FastJSONResponse(await reverse_lookup(request.preferred_curies, request.fields, request.max_synonyms))
 
 
-async def reverse_lookup(curies) -> Dict[str, Dict]:
-    """Returns a list of synonyms for a particular CURIE."""
-    query = f"http://{SOLR_HOST}:{SOLR_PORT}/solr/name_lookup/select"
-    curie_filter = " OR ".join(
-        f"curie:\"{curie}\""
-        for curie in curies
-    )
-    params = {
-        "query": curie_filter,
-        "limit": 1000000,
-    }
-    async with httpx.AsyncClient(timeout=None) as client:
-        response = await client.post(query, json=params)
-    response.raise_for_status()
-    response_json = response.json()
+async def reverse_lookup(curies,
+                         fields: Optional[List[str]] = None,
+                         max_synonyms: Optional[int] = None) -> Dict[str, Dict]:
+    """
+    Returns a list of synonyms for a particular CURIE.
+
+    :param fields: The Solr fields to return for each CURIE (the `curie` field is always included). If None or empty,
+        all fields are returned.
+    :param max_synonyms: The maximum number of synonyms (`names`) to return for each CURIE, or None for all of them.
+    """
     output = {
         curie: {}
         for curie in curies
     }
-    for doc in response_json["response"]["docs"]:
-        output[doc["curie"]] = doc
+
+    # Solr documents are cached by CURIE and the fields that were requested from Solr.
+    fields_key = tuple(sorted(set(fields) | {'curie'})) if fields else None
+
+    # Use cached documents where we have them.
+    missing_curies = []
+    for curie in output:
+        doc = None if debugging() else SYNONYMS_CACHE.get((curie, fields_key))
+        if doc is None:
+            missing_curies.append(curie)
+        else:
+            output[curie] = doc
+
+    # Wait for CURIEs that another request is already fetching, and fetch the rest from Solr in concurrent chunks.
+    tasks = {}
+    curies_to_fetch = []
+    for curie in missing_curies:
+        task = None if debugging() else SYNONYMS_FLIGHTS.get((curie, fields_key))
+        if task is None:
+            curies_to_fetch.append(curie)
+        else:
+            tasks[curie] = task
+    backend = await get_backend()
+    for i in range(0, len(curies_to_fetch), SYNONYMS_CHUNK_SIZE):
+        chunk = curies_to_fetch[i:i + SYNONYMS_CHUNK_SIZE]
+        task = SYNONYMS_FLIGHTS.start([(curie, fields_key) for curie in chunk],
+                                      fetch_synonyms(backend, chunk, fields_key))
+        for curie in chunk:
+            tasks[curie] = task
+
+    unique_tasks = list(set(tasks.values()))
+    docs_by_task = dict(zip(unique_tasks, await asyncio.gather(*[SYNONYMS_FLIGHTS.wait(task) for task in unique_tasks])))
+    for curie, task in tasks.items():
+        output[curie] = docs_by_task[task][curie]
+
+    # Solr can't truncate a multivalued field, so we cap the synonyms here. We copy the document so that we don't
+    # modify the cached version.
+    if max_synonyms is not None:
+        for curie, doc in output.items():
+            if len(doc.get('names', [])) > max_synonyms:
+                output[curie] = dict(doc, names=doc['names'][:max_synonyms])
+
     return output
 
+
+async def fetch_synonyms(backend, curies: List[str], fields_key: Optional[tuple]) -> Dict[str, Dict]:
+    """ Fetch and cache the documents for a chunk of CURIEs, returning an empty document for CURIEs not in Solr. """
+    cache_generation = SYNONYMS_CACHE.generation
+    docs = await backend.fetch_documents(curies, fields_key)
+    result = {}
+    for curie in curies:
+        # We cache CURIEs that aren't in Solr as well, so we don't keep looking for them.
+        result[curie] = docs.get(curie, {})
+        SYNONYMS_CACHE.set((curie, fields_key), result[curie], cache_generation)
+    return result
+
+
 class LookupResult(BaseModel):
+    """
+    A single lookup result. If specific `fields` were requested, only those fields (and `curie`) are included, so
+    every other field is optional.
+    """
     curie:str
-    label: str
-    highlighting: Dict[str, List[str]]
-    synonyms: List[str]
-    taxa: List[str]
-    types: List[str]
-    score: float
-    clique_identifier_count: int
+    label: Optional[str] = None
+    highlighting: Optional[Dict[str, List[str]]] = None
+    synonyms: Optional[List[str]] = None
+    taxa: Optional[List[str]] = None
+    types: Optional[List[str]] = None
+    score: Optional[float] = Field(
+        None,
+        description="The relevance score of this result. Scores can only be compared between results for the same "
+                    "query. Results for complete names that are answered from the exact match table are scored by "
+                    "the table's own formula, which approximates the search backend's ranking: the scores differ "
+                    "from Solr's, and the order (and which results are returned) may differ too."
+    )
+    clique_identifier_count: Optional[int] = None
+
+
+# The fields that can be requested in a LookupResult, and the Solr fields we need to fetch to fill them in.
+LookupResultField = Literal['curie', 'label', 'highlighting', 'synonyms', 'taxa', 'types', 'score',
+                            'clique_identifier_count']
+LOOKUP_RESULT_SOLR_FIELDS = {
+    'curie': ['curie'],
+    'label': ['preferred_name'],
+    'highlighting': ['id'],
+    'synonyms': ['names'],
+    'taxa': ['taxa'],
+    'types': ['types'],
+    'score': ['score'],
+    'clique_identifier_count': ['clique_identifier_count'],
+}
 
 
 @app.get("/lookup",
@@ -263,12 +509,22 @@ async def lookup_curies_get(
                         "e.g. `NCBITaxon:9606|NCBITaxon:10090|NCBITaxon:10116|NCBITaxon:7955`.",
             # We can't use `example` here because otherwise it gets filled in when filling this in.
             # example="NCBITaxon:9606|NCBITaxon:10090|NCBITaxon:10116|NCBITaxon:7955"
+        )] = None,
+        fields: Annotated[Union[List[LookupResultField], None], Query(
+            description="The fields to include in each result, e.g. `curie` and `label`. The `curie` field is always "
+                        "included. All fields are returned if none are specified."
+        )] = None,
+        max_synonyms: Annotated[Union[int, None], Query(
+            description="The maximum number of synonyms to return for each result. All synonyms are returned if not "
+                        "specified.",
+            ge=0
         )] = None
-) -> List[LookupResult]:
+) -> FastJSONResponse:
     """
     Returns cliques with a name or synonym that contains a specified string.
     """
-    return await lookup(string, autocomplete, highlighting, offset, limit, biolink_type, only_prefixes, exclude_prefixes, only_taxa)
+    return FastJSONResponse(await lookup(string, autocomplete, highlighting, offset, limit, biolink_type, only_prefixes,
+                                         exclude_prefixes, only_taxa, fields, max_synonyms))
 
 
 @app.post("/lookup",
@@ -322,12 +578,22 @@ async def lookup_curies_post(
                         "e.g. `NCBITaxon:9606|NCBITaxon:10090|NCBITaxon:10116|NCBITaxon:7955`.",
             # We can't use `example` here because otherwise it gets filled in when filling this in.
             # example="NCBITaxon:9606|NCBITaxon:10090|NCBITaxon:10116|NCBITaxon:7955"
+        )] = None,
+        fields: Annotated[Union[List[LookupResultField], None], Query(
+            description="The fields to include in each result, e.g. `curie` and `label`. The `curie` field is always "
+                        "included. All fields are returned if none are specified."
+        )] = None,
+        max_synonyms: Annotated[Union[int, None], Query(
+            description="The maximum number of synonyms to return for each result. All synonyms are returned if not "
+                        "specified.",
+            ge=0
         )] = None
-) -> List[LookupResult]:
+) -> FastJSONResponse:
     """
     Returns cliques with a name or synonym that contains a specified string.
     """
-    return await lookup(string, autocomplete, highlighting, offset, limit, biolink_type, only_prefixes, exclude_prefixes, only_taxa)
+    return FastJSONResponse(await lookup(string, autocomplete, highlighting, offset, limit, biolink_type, only_prefixes,
+                                         exclude_prefixes, only_taxa, fields, max_synonyms))
 
 
 async def lookup(string: str,
@@ -338,17 +604,25 @@ async def lookup(string: str,
            biolink_types: List[str] = None,
            only_prefixes: str = "",
            exclude_prefixes: str = "",
-           only_taxa: str = ""
-) -> List[LookupResult]:
+           only_taxa: str = "",
+           fields: Optional[List[str]] = None,
+           max_synonyms: Optional[int] = None
+) -> List[Dict]:
     """
     Returns cliques with a name or synonym that contains a specified string.
 
+    The results are plain dictionaries in the shape of LookupResult, so they can be returned without being validated
+    again.
+
     :param autocomplete: Should we do the lookup in autocomplete mode (in which we expect the final word to be
         incomplete) or not (in which the entire phrase is expected to be complete, i.e. as an entity linker)?
     :param highlighting: Return information on which labels and synonyms matched the search query.
     :param biolink_types: A list of Biolink types to filter (with or without the `biolink:` prefix). Note that these are
         additive, i.e. if this list is ['PhenotypicFeature', 'Disease'], then both phenotypic features AND diseases
         will be returned, rather than filtering to concepts that are both PhenotypicFeature and Disease.
+    :param fields: The LookupResult fields to include in each result (the `curie` field is always included). If None
+        or empty, all fields are returned. Only the Solr fields needed for these fields are fetched.
+    :param max_synonyms: The maximum number of synonyms to return for each result, or None for all of them.
     """
 
     # First, we strip and lowercase the query since all our indexes are case-insensitive.
@@ -367,114 +641,66 @@ async def lookup(string: str,
     if string_lc == "":
         return []
 
-    # For reasons I don't understand, we need to use backslash to escape characters (e.g. "\(") to remove the special
-    # significance of characters inside round brackets, but not inside double-quotes. So we escape them separately:
-    # - For a full exact search, we only remove double-quotes and slashes, leaving other special characters as-is.
-    string_lc_escape_groupings = string_lc.replace('"', '').replace('\\', '')
-
-    # - For a tokenized search, we escape all special characters with backslashes as well as other characters that might
-    #   mess up the search.
-    string_lc_escape_everything = re.sub(r'([!(){}\[\]^"~*?:/+-\\])', r'\\\g<0>', string_lc) \
-        .replace('&&', ' ').replace('||', ' ')
-
-    # If autocomplete mode is turned on, add an asterisk at the end so that we look for incomplete terms.
-    if autocomplete:
-        query = f'"{string_lc_escape_groupings}" OR ({string_lc_escape_everything}*)'
+    # Have we answered this query recently?
+    filter_args = normalize_filter_args(biolink_types, only_prefixes, exclude_prefixes, only_taxa)
+    result_fields = tuple(sorted(set(fields) | {'curie'})) if fields else None
+    cache_key = (string_lc, bool(autocomplete), bool(highlighting), offset, limit, filter_args, result_fields,
+                 max_synonyms)
+    record_lookup(cache_key)
+    # (Debug reports are about what Solr does with the query, so they never use the cache.)
+    cached_outputs = None if debugging() else LOOKUP_CACHE.get(cache_key)
+    if cached_outputs is not None:
+        return list(cached_outputs)
+
+    # Wait for an identical lookup that is already in progress, or search for this one.
+    # (Debug reports are about what Solr does with the query, so they always run their own search.)
+    if debugging():
+        outputs = await search_lookup(string_lc, autocomplete, highlighting, offset, limit, filter_args,
+                                      result_fields, max_synonyms, cache_key)
     else:
-        query = f'"{string_lc_escape_groupings}" OR ({string_lc_escape_everything})'
-
-    # Apply filters as needed.
-    filters = []
-
-    # Biolink type filter
-    if biolink_types:
-        biolink_types_filters = []
-        for biolink_type in biolink_types:
-            biolink_type_stripped = biolink_type.strip()
-            if biolink_type_stripped:
-                if biolink_type_stripped.startswith('biolink:'):
-                    biolink_type_stripped = biolink_type_stripped[8:]
-                biolink_types_filters.append(f"types:{biolink_type_stripped}")
-        filters.append(" OR ".join(biolink_types_filters))
-
-    # Prefix: only filter
-    if only_prefixes:
-        prefix_filters = []
-        for prefix in re.split('\\s*\\|\\s*', only_prefixes):
-            prefix_filters.append(f"curie:/{prefix}:.*/")
-        filters.append(" OR ".join(prefix_filters))
-
-    # Prefix: exclude filter
-    if exclude_prefixes:
-        prefix_exclude_filters = []
-        for prefix in re.split('\\s*\\|\\s*', exclude_prefixes):
-            prefix_exclude_filters.append(f"NOT curie:/{prefix}:.*/")
-        filters.append(" AND ".join(prefix_exclude_filters))
-
-    # Taxa filter.
-    # only_taxa is like: 'NCBITaxon:9606|NCBITaxon:10090|NCBITaxon:10116|NCBITaxon:7955'
-    if only_taxa:
-        taxa_filters = []
-        for taxon in re.split('\\s*\\|\\s*', only_taxa):
-            taxa_filters.append(f'taxa:"{taxon}"')
-        filters.append(" OR ".join(taxa_filters))
-
-    # Turn on highlighting if requested.
-    inner_params = {}
-    if highlighting:
-        inner_params.update({
-            # Highlighting
-            "hl": "true",
-            "hl.method": "unified",
-            "hl.encoder": "html",
-            "hl.tag.pre": "<strong>",
-            "hl.tag.post": "</strong>",
-            # "hl.usePhraseHighlighter": "true",
-            # "hl.highlightMultiTerm": "true",
-        })
-
-    params = {
-        "query": {
-            "edismax": {
-                "query": query,
-                # qf = query fields, i.e. how should we boost these fields if they contain the same fields as the input.
-                # https://solr.apache.org/guide/solr/latest/query-guide/dismax-query-parser.html#qf-query-fields-parameter
-                "qf": "preferred_name_exactish^250 names_exactish^100 preferred_name^25 names^10",
-                # pf = phrase fields, i.e. how should we boost these fields if they contain the entire search phrase.
-                # https://solr.apache.org/guide/solr/latest/query-guide/dismax-query-parser.html#pf-phrase-fields-parameter
-                "pf": "preferred_name_exactish^300 names_exactish^200 preferred_name^30 names^20",
-                # Boosts
-                "bq": [],
-                "boost": [
-                    # The boost is multiplied with score -- calculating the log() reduces how quickly this increases
-                    # the score for increasing clique identifier counts.
-                    "log(sum(clique_identifier_count, 1))"
-                ],
-            },
-        },
-        "sort": "score DESC, clique_identifier_count DESC, curie_suffix ASC",
-        "limit": limit,
-        "offset": offset,
-        "filter": filters,
-        "fields": "*, score",
-        "params": inner_params,
-    }
-    logging.debug(f"Query: {json.dumps(params, indent=2)}")
+        outputs = await LOOKUP_FLIGHTS.run(cache_key, lambda: search_lookup(
+            string_lc, autocomplete, highlighting, offset, limit, filter_args, result_fields, max_synonyms, cache_key))
+    return list(outputs)
+
+
+async def search_lookup(string_lc: str,
+                        autocomplete: bool,
+                        highlighting: bool,
+                        offset: int,
+                        limit: int,
+                        filter_args: tuple,
+                        result_fields: Optional[tuple],
+                        max_synonyms: Optional[int],
+                        cache_key: tuple) -> List[Dict]:
+    """
+    Search for a lookup that isn't in the cache, and cache the results. The arguments are those to lookup() after
+    normalization.
+    """
+    # If the index changes while we're searching, our results will be from the old index, so we don't cache them.
+    cache_generation = LOOKUP_CACHE.generation
+
+    # Only fetch the fields we need: stored fields like `names` can be very large.
+    backend_fields = None
+    if result_fields:
+        backend_fields = sorted(
+            {'id', 'curie'} | {solr_field for field in result_fields for solr_field in LOOKUP_RESULT_SOLR_FIELDS[field]}
+        )
 
-    query_url = f"http://{SOLR_HOST}:{SOLR_PORT}/solr/name_lookup/select"
-    async with httpx.AsyncClient(timeout=None) as client:
-        response = await client.post(query_url, json=params)
-    if response.status_code >= 300:
-        LOGGER.error("Solr REST error: %s", response.text)
-        response.raise_for_status()
-    response = response.json()
-    logging.debug(f"Solr response: {json.dumps(response, indent=2)}")
+    # Complete names without filters might be answered from the exact match table.
+    docs = None
+    highlighting_response = {}
+    if EXACT_MATCH_TABLE is not None and EXACT_MATCH_TABLE.enabled and not autocomplete and not highlighting and not any(filter_args):
+        docs = exact_match_docs(string_lc, offset, limit)
 
-    # Associate highlighting information with search results.
-    highlighting_response = response.get("highlighting", {})
+    if docs is None:
+        backend = await get_backend()
+        docs, highlighting_response = await backend.search(string_lc, autocomplete, highlighting, offset, limit,
+                                                           filter_args, backend_fields)
+    stage_start = time.perf_counter()
 
+    # Associate highlighting information with search results.
     outputs = []
-    for doc in response['response']['docs']:
+    for doc in docs:
         preferred_matches = []
         synonym_matches = []
 
@@ -499,20 +725,86 @@ async def lookup(string: str,
             # Solr sometimes returns duplicates or a blank string here?
             synonym_matches = list(filter(lambda s: s, set(synonym_matches)))
 
-        outputs.append(LookupResult(curie=doc.get("curie", ""),
-                           label=doc.get("preferred_name", ""),
-                           highlighting={
-                               'labels': preferred_matches,
-                               'synonyms': synonym_matches,
-                           } if highlighting else {},
-                           synonyms=doc.get("names", []),
-                           score=doc.get("score", ""),
-                           taxa=doc.get("taxa", []),
-                           clique_identifier_count=doc.get("clique_identifier_count", 0),
-                           types=[f"biolink:{d}" for d in doc.get("types", [])]))
+        synonyms = doc.get("names", [])
+        if max_synonyms is not None:
+            synonyms = synonyms[:max_synonyms]
+
+        output = {
+            'curie': doc.get("curie", ""),
+            'label': doc.get("preferred_name", ""),
+            'highlighting': {
+                'labels': preferred_matches,
+                'synonyms': synonym_matches,
+            } if highlighting else {},
+            'synonyms': synonyms,
+            'taxa': doc.get("taxa", []),
+            'types': [f"biolink:{d}" for d in doc.get("types", [])],
+            'score': doc.get("score", 0.0),
+            'clique_identifier_count': doc.get("clique_identifier_count", 0),
+        }
+        if result_fields:
+            output = {field: value for field, value in output.items() if field in result_fields}
+        outputs.append(output)
+
+    observe_lookup_stage('result_building', stage_start)
+    LOOKUP_RESULTS.observe(len(outputs))
 
+    LOOKUP_CACHE.set(cache_key, outputs, cache_generation)
     return outputs
 
+
+def exact_match_docs(string_lc: str, offset: int, limit: int) -> Optional[List[Dict]]:
+    """
+    Return the documents for a page of results from the exact match table, or None if the table can't answer this
+    query (because there are no exact matches, or too few of them to fill the page).
+    """
+    start = time.perf_counter()
+
+    # The exactish fields match the whole query without double-quotes or backslashes (see SolrBackend.search()).
+    matches = EXACT_MATCH_TABLE.lookup(string_lc.replace('"', '').replace('\\', ''))
+    if matches is None:
+        EXACT_MATCH_LOOKUPS.labels('miss').inc()
+        return None
+    if len(matches) < offset + limit and not EXACT_MATCH_SHORT_RESULTS:
+        EXACT_MATCH_LOOKUPS.labels('incomplete').inc()
+        return None
+
+    EXACT_MATCH_LOOKUPS.labels('hit').inc()
+    docs = [dict(doc, score=score) for doc, score in matches[offset:offset + limit]]
+    observe_lookup_stage('exact_match', start)
+    return docs
+
+
+def normalize_filter_args(biolink_types: Optional[List[str]],
+                          only_prefixes: Optional[str],
+                          exclude_prefixes: Optional[str],
+                          only_taxa: Optional[str]) -> Tuple[tuple, tuple, tuple, tuple]:
+    """
+    Normalize the filter arguments to lookup() into sorted tuples of Biolink types (without the `biolink:` prefix),
+    prefixes to include, prefixes to exclude and taxa. Since these are hashable, they can be used in cache keys.
+    """
+    def split_pipes(value: Optional[str]) -> tuple:
+        # The order of pipe-separated values doesn't affect the query, so we sort them.
+        if not value:
+            return ()
+        return tuple(sorted(set(filter(None, re.split('\\s*\\|\\s*', value.strip())))))
+
+    types = set()
+    for biolink_type in (biolink_types or []):
+        biolink_type = biolink_type.strip()
+        if biolink_type.startswith('biolink:'):
+            biolink_type = biolink_type[8:]
+        if biolink_type:
+            types.add(biolink_type)
+
+    return (
+        tuple(sorted(types)),
+        split_pipes(only_prefixes),
+        split_pipes(exclude_prefixes),
+        split_pipes(only_taxa),
+    )
+
+
 ## BULK ENDPOINT
 
 class NameResQuery(BaseModel):
@@ -570,28 +862,78 @@ class NameResQuery(BaseModel):
         # We can't use `example` here because otherwise it gets filled in when filling this in.
         # example="NCBITaxon:9606|NCBITaxon:10090|NCBITaxon:10116|NCBITaxon:7955"
     )
+    fields: Optional[List[LookupResultField]] = Field(
+        None,
+        description="The fields to include in each result, e.g. `curie` and `label`. The `curie` field is always "
+                    "included. All fields are returned if none are specified."
+    )
+    max_synonyms: Optional[int] = Field(
+        None,
+        description="The maximum number of synonyms to return for each result. All synonyms are returned if not "
+                    "specified.",
+        ge=0
+    )
+
+
+class BulkLookupError(BaseModel):
+    """
+    Returned in place of a list of results for a string in a bulk lookup that could not be looked up.
+    """
+    error: str = Field(
+        ...,
+        description="A description of the error that occurred while looking up this string."
+    )
 
 
 @app.post("/bulk-lookup",
           summary="Look up cliques for a fragment of multiple names or synonyms.",
-          description="Returns cliques for each query.",
-          response_model=Dict[str, List[LookupResult]],
+          description="Returns cliques for each query. If a particular string could not be looked up, its value will "
+                      "be an object with an `error` key instead of a list of results.",
+          response_model=Dict[str, Union[List[LookupResult], BulkLookupError]],
           tags=["lookup"]
 )
-async def bulk_lookup(query: NameResQuery) -> Dict[str, List[LookupResult]]:
-    result = {}
-    for string in query.strings:
-        result[string] = await lookup(
-            string,
-            query.autocomplete,
-            query.highlighting,
-            query.offset,
-            query.limit,
-            query.biolink_types,
-            query.only_prefixes,
-            query.exclude_prefixes,
-            query.only_taxa)
-    return result
+async def bulk_lookup(query: NameResQuery) -> FastJSONResponse:
+    # We only need to look up each distinct string once; dict.fromkeys() keeps them in input order.
+    strings = list(dict.fromkeys(query.strings))
+
+    # Run the lookups concurrently, but don't send more than BULK_LOOKUP_CONCURRENCY queries to Solr at a time.
+    semaphore = asyncio.Semaphore(BULK_LOOKUP_CONCURRENCY)
+
+    async def lookup_string(string: str) -> Union[List[Dict], Dict]:
+        async with semaphore:
+            try:
+                return await lookup(
+                    string,
+                    query.autocomplete,
+                    query.highlighting,
+                    query.offset,
+                    query.limit,
+                    query.biolink_types,
+                    query.only_prefixes,
+                    query.exclude_prefixes,
+                    query.only_taxa,
+                    query.fields,
+                    query.max_synonyms)
+            except SolrOverloaded:
+                # If Solr is overloaded, we reject the whole bulk lookup rather than adding to its load.
+                raise
+            except DeadlineExceeded as err:
+                # Strings we didn't get to before the deadline are reported as errors, alongside the other results.
+                return {'error': f"{type(err).__name__}: {err}"}
+            except Exception as err:
+                LOGGER.exception("Could not look up '%s' in bulk lookup: %s", string, err)
+                return {'error': f"{type(err).__name__}: {err}"}
+
+    tasks = [asyncio.ensure_future(lookup_string(string)) for string in strings]
+    try:
+        results = await asyncio.gather(*tasks)
+    except SolrOverloaded:
+        # Cancel the lookups that are still running or waiting for the semaphore, so that they don't send any more
+        # queries to Solr.
+        for task in tasks:
+            task.cancel()
+        raise
+    return FastJSONResponse(dict(zip(strings, results)))
 
 
 # Override open api schema with custom schema
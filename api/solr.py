@@ -0,0 +1,456 @@
+"""
+Shared Solr client for NameRes.
+
+Rather than opening a new HTTP connection to Solr for every request, NameRes keeps a single pooled
+httpx.AsyncClient for every Solr node for the lifetime of the application. The clients are created when the FastAPI
+lifespan starts and closed when it ends; all of their settings can be configured with environmental variables.
+
+With more than one Solr node (SOLR_ENDPOINTS), requests are sent to the healthy node with the fewest outstanding
+requests, and search queries can be hedged: if the first node hasn't answered within a recent latency percentile,
+the same query is sent to a second node and whichever answers first is used.
+
+Only SOLR_MAX_CONCURRENT_REQUESTS requests are sent to Solr at a time, with a bounded queue of requests waiting for
+a turn; once that is full, requests are rejected with SolrOverloaded (which NameRes reports as HTTP 503) instead of
+piling up while Solr is slow. A hedge counts against this limit too, so a query is only hedged if a turn is free
+straight away. Requests never wait past the deadline of the request they are part of (see
+api/deadlines.py).
+"""
+import asyncio
+import collections
+import logging
+import math
+import os
+import random
+import time
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from .deadlines import DeadlineExceeded, check_deadline, remaining
+
+LOGGER = logging.getLogger(__name__)
+
+SOLR_HOST = os.getenv("SOLR_HOST", "localhost")
+SOLR_PORT = os.getenv("SOLR_PORT", "8983")
+
+# A comma-separated list of Solr nodes (e.g. `solr-0:8983,solr-1:8983`) that all serve the name_lookup collection.
+SOLR_ENDPOINTS = os.getenv("SOLR_ENDPOINTS", "")
+
+# Connection pool settings (for each Solr node).
+SOLR_MAX_CONNECTIONS = int(os.getenv("SOLR_MAX_CONNECTIONS", "100"))
+SOLR_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("SOLR_MAX_KEEPALIVE_CONNECTIONS", "20"))
+SOLR_KEEPALIVE_EXPIRY = float(os.getenv("SOLR_KEEPALIVE_EXPIRY", "30"))
+
+# Timeouts (in seconds). The read timeout needs to be long enough for our slowest legitimate queries.
+SOLR_CONNECT_TIMEOUT = float(os.getenv("SOLR_CONNECT_TIMEOUT", "5"))
+SOLR_READ_TIMEOUT = float(os.getenv("SOLR_READ_TIMEOUT", "60"))
+SOLR_POOL_TIMEOUT = float(os.getenv("SOLR_POOL_TIMEOUT", "10"))
+
+# Retries for idempotent requests: we wait SOLR_RETRY_BACKOFF seconds before the first retry, and double that
+# (with some jitter) for every subsequent retry.
+SOLR_MAX_RETRIES = int(os.getenv("SOLR_MAX_RETRIES", "2"))
+SOLR_RETRY_BACKOFF = float(os.getenv("SOLR_RETRY_BACKOFF", "0.1"))
+
+# Health checks: with more than one Solr node, we check every node this often (in seconds), and stop sending
+# requests to nodes that don't respond within SOLR_HEALTH_CHECK_TIMEOUT seconds. Set the interval to 0 to turn
+# health checks off.
+SOLR_HEALTH_CHECK_INTERVAL = float(os.getenv("SOLR_HEALTH_CHECK_INTERVAL", "5"))
+SOLR_HEALTH_CHECK_TIMEOUT = float(os.getenv("SOLR_HEALTH_CHECK_TIMEOUT", "2"))
+HEALTH_CHECK_PATH = "/solr/admin/cores"
+
+# Hedging: if turned on, a search that hasn't been answered within the SOLR_HEDGE_PERCENTILE percentile of recent
+# search latencies (but at least SOLR_HEDGE_MIN_DELAY seconds) is sent to a second node as well.
+SOLR_HEDGING = os.getenv("SOLR_HEDGING", "false").lower() == "true"
+SOLR_HEDGE_PERCENTILE = float(os.getenv("SOLR_HEDGE_PERCENTILE", "95"))
+SOLR_HEDGE_MIN_DELAY = float(os.getenv("SOLR_HEDGE_MIN_DELAY", "0.01"))
+
+# The number of recent search latencies to calculate the hedging delay from, the number we need before we start
+# hedging, and how often we recalculate the delay.
+HEDGE_LATENCY_WINDOW = 1000
+HEDGE_MIN_SAMPLES = 20
+HEDGE_RECALCULATE_EVERY = 50
+
+# Load shedding: at most SOLR_MAX_CONCURRENT_REQUESTS requests are sent to Solr at a time, and at most
+# SOLR_MAX_QUEUED_REQUESTS more can wait for a turn; requests beyond that are rejected immediately, and clients are
+# asked to retry after SOLR_OVERLOAD_RETRY_AFTER seconds. Set SOLR_MAX_CONCURRENT_REQUESTS to 0 to turn this off.
+SOLR_MAX_CONCURRENT_REQUESTS = int(os.getenv("SOLR_MAX_CONCURRENT_REQUESTS", "100"))
+SOLR_MAX_QUEUED_REQUESTS = int(os.getenv("SOLR_MAX_QUEUED_REQUESTS", "500"))
+SOLR_OVERLOAD_RETRY_AFTER = int(os.getenv("SOLR_OVERLOAD_RETRY_AFTER", "1"))
+
+# HTTP status codes that indicate a transient problem with Solr that is worth retrying.
+RETRYABLE_STATUS_CODES = {502, 503, 504}
+
+
+class SolrOverloaded(Exception):
+    """ Raised when there are too many requests waiting for Solr to accept another one. """
+
+
+def request_timeout() -> Optional[httpx.Timeout]:
+    """ The timeouts for a Solr request, shortened to the time remaining before the current request's deadline. """
+    time_remaining = remaining()
+    if time_remaining is None:
+        return None
+    return httpx.Timeout(
+        connect=min(SOLR_CONNECT_TIMEOUT, time_remaining),
+        read=min(SOLR_READ_TIMEOUT, time_remaining),
+        write=min(SOLR_READ_TIMEOUT, time_remaining),
+        pool=min(SOLR_POOL_TIMEOUT, time_remaining),
+    )
+
+
+def solr_endpoint_urls() -> List[str]:
+    """ Return the base URLs of the Solr nodes to use, from SOLR_ENDPOINTS or else SOLR_HOST and SOLR_PORT. """
+    endpoints = [endpoint.strip() for endpoint in SOLR_ENDPOINTS.split(',') if endpoint.strip()]
+    if not endpoints:
+        endpoints = [f"{SOLR_HOST}:{SOLR_PORT}"]
+    return [(endpoint if '://' in endpoint else f"http://{endpoint}").rstrip('/') for endpoint in endpoints]
+
+
+class SolrEndpoint:
+    """ A single Solr node, with its own connection pool, health and count of outstanding requests. """
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            limits=httpx.Limits(
+                max_connections=SOLR_MAX_CONNECTIONS,
+                max_keepalive_connections=SOLR_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=SOLR_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(
+                connect=SOLR_CONNECT_TIMEOUT,
+                read=SOLR_READ_TIMEOUT,
+                write=SOLR_READ_TIMEOUT,
+                pool=SOLR_POOL_TIMEOUT,
+            ),
+        )
+        self.healthy = True
+        self.outstanding = 0
+        self.requests = 0
+        self.errors = 0
+
+    async def request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        self.requests += 1
+        self.outstanding += 1
+        try:
+            return await self.client.request(method, path, **kwargs)
+        except httpx.TransportError:
+            self.errors += 1
+            raise
+        finally:
+            self.outstanding -= 1
+
+    async def check_health(self):
+        """ Check whether this node is up, using the same CoreAdmin call as /status. """
+        try:
+            response = await self.client.get(HEALTH_CHECK_PATH, params={'action': 'STATUS', 'indexInfo': 'false'},
+                                             timeout=SOLR_HEALTH_CHECK_TIMEOUT)
+            healthy = response.status_code == 200
+        except httpx.HTTPError:
+            healthy = False
+        if healthy != self.healthy:
+            LOGGER.warning("Solr node %s is now %s.", self.base_url, "healthy" if healthy else "unhealthy")
+        self.healthy = healthy
+
+    def connection_counts(self) -> Tuple[int, int]:
+        """ Return the number of connections in the pool, and how many of them are idle. """
+        # httpx doesn't expose its connection pool publicly, so we read it off the transport if we can.
+        connections = []
+        pool = getattr(getattr(self.client, '_transport', None), '_pool', None)
+        if pool is not None:
+            connections = list(getattr(pool, 'connections', []))
+        return len(connections), len([c for c in connections if c.is_idle()])
+
+    def stats(self) -> Dict:
+        connections, idle_connections = self.connection_counts()
+        return {
+            'base_url': self.base_url,
+            'healthy': self.healthy,
+            'outstanding': self.outstanding,
+            'requests': self.requests,
+            'errors': self.errors,
+            'connections': connections,
+            'idle_connections': idle_connections,
+        }
+
+
+class SolrClient:
+    """
+    A pooled, long-lived HTTP client for one or more Solr nodes serving the same collection.
+
+    All requests made through this client are treated as idempotent reads, and will be retried with exponential
+    backoff (on a different node, if there is one) if Solr can't be reached or reports a transient error.
+    """
+
+    def __init__(self, base_urls: List[str]):
+        self.endpoints = [SolrEndpoint(base_url) for base_url in base_urls]
+        self.base_url = ','.join(base_urls)
+        self.health_check_task: Optional[asyncio.Task] = None
+
+        # Limits the number of requests sent to Solr at the same time (see SOLR_MAX_CONCURRENT_REQUESTS).
+        self.semaphore = asyncio.Semaphore(SOLR_MAX_CONCURRENT_REQUESTS) if SOLR_MAX_CONCURRENT_REQUESTS > 0 else None
+        self.queued = 0
+        self.shed = 0
+
+        # Recent search latencies, and the hedging delay calculated from them.
+        self.latencies = collections.deque(maxlen=HEDGE_LATENCY_WINDOW)
+        self.hedge_delay: Optional[float] = None
+
+        # Counters for stats().
+        self.requests = 0
+        self.in_flight = 0
+        self.retries = 0
+        self.errors = 0
+        self.http_errors = 0
+        self.hedged_requests = 0
+        self.hedges_won = 0
+        self.hedges_skipped = 0
+
+    def start_health_checks(self):
+        """ Start checking the health of every node in the background, if there is more than one. """
+        if len(self.endpoints) > 1 and SOLR_HEALTH_CHECK_INTERVAL > 0 and self.health_check_task is None:
+            self.health_check_task = asyncio.create_task(self.health_check_loop())
+
+    async def health_check_loop(self):
+        while True:
+            await asyncio.gather(*(endpoint.check_health() for endpoint in self.endpoints))
+            await asyncio.sleep(SOLR_HEALTH_CHECK_INTERVAL)
+
+    def choose_endpoint(self, exclude: tuple = ()) -> Optional[SolrEndpoint]:
+        """
+        Choose the healthy node with the fewest outstanding requests (breaking ties at random), other than those in
+        exclude. If none of them are healthy, we choose from all of them rather than failing outright.
+        """
+        candidates = [endpoint for endpoint in self.endpoints if endpoint not in exclude]
+        healthy = [endpoint for endpoint in candidates if endpoint.healthy]
+        if healthy:
+            candidates = healthy
+        if not candidates:
+            return None
+        fewest = min(endpoint.outstanding for endpoint in candidates)
+        return random.choice([endpoint for endpoint in candidates if endpoint.outstanding == fewest])
+
+    def record_latency(self, latency: float):
+        """ Record the latency of a search, and recalculate the hedging delay every so often. """
+        self.latencies.append(latency)
+        if len(self.latencies) >= HEDGE_MIN_SAMPLES and \
+                (self.hedge_delay is None or len(self.latencies) % HEDGE_RECALCULATE_EVERY == 0):
+            latencies = sorted(self.latencies)
+            index = min(len(latencies) - 1, math.ceil(len(latencies) * SOLR_HEDGE_PERCENTILE / 100) - 1)
+            self.hedge_delay = max(SOLR_HEDGE_MIN_DELAY, latencies[max(index, 0)])
+
+    async def send(self, endpoint: SolrEndpoint, method: str, path: str, hedge: bool, **kwargs) -> httpx.Response:
+        """ Send a request to a node, and then hedge it to a second node if it takes too long. """
+        if not hedge or not SOLR_HEDGING:
+            return await endpoint.request(method, path, **kwargs)
+
+        start = time.perf_counter()
+        delay = self.hedge_delay
+        first = asyncio.ensure_future(endpoint.request(method, path, **kwargs))
+        tasks = {first}
+        try:
+            second_endpoint = self.choose_endpoint(exclude=(endpoint,)) if delay is not None else None
+            if second_endpoint is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                # A hedge is an extra request to Solr, so we only send it if we can do so without waiting for a turn.
+                if not done and not await self.try_acquire():
+                    self.hedges_skipped += 1
+                elif not done:
+                    self.hedged_requests += 1
+                    hedge_task = asyncio.ensure_future(second_endpoint.request(method, path, **kwargs))
+                    hedge_task.add_done_callback(lambda _: self.release())
+                    tasks.add(hedge_task)
+
+            # Use the first successful response, or else the last failure.
+            while True:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and task.result().status_code not in RETRYABLE_STATUS_CODES:
+                        if task is not first:
+                            self.hedges_won += 1
+                        self.record_latency(time.perf_counter() - start)
+                        return task.result()
+                if not tasks:
+                    return done.pop().result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def acquire(self):
+        """
+        Wait for a turn to send a request to Solr (see SOLR_MAX_CONCURRENT_REQUESTS), until the deadline of the current
+        request. If too many requests are already waiting, this raises SolrOverloaded immediately.
+        """
+        if self.semaphore is None:
+            return
+        if self.semaphore.locked() and self.queued >= SOLR_MAX_QUEUED_REQUESTS:
+            self.shed += 1
+            raise SolrOverloaded(f"{self.queued} requests are already waiting for Solr.")
+        self.queued += 1
+        try:
+            check_deadline()
+            await asyncio.wait_for(self.semaphore.acquire(), remaining())
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded("The deadline for this request passed while it was waiting for Solr.")
+        finally:
+            self.queued -= 1
+
+    async def try_acquire(self) -> bool:
+        """ Take a turn to send a request to Solr if one is free right now, without waiting or queueing for it. """
+        if self.semaphore is None:
+            return True
+        if self.semaphore.locked():
+            return False
+        # This returns straight away, since the semaphore isn't locked.
+        return await self.semaphore.acquire()
+
+    def release(self):
+        if self.semaphore is not None:
+            self.semaphore.release()
+
+    async def request(self, method: str, path: str, hedge: bool = False, **kwargs) -> httpx.Response:
+        """
+        Make a request to Solr, retrying transport errors and transient HTTP errors.
+
+        If the current request has a deadline (see api/deadlines.py), every timeout is shortened to the time remaining,
+        and DeadlineExceeded is raised instead of sending or retrying the request once it has passed.
+
+        :param method: The HTTP method to use.
+        :param path: The path to request, relative to the Solr base URL (e.g. `/solr/name_lookup/select`).
+        :param hedge: Whether this request may be hedged to a second node (see SOLR_HEDGING).
+        :return: The final httpx.Response. Callers are responsible for checking its status code.
+        """
+        await self.acquire()
+        self.requests += 1
+        self.in_flight += 1
+        try:
+            attempt = 0
+            endpoint = None
+            while True:
+                check_deadline()
+                timeout = request_timeout()
+                if timeout is not None:
+                    kwargs['timeout'] = timeout
+
+                # Retries go to a different node if there is one.
+                endpoint = self.choose_endpoint(exclude=(endpoint,)) or endpoint
+                try:
+                    response = await asyncio.wait_for(self.send(endpoint, method, path, hedge, **kwargs), remaining())
+                    if response.status_code not in RETRYABLE_STATUS_CODES or attempt >= SOLR_MAX_RETRIES:
+                        if response.status_code >= 400:
+                            self.http_errors += 1
+                        return response
+                    LOGGER.warning("Solr returned HTTP %d for %s, retrying (attempt %d of %d).",
+                                   response.status_code, path, attempt + 1, SOLR_MAX_RETRIES)
+                except asyncio.TimeoutError:
+                    raise DeadlineExceeded("Solr did not answer before the deadline for this request.")
+                except httpx.TransportError as err:
+                    # A timeout that was shortened by our deadline isn't the node's fault.
+                    if isinstance(err, httpx.TimeoutException) and timeout is not None:
+                        check_deadline()
+                    # With health checks running, we stop using this node until it passes one again (unless we were
+                    # asking for an absolute URL on another node, such as one from CLUSTERSTATUS).
+                    if self.health_check_task is not None and '://' not in path:
+                        endpoint.healthy = False
+                    if attempt >= SOLR_MAX_RETRIES:
+                        self.errors += 1
+                        raise
+                    LOGGER.warning("Could not connect to Solr at %s for %s (%s), retrying (attempt %d of %d).",
+                                   endpoint.base_url, path, err, attempt + 1, SOLR_MAX_RETRIES)
+
+                self.retries += 1
+                delay = SOLR_RETRY_BACKOFF * (2 ** attempt)
+                await asyncio.sleep(delay + random.uniform(0, delay))
+                attempt += 1
+        finally:
+            self.in_flight -= 1
+            self.release()
+
+    async def get(self, path: str, params: Optional[Dict] = None, hedge: bool = False) -> httpx.Response:
+        """ Make a GET request to Solr. """
+        return await self.request("GET", path, hedge=hedge, params=params)
+
+    async def post(self, path: str, json: Optional[Dict] = None, hedge: bool = False) -> httpx.Response:
+        """ Make a POST request to Solr. This should only be used for idempotent requests, such as selects. """
+        return await self.request("POST", path, hedge=hedge, json=json)
+
+    def stats(self) -> Dict:
+        """ Return statistics on this client, its connection pools and its nodes. """
+        endpoints = [endpoint.stats() for endpoint in self.endpoints]
+        return {
+            'base_url': self.base_url,
+            'requests': self.requests,
+            'in_flight': self.in_flight,
+            'retries': self.retries,
+            'errors': self.errors,
+            'http_errors': self.http_errors,
+            'hedged_requests': self.hedged_requests,
+            'hedges_won': self.hedges_won,
+            'hedges_skipped': self.hedges_skipped,
+            'hedge_delay': self.hedge_delay if SOLR_HEDGING else None,
+            'max_concurrent_requests': SOLR_MAX_CONCURRENT_REQUESTS,
+            'queued': self.queued,
+            'shed': self.shed,
+            'connections': sum(endpoint['connections'] for endpoint in endpoints),
+            'idle_connections': sum(endpoint['idle_connections'] for endpoint in endpoints),
+            'max_connections': SOLR_MAX_CONNECTIONS,
+            'max_keepalive_connections': SOLR_MAX_KEEPALIVE_CONNECTIONS,
+            'endpoints': endpoints,
+        }
+
+    async def aclose(self):
+        """ Stop the health checks and close all the connections in this client. """
+        if self.health_check_task is not None:
+            self.health_check_task.cancel()
+            self.health_check_task = None
+        for endpoint in self.endpoints:
+            await endpoint.client.aclose()
+
+
+# The shared Solr client, and the event loop it was created on.
+_solr_client: Optional[SolrClient] = None
+_solr_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+async def start_solr_client() -> SolrClient:
+    """ Create the shared Solr client. This should be called when the application starts up. """
+    global _solr_client, _solr_client_loop
+    if _solr_client is not None and _solr_client_loop is asyncio.get_running_loop():
+        await close_solr_client()
+    # A client created on a different event loop can't be closed from this one, so we just drop it.
+    _solr_client = SolrClient(solr_endpoint_urls())
+    _solr_client.start_health_checks()
+    _solr_client_loop = asyncio.get_running_loop()
+    LOGGER.info("Started Solr client for %s.", _solr_client.base_url)
+    return _solr_client
+
+
+async def close_solr_client():
+    """ Close the shared Solr client. This should be called when the application shuts down. """
+    global _solr_client, _solr_client_loop
+    if _solr_client is not None:
+        client = _solr_client
+        _solr_client = None
+        _solr_client_loop = None
+        await client.aclose()
+
+
+async def get_solr_client() -> SolrClient:
+    """
+    Return the shared Solr client.
+
+    This will normally have been created by the application lifespan, but if it hasn't (e.g. if the application
+    is being run without its lifespan, as the FastAPI TestClient does when not used as a context manager), or if
+    we are now running on a different event loop than the one the client was created on, we create a new one.
+    """
+    if _solr_client is None or _solr_client_loop is not asyncio.get_running_loop():
+        return await start_solr_client()
+    return _solr_client
+
+
+def solr_client_stats() -> Optional[Dict]:
+    """ Return statistics on the shared Solr client, or None if it hasn't been created yet. """
+    if _solr_client is None:
+        return None
+    return _solr_client.stats()
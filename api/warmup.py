@@ -0,0 +1,240 @@
+"""
+Cache warm-up from a log of frequent lookups.
+
+After a restart or an index swap, both Solr's caches and our own are empty, and the first few minutes of traffic are
+much slower than usual. To avoid this, NameRes can record a sample of the lookups it answers in a query log, and
+replay the most frequent of them when it starts up and whenever the index changes.
+
+The query log is privacy-safe: it only records the normalized arguments to lookup() (the lowercased search string,
+filters and paging) and how often they were sampled -- never who made a request or when. Lookups are only written to
+the log once they have been sampled at least QUERY_LOG_MIN_COUNT times, so rare (and possibly identifying) searches
+never reach the disk.
+
+Several worker processes can share a query log: each one merges its counts into the file when it flushes them.
+Counts may occasionally be lost if two processes flush at the same moment, which doesn't matter for a sample.
+
+To list the most frequent search strings (e.g. for solr-restore/warmup-queries.txt):
+    python -m api.warmup query-log.jsonl
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+from collections import Counter
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+LOGGER = logging.getLogger(__name__)
+
+# Where to keep the query log. If not set, we don't record lookups, but can still warm up from an existing log.
+QUERY_LOG_PATH = os.getenv("QUERY_LOG_PATH", "")
+# The fraction of lookups to record.
+QUERY_LOG_SAMPLE_RATE = float(os.getenv("QUERY_LOG_SAMPLE_RATE", "0.01"))
+# The number of times a lookup needs to be sampled before it is written to the log.
+QUERY_LOG_MIN_COUNT = int(os.getenv("QUERY_LOG_MIN_COUNT", "3"))
+# How often to write the sampled lookups to the log (in seconds).
+QUERY_LOG_FLUSH_INTERVAL = float(os.getenv("QUERY_LOG_FLUSH_INTERVAL", "300"))
+# The maximum number of lookups to keep in the log.
+QUERY_LOG_MAX_ENTRIES = int(os.getenv("QUERY_LOG_MAX_ENTRIES", "10000"))
+# Longer search strings are never recorded.
+QUERY_LOG_MAX_STRING_LENGTH = 100
+
+# The number of lookups to replay when warming up, how many to run at once, and how long to spend on it (in
+# seconds) before giving up.
+WARMUP_QUERIES = int(os.getenv("WARMUP_QUERIES", "1000"))
+WARMUP_CONCURRENCY = int(os.getenv("WARMUP_CONCURRENCY", "4"))
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "300"))
+
+# A lookup as recorded in the query log: the search string, autocomplete, highlighting, offset, limit, the normalized
+# filters (Biolink types, only_prefixes, exclude_prefixes and only_taxa), the result fields and max_synonyms.
+LookupKey = Tuple
+
+# Set while we are replaying lookups, so that we don't record them again.
+_warming = contextvars.ContextVar('warming', default=False)
+
+
+class QueryLog:
+    """ Sampled counts of lookups, which are periodically merged into the query log file. """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.counts = Counter()
+        self.sampled = 0
+        self.flushes = 0
+
+    def record(self, key: LookupKey):
+        """ Record a lookup, if it is sampled. """
+        if not self.path or _warming.get() or random.random() >= QUERY_LOG_SAMPLE_RATE:
+            return
+        if len(key[0]) > QUERY_LOG_MAX_STRING_LENGTH:
+            return
+        self.counts[key] += 1
+        self.sampled += 1
+        # Don't let lookups that are never repeated build up in memory.
+        if len(self.counts) > 2 * QUERY_LOG_MAX_ENTRIES:
+            self.counts = Counter(dict(self.counts.most_common(QUERY_LOG_MAX_ENTRIES)))
+
+    def flush(self):
+        """ Merge our counts into the query log file, writing out the lookups that have been sampled often enough. """
+        if not self.path or not self.counts:
+            return
+        merged = Counter(read_query_log(self.path))
+        merged.update(self.counts)
+        entries = [(key, count) for key, count in merged.most_common(QUERY_LOG_MAX_ENTRIES)
+                   if count >= QUERY_LOG_MIN_COUNT]
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', dir=directory, delete=False, encoding='utf-8') as f:
+            for key, count in entries:
+                f.write(json.dumps({'count': count, 'lookup': key}, ensure_ascii=False) + '\n')
+        os.replace(f.name, self.path)
+
+        # Lookups that are now in the file don't need to be counted again; the rest wait until they are sampled
+        # often enough.
+        written = {key for key, _ in entries}
+        self.counts = Counter({key: count for key, count in self.counts.items() if key not in written})
+        self.flushes += 1
+
+
+def read_query_log(path: str) -> Dict[LookupKey, int]:
+    """ Read a query log, returning the count of every lookup in it. """
+    counts = {}
+    if not path or not os.path.exists(path):
+        return counts
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            counts[lookup_key(entry['lookup'])] = entry['count']
+    return counts
+
+
+def lookup_key(value: list) -> LookupKey:
+    """ Convert a lookup read from JSON back into a (hashable) LookupKey. """
+    string_lc, autocomplete, highlighting, offset, limit, filter_args, result_fields, max_synonyms = value
+    return (string_lc, autocomplete, highlighting, offset, limit, tuple(tuple(values) for values in filter_args),
+            tuple(result_fields) if result_fields is not None else None, max_synonyms)
+
+
+QUERY_LOG = QueryLog(QUERY_LOG_PATH)
+
+
+def record_lookup(key: LookupKey):
+    """ Record a lookup in the query log (if it is sampled). """
+    QUERY_LOG.record(key)
+
+
+async def flush_query_log_periodically():
+    """ Write the sampled lookups to the query log every QUERY_LOG_FLUSH_INTERVAL seconds. """
+    while True:
+        await asyncio.sleep(QUERY_LOG_FLUSH_INTERVAL)
+        try:
+            await asyncio.to_thread(QUERY_LOG.flush)
+        except Exception as err:
+            LOGGER.warning("Could not write the query log to %s: %s", QUERY_LOG.path, err)
+
+
+class WarmUp:
+    """ Replays the most frequent lookups in the query log, and keeps track of whether we have warmed up yet. """
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        # We are ready once our first warm-up has finished (or if there is nothing to warm up from).
+        self.ready = False
+        self.runs = 0
+        self.lookups = 0
+        self.errors = 0
+        self.last_duration: Optional[float] = None
+
+    def start(self, lookup: Callable[..., Awaitable[List[Dict]]], reason: str):
+        """ Start warming up in the background, replacing any warm-up that is already running. """
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+        self.task = asyncio.create_task(self.run(lookup, reason))
+
+    async def run(self, lookup: Callable[..., Awaitable[List[Dict]]], reason: str):
+        start = time.perf_counter()
+        try:
+            counts = await asyncio.to_thread(read_query_log, QUERY_LOG_PATH)
+            keys = [key for key, _ in Counter(counts).most_common(WARMUP_QUERIES)]
+            if not keys:
+                return
+            LOGGER.info("Warming up with %d lookups from %s (%s).", len(keys), QUERY_LOG_PATH, reason)
+            self.runs += 1
+            semaphore = asyncio.Semaphore(WARMUP_CONCURRENCY)
+
+            async def replay(key: LookupKey):
+                async with semaphore:
+                    try:
+                        await replay_lookup(lookup, key)
+                        self.lookups += 1
+                    except Exception as err:
+                        self.errors += 1
+                        LOGGER.debug("Warm-up lookup for '%s' failed: %s", key[0], err)
+
+            await asyncio.wait_for(asyncio.gather(*(replay(key) for key in keys)), WARMUP_TIMEOUT)
+            self.last_duration = time.perf_counter() - start
+            LOGGER.info("Warmed up in %.1f seconds (%d errors).", self.last_duration, self.errors)
+        except asyncio.TimeoutError:
+            LOGGER.warning("Warm-up did not finish within %.0f seconds.", WARMUP_TIMEOUT)
+        except Exception as err:
+            LOGGER.warning("Could not warm up from %s: %s", QUERY_LOG_PATH, err)
+        finally:
+            self.ready = True
+
+    def cancel(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def stats(self) -> Dict:
+        return {
+            'ready': self.ready,
+            'running': self.task is not None and not self.task.done(),
+            'runs': self.runs,
+            'lookups': self.lookups,
+            'errors': self.errors,
+            'last_duration': self.last_duration,
+            'query_log': QUERY_LOG_PATH or None,
+            'sampled': QUERY_LOG.sampled,
+            'pending': len(QUERY_LOG.counts),
+        }
+
+
+WARM_UP = WarmUp()
+
+
+async def replay_lookup(lookup: Callable[..., Awaitable[List[Dict]]], key: LookupKey):
+    """ Replay a lookup from the query log, without recording it again. """
+    string_lc, autocomplete, highlighting, offset, limit, filter_args, result_fields, max_synonyms = key
+    biolink_types, only_prefixes, exclude_prefixes, only_taxa = filter_args
+    token = _warming.set(True)
+    try:
+        await lookup(string_lc, autocomplete, highlighting, offset, limit, list(biolink_types),
+                     '|'.join(only_prefixes), '|'.join(exclude_prefixes), '|'.join(only_taxa),
+                     list(result_fields) if result_fields else None, max_synonyms)
+    finally:
+        _warming.reset(token)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List the most frequent search strings in a query log.")
+    parser.add_argument('query_log', help="The query log to read.")
+    parser.add_argument('--count', type=int, default=1000, help="The number of search strings to list.")
+    args = parser.parse_args()
+
+    strings = Counter()
+    for key, count in read_query_log(args.query_log).items():
+        strings[key[0]] += count
+    for string, _ in strings.most_common(args.count):
+        print(string)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+"""
+A load test driver for NameRes.
+
+This replays a mix of queries against the /lookup, /bulk-lookup and /synonyms endpoints of a running NameRes
+instance at one or more concurrency levels, and reports the throughput and latency distribution for each endpoint.
+If NameRes is running against the stub Solr in benchmarks/stub_solr.py, it also reports how much of each request
+was spent in Solr and how much in NameRes itself.
+
+Results are written as JSON so that they can be compared between releases.
+
+Usage:
+    # Start a stub Solr and NameRes, run the benchmark and shut them both down again.
+    python benchmarks/load_test.py --spawn --output bench-results.json
+
+    # Or run against a NameRes instance that is already running.
+    python benchmarks/load_test.py --url http://localhost:2433 --stub-url http://localhost:8983
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+REPO_ROOT = Path(__file__).parent.parent
+DEFAULT_SYNONYMS = REPO_ROOT / 'tests' / 'data' / 'test-synonyms.json'
+ENDPOINTS = ['lookup', 'bulk-lookup', 'synonyms']
+
+# Upper bounds (in milliseconds) of the latency histogram buckets.
+HISTOGRAM_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+
+
+def load_query_mix(path: Optional[str], synonyms_path: Path, bulk_size: int, seed: int) -> Dict[str, List[Dict]]:
+    """
+    Load a query mix, keyed by endpoint.
+
+    A query mix file is a JSON Lines file where each line is an object with an `endpoint` (one of `lookup`,
+    `bulk-lookup` or `synonyms`) and `params` (the query parameters or JSON body to send). If no file is provided,
+    we generate a mix from a Babel synonyms file: full names and autocomplete prefixes for /lookup, batches of names
+    for /bulk-lookup and CURIEs for /synonyms.
+    """
+    mix = {endpoint: [] for endpoint in ENDPOINTS}
+    if path:
+        with open(path, 'r') as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    mix[entry['endpoint']].append(entry['params'])
+        return mix
+
+    with open(synonyms_path, 'r') as f:
+        if synonyms_path.suffix == '.json':
+            records = json.load(f)
+        else:
+            records = [json.loads(line) for line in f if line.strip()]
+
+    rng = random.Random(seed)
+    names = [name for record in records for name in record.get('names', [])]
+    for name in names:
+        mix['lookup'].append({'string': name, 'autocomplete': 'false'})
+        mix['lookup'].append({'string': name[:rng.randint(1, max(1, len(name)))], 'autocomplete': 'true'})
+    for i in range(0, len(names), bulk_size):
+        mix['bulk-lookup'].append({'strings': names[i:i + bulk_size], 'limit': 10})
+    for record in records:
+        mix['synonyms'].append({'preferred_curies': [record['curie']]})
+
+    for queries in mix.values():
+        rng.shuffle(queries)
+    return mix
+
+
+async def send(client: httpx.AsyncClient, endpoint: str, params: Dict) -> httpx.Response:
+    """ Send a single query to NameRes. """
+    if endpoint == 'bulk-lookup':
+        return await client.post('/bulk-lookup', json=params)
+    if endpoint == 'synonyms':
+        return await client.get('/synonyms', params=params)
+    return await client.get('/lookup', params=params)
+
+
+async def run_level(client: httpx.AsyncClient, endpoint: str, queries: List[Dict], concurrency: int,
+                    requests: int) -> Dict:
+    """ Send `requests` queries to an endpoint with `concurrency` workers, and return the measurements. """
+    latencies = []
+    errors = 0
+    next_query = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for i in next_query:
+            start = time.perf_counter()
+            try:
+                response = await send(client, endpoint, queries[i % len(queries)])
+                if response.status_code >= 300:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+
+    latencies_ms = sorted(latency * 1000 for latency in latencies)
+    histogram = {}
+    for bucket in HISTOGRAM_BUCKETS_MS:
+        histogram[f"le_{bucket}ms"] = len([latency for latency in latencies_ms if latency <= bucket])
+    histogram['le_inf'] = len(latencies_ms)
+
+    def percentile(p: float) -> float:
+        return latencies_ms[min(len(latencies_ms) - 1, int(len(latencies_ms) * p))]
+
+    return {
+        'endpoint': endpoint,
+        'concurrency': concurrency,
+        'requests': len(latencies_ms),
+        'errors': errors,
+        'elapsed_s': elapsed,
+        'throughput_rps': len(latencies_ms) / elapsed if elapsed else 0.0,
+        'latency_ms': {
+            'mean': statistics.fmean(latencies_ms),
+            'min': latencies_ms[0],
+            'p50': percentile(0.50),
+            'p90': percentile(0.90),
+            'p99': percentile(0.99),
+            'max': latencies_ms[-1],
+        },
+        'histogram': histogram,
+    }
+
+
+async def cache_stats(client: httpx.AsyncClient) -> Optional[Dict[str, Dict]]:
+    """ Return the statistics NameRes reports for its in-process caches, or None if it doesn't report them. """
+    try:
+        response = await client.get('/status')
+        return response.json().get('caches')
+    except (httpx.HTTPError, ValueError):
+        return None
+
+
+def cache_hit_rates(before: Optional[Dict[str, Dict]], after: Optional[Dict[str, Dict]]) -> Optional[Dict]:
+    """ Calculate the hit rate of every cache between two sets of cache statistics. """
+    if not before or not after:
+        return None
+    hit_rates = {}
+    for name, stats in after.items():
+        hits = stats['hits'] - before.get(name, {}).get('hits', 0)
+        misses = stats['misses'] - before.get(name, {}).get('misses', 0)
+        hit_rates[name] = hits / (hits + misses) if hits + misses else None
+    return hit_rates
+
+
+def solr_ms_per_request(stub_stats: Dict, requests: int, concurrency: int) -> Optional[float]:
+    """
+    Return how long the stub Solr spent on each request, or None if we can't tell.
+
+    If each request sends at most one query, this is the total time spent on queries divided by the number of
+    requests. A request that sends several queries at once (e.g. a bulk lookup) only waits for them as long as they
+    overlap, which is the stub's busy time as long as no other request was running at the same time (concurrency 1).
+    """
+    if stub_stats['queries'] <= requests:
+        return stub_stats['service_time'] * 1000 / requests
+    if concurrency == 1:
+        return stub_stats['busy_time'] * 1000 / requests
+    return None
+
+
+async def run_benchmark(args) -> Dict:
+    mix = load_query_mix(args.queries, Path(args.synonyms), args.bulk_size, args.seed)
+    results = []
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout) as client, \
+            httpx.AsyncClient(base_url=args.stub_url or 'http://unused', timeout=args.timeout) as stub_client:
+        caches = await cache_stats(client)
+        for endpoint in args.endpoints:
+            if not mix[endpoint]:
+                print(f"No queries for /{endpoint}, skipping.", file=sys.stderr)
+                continue
+
+            # Warm up, so that we don't measure connection setup.
+            await run_level(client, endpoint, mix[endpoint], 1, min(args.warmup, len(mix[endpoint])))
+
+            for concurrency in args.concurrency:
+                if args.stub_url:
+                    await stub_client.post('/stub/reset')
+                caches_before = await cache_stats(client)
+                result = await run_level(client, endpoint, mix[endpoint], concurrency, args.requests)
+                result['cache_hit_rates'] = cache_hit_rates(caches_before, await cache_stats(client))
+
+                # If we know how long Solr took, the rest of the time was spent in NameRes.
+                if args.stub_url:
+                    stub_stats = (await stub_client.get('/stub/stats')).json()
+                    result['solr_queries_per_request'] = stub_stats['queries'] / result['requests']
+                    solr_ms = solr_ms_per_request(stub_stats, result['requests'], concurrency)
+                    result['solr_ms_per_request'] = solr_ms
+                    result['python_overhead_ms_per_request'] = \
+                        result['latency_ms']['mean'] - solr_ms if solr_ms is not None else None
+
+                results.append(result)
+                overhead = result.get('python_overhead_ms_per_request')
+                print(f"/{endpoint} concurrency={concurrency}: {result['throughput_rps']:.1f} req/s, "
+                      f"p50={result['latency_ms']['p50']:.1f}ms p99={result['latency_ms']['p99']:.1f}ms, "
+                      f"overhead={overhead if overhead is not None else float('nan'):.1f}ms, "
+                      f"cache hit rates={result['cache_hit_rates']}, "
+                      f"errors={result['errors']}", file=sys.stderr)
+
+    return {
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'git_commit': git_commit(),
+        'settings': {
+            'url': args.url,
+            'stub_url': args.stub_url,
+            'queries': args.queries or str(args.synonyms),
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'bulk_size': args.bulk_size,
+            'seed': args.seed,
+            'stub_latency_ms': args.stub_latency_ms if args.spawn else None,
+            'caches': {
+                name: {'max_size': stats['max_size'], 'ttl': stats['ttl']} for name, stats in caches.items()
+            } if caches else None,
+        },
+        'results': results,
+    }
+
+
+def git_commit() -> Optional[str]:
+    """ Return the current git commit of this repository, if we can. """
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def wait_for(url: str, timeout: float = 30):
+    """ Wait for a URL to respond. """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not start within {timeout} seconds.")
+
+
+def spawn(args) -> List[subprocess.Popen]:
+    """ Start a stub Solr and a NameRes instance pointing at it. """
+    stub_port, nameres_port = args.stub_port, args.nameres_port
+    stub = subprocess.Popen([
+        sys.executable, str(REPO_ROOT / 'benchmarks' / 'stub_solr.py'),
+        '--port', str(stub_port),
+        '--latency-ms', str(args.stub_latency_ms),
+        '--names-per-doc', str(args.stub_names_per_doc),
+    ])
+    env = dict(os.environ, SOLR_HOST='127.0.0.1', SOLR_PORT=str(stub_port))
+    # Every concurrency level replays the same query mix, so with the in-process caches turned on every level after
+    # the first would measure cache hits rather than NameRes and Solr.
+    if not args.with_caches:
+        env.update(LOOKUP_CACHE_SIZE='0', SYNONYMS_CACHE_SIZE='0')
+    nameres = subprocess.Popen([
+        sys.executable, '-m', 'uvicorn', 'api.server:app',
+        '--host', '127.0.0.1', '--port', str(nameres_port), '--log-level', 'warning',
+    ], cwd=REPO_ROOT, env=env)
+
+    args.url = f"http://127.0.0.1:{nameres_port}"
+    args.stub_url = f"http://127.0.0.1:{stub_port}"
+    wait_for(f"{args.stub_url}/stub/stats")
+    wait_for(f"{args.url}/openapi.json")
+    return [nameres, stub]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the throughput and latency of a NameRes instance.")
+    parser.add_argument('--url', default='http://localhost:2433', help="The NameRes instance to test.")
+    parser.add_argument('--stub-url', help="The stub Solr that NameRes is using, to measure NameRes overhead.")
+    parser.add_argument('--spawn', action='store_true',
+                        help="Start a stub Solr and NameRes instance for this benchmark (overrides --url and --stub-url).")
+    parser.add_argument('--stub-port', type=int, default=18983, help="The port for the stub Solr with --spawn.")
+    parser.add_argument('--nameres-port', type=int, default=12433, help="The port for NameRes with --spawn.")
+    parser.add_argument('--stub-latency-ms', type=float, default=5.0, help="The stub Solr latency with --spawn.")
+    parser.add_argument('--stub-names-per-doc', type=int, default=20,
+                        help="The number of synonyms per stub Solr document with --spawn.")
+    parser.add_argument('--with-caches', action='store_true',
+                        help="Leave the in-process caches of the NameRes started with --spawn turned on.")
+    parser.add_argument('--queries', help="A JSON Lines file containing the query mix to replay.")
+    parser.add_argument('--synonyms', default=str(DEFAULT_SYNONYMS),
+                        help="A Babel synonyms file to generate a query mix from, if --queries is not provided.")
+    parser.add_argument('--endpoints', nargs='+', choices=ENDPOINTS, default=ENDPOINTS,
+                        help="The endpoints to test.")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32],
+                        help="The concurrency levels to test.")
+    parser.add_argument('--requests', type=int, default=500, help="The number of requests per concurrency level.")
+    parser.add_argument('--warmup', type=int, default=20, help="The number of warm-up requests per endpoint.")
+    parser.add_argument('--bulk-size', type=int, default=20, help="The number of strings per /bulk-lookup request.")
+    parser.add_argument('--timeout', type=float, default=60, help="The request timeout in seconds.")
+    parser.add_argument('--seed', type=int, default=42, help="The random seed for generating the query mix.")
+    parser.add_argument('--output', help="Write the results to this JSON file.")
+    args = parser.parse_args()
+
+    processes = spawn(args) if args.spawn else []
+    try:
+        report = asyncio.run(run_benchmark(args))
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+"""
+A stub Solr server for benchmarking NameRes.
+
+This serves just enough of the Solr API for NameRes to run against it:
+  - /solr/name_lookup/select returns synthetic documents after a configurable delay.
+  - /solr/admin/cores returns a status report for a single name_lookup core.
+
+Responses don't depend on the query except for their size (the number of rows requested) and the CURIEs requested
+in a `{!terms f=curie}` query, so the time NameRes spends on each request can be separated from Solr's time. The stub
+keeps track of how many queries it has answered, the total time it spent on them (service_time) and the wall-clock
+time during which at least one query was in progress (busy_time), which can be read from /stub/stats and reset by
+POSTing to /stub/reset. When queries overlap (e.g. the concurrent queries of a bulk lookup), service_time counts
+each of them in full, while busy_time only counts the time they overlap once.
+
+Usage: python benchmarks/stub_solr.py --port 8983 --latency-ms 5 --names-per-doc 20
+"""
+import argparse
+import asyncio
+import random
+import time
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+
+class StubSolr:
+    """ Generates synthetic Solr responses and keeps track of how much time was spent producing them. """
+
+    def __init__(self, latency_ms: float, latency_jitter_ms: float, max_docs: int, names_per_doc: int,
+                 name_length: int):
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.max_docs = max_docs
+        self.names_per_doc = names_per_doc
+        self.name_length = name_length
+        self.reset()
+
+    def reset(self):
+        self.queries = 0
+        self.service_time = 0.0
+        self.busy_time = 0.0
+        self.active = 0
+        self.busy_since = 0.0
+
+    def doc(self, curie: str, index: int) -> dict:
+        """ Return a synthetic Solr document. """
+        names = [f"{curie} synonym {i} ".ljust(self.name_length, 'x') for i in range(self.names_per_doc)]
+        return {
+            'id': f"stub-{curie}",
+            'curie': curie,
+            'curie_suffix': index,
+            'preferred_name': names[0] if names else curie,
+            'names': names,
+            'types': ['Disease', 'DiseaseOrPhenotypicFeature', 'NamedThing'],
+            'taxa': ['NCBITaxon:9606'],
+            'shortest_name_length': min((len(name) for name in names), default=0),
+            'clique_identifier_count': index % 10 + 1,
+            'score': 100.0 / (index + 1),
+        }
+
+    async def select(self, request: Request) -> JSONResponse:
+        start = time.perf_counter()
+        if self.active == 0:
+            self.busy_since = start
+        self.active += 1
+
+        params = dict(request.query_params)
+        if request.method == 'POST':
+            params.update(await request.json())
+        query = params.get('query', params.get('q', ''))
+        if not isinstance(query, str):
+            query = ''
+
+        if query.startswith('{!terms f=curie}'):
+            curies = query[len('{!terms f=curie}'):].split(',')
+            docs = [self.doc(curie, index) for index, curie in enumerate(curies)]
+        else:
+            rows = int(params.get('limit', params.get('rows', 10)))
+            offset = int(params.get('offset', params.get('start', 0)))
+            docs = [self.doc(f"STUB:{offset + i}", offset + i) for i in range(min(rows, self.max_docs))]
+
+        delay_ms = max(0.0, random.gauss(self.latency_ms, self.latency_jitter_ms))
+        await asyncio.sleep(delay_ms / 1000)
+
+        response = {
+            'responseHeader': {'status': 0, 'QTime': int(delay_ms)},
+            'response': {'numFound': len(docs), 'start': 0, 'docs': docs},
+        }
+        end = time.perf_counter()
+        self.queries += 1
+        self.service_time += end - start
+        self.active -= 1
+        if self.active == 0:
+            self.busy_time += end - self.busy_since
+        return JSONResponse(response)
+
+    async def cores(self, request: Request) -> JSONResponse:
+        return JSONResponse({
+            'status': {
+                'name_lookup_shard1_replica_n1': {
+                    'name': 'name_lookup_shard1_replica_n1',
+                    'startTime': '2024-01-01T00:00:00.000Z',
+                    'index': {
+                        'numDocs': 1000000,
+                        'maxDoc': 1000000,
+                        'deletedDocs': 0,
+                        'version': 1,
+                        'segmentCount': 1,
+                        'lastModified': '2024-01-01T00:00:00.000Z',
+                        'size': '1 GB',
+                    },
+                },
+            },
+        })
+
+    async def stats(self, request: Request) -> JSONResponse:
+        return JSONResponse({'queries': self.queries, 'service_time': self.service_time, 'busy_time': self.busy_time})
+
+    async def reset_stats(self, request: Request) -> JSONResponse:
+        self.reset()
+        return JSONResponse({'queries': self.queries, 'service_time': self.service_time, 'busy_time': self.busy_time})
+
+
+def create_app(stub: StubSolr) -> Starlette:
+    return Starlette(routes=[
+        Route('/solr/name_lookup/select', stub.select, methods=['GET', 'POST']),
+        Route('/solr/admin/cores', stub.cores, methods=['GET']),
+        Route('/stub/stats', stub.stats, methods=['GET']),
+        Route('/stub/reset', stub.reset_stats, methods=['POST']),
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="A stub Solr server for benchmarking NameRes.")
+    parser.add_argument('--host', default='127.0.0.1', help="The host to listen on.")
+    parser.add_argument('--port', type=int, default=8983, help="The port to listen on.")
+    parser.add_argument('--latency-ms', type=float, default=5.0, help="The mean query latency in milliseconds.")
+    parser.add_argument('--latency-jitter-ms', type=float, default=1.0,
+                        help="The standard deviation of the query latency in milliseconds.")
+    parser.add_argument('--max-docs', type=int, default=1000,
+                        help="The maximum number of documents to return for a query.")
+    parser.add_argument('--names-per-doc', type=int, default=20, help="The number of synonyms in each document.")
+    parser.add_argument('--name-length', type=int, default=30, help="The length of each synonym.")
+    args = parser.parse_args()
+
+    stub = StubSolr(args.latency_ms, args.latency_jitter_ms, args.max_docs, args.names_per_doc, args.name_length)
+    uvicorn.run(create_app(stub), host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+"""
+Update an existing name_lookup collection from one Babel release to the next.
+
+Most cliques don't change between Babel releases, so rather than rebuilding the whole index we can work out which
+cliques were added, changed or removed, and only send those to Solr. This happens in two steps:
+
+1. `diff` preprocesses the new synonym files (see preprocess_synonyms.py) and compares the content hash of every
+   clique with a manifest of content hashes from the previous release. It writes out:
+     - `upserts-NNNNN.txt.gz`: the added and changed cliques, as preprocessed JSON Lines.
+     - `deletes.txt`: the CURIEs of the removed cliques.
+     - `manifest.tsv.gz`: the manifest for the new release, which will be the previous manifest next time.
+     - `summary.json`: the number of added, changed, removed and unchanged cliques, and the number of duplicate
+       records for the same CURIE in the new release (only the last of which is used).
+   If there is no previous manifest, every clique is added. With `--manifest-only`, only the manifest is written,
+   which is how a full build records a manifest for the next release to be compared with.
+
+2. `apply` sends the upserts to Solr with load_synonyms.py and deletes the removed cliques by ID.
+
+This relies on documents having their CURIE as their ID, which is the case for collections loaded from
+preprocessed synonym files.
+
+To keep memory use low with tens of millions of cliques, the manifests and new cliques are split into buckets by
+a hash of the CURIE, and each bucket is compared separately.
+
+Usage:
+    python delta_synonyms.py diff "data/synonyms/*.txt*" data/delta --previous-manifest previous/manifest.tsv.gz
+    python delta_synonyms.py apply data/delta --solr-url http://localhost:8983/solr/name_lookup
+"""
+import argparse
+import glob
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+import zlib
+from collections import Counter
+from typing import Dict, List, Optional
+
+from load_synonyms import Checkpoint, Loader
+from preprocess_synonyms import ChunkWriter, preprocess_record, read_blocks
+
+LOGGER = logging.getLogger('delta_synonyms')
+
+# The number of buckets to split cliques into while comparing releases.
+BUCKETS = 256
+
+
+def content_hash(record: Dict) -> str:
+    """ Return a hash of the content of a preprocessed record. """
+    canonical = json.dumps(record, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.blake2b(canonical.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def bucket_of(curie: str) -> int:
+    return zlib.crc32(curie.encode('utf-8')) % BUCKETS
+
+
+def diff(paths: List[str], output_dir: str, previous_manifest: Optional[str], chunk_size: int,
+         manifest_only: bool = False) -> Dict:
+    """ Compare a new release with the previous manifest, and write out the changes (see the top of this file). """
+    os.makedirs(output_dir, exist_ok=True)
+    if glob.glob(os.path.join(output_dir, '*')):
+        raise FileExistsError(f"{output_dir} is not empty.")
+
+    start = time.perf_counter()
+    stats = Counter()
+    with tempfile.TemporaryDirectory(dir=output_dir) as tempdir:
+        # Split the previous manifest and the new cliques into buckets.
+        old_buckets = [open(os.path.join(tempdir, f'old-{i}'), 'w', encoding='utf-8') for i in range(BUCKETS)]
+        if previous_manifest:
+            with gzip.open(previous_manifest, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    curie, _ = line.rstrip('\n').split('\t')
+                    old_buckets[bucket_of(curie)].write(line)
+        for bucket in old_buckets:
+            bucket.close()
+
+        new_buckets = [open(os.path.join(tempdir, f'new-{i}'), 'w', encoding='utf-8') for i in range(BUCKETS)]
+        for path in paths:
+            LOGGER.info("Reading %s...", path)
+            for block in read_blocks(path, 10000):
+                for line in block:
+                    if not line.strip():
+                        continue
+                    record = preprocess_record(json.loads(line), stats)
+                    if record is None:
+                        continue
+                    record_json = json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+                    new_buckets[bucket_of(record['curie'])].write(
+                        f"{record['curie']}\t{content_hash(record)}\t{record_json}\n")
+        for bucket in new_buckets:
+            bucket.close()
+
+        # Compare each bucket.
+        writer = ChunkWriter(output_dir, chunk_size, prefix='upserts')
+        with gzip.open(os.path.join(output_dir, 'manifest.tsv.gz'), 'wt', encoding='utf-8') as manifest, \
+                open(os.path.join(output_dir, 'deletes.txt'), 'w', encoding='utf-8') as deletes:
+            for i in range(BUCKETS):
+                with open(os.path.join(tempdir, f'old-{i}'), 'r', encoding='utf-8') as f:
+                    old_hashes = dict(line.rstrip('\n').split('\t') for line in f)
+                os.remove(os.path.join(tempdir, f'old-{i}'))
+
+                # Every copy of a CURIE is in the same bucket. If a CURIE appears more than once in the new release, we
+                # keep the last copy, since that is the one that a full load would leave in Solr.
+                new_records = {}
+                with open(os.path.join(tempdir, f'new-{i}'), 'r', encoding='utf-8') as f:
+                    for line in f:
+                        curie, new_hash, record_json = line.rstrip('\n').split('\t', 2)
+                        if curie in new_records:
+                            stats['duplicates'] += 1
+                            LOGGER.warning("%s appears more than once in the new release; using its last record.",
+                                           curie)
+                        new_records[curie] = (new_hash, record_json)
+                os.remove(os.path.join(tempdir, f'new-{i}'))
+
+                upserts = []
+                for curie, (new_hash, record_json) in new_records.items():
+                    old_hash = old_hashes.pop(curie, None)
+                    if old_hash is None:
+                        stats['added'] += 1
+                        upserts.append(record_json)
+                    elif old_hash != new_hash:
+                        stats['changed'] += 1
+                        upserts.append(record_json)
+                    else:
+                        stats['unchanged'] += 1
+                    manifest.write(f"{curie}\t{new_hash}\n")
+
+                # Anything left in the old manifest is no longer in this release.
+                for curie in old_hashes:
+                    deletes.write(curie + '\n')
+                stats['removed'] += len(old_hashes)
+
+                if upserts and not manifest_only:
+                    data = ('\n'.join(upserts) + '\n').encode('utf-8')
+                    writer.write(gzip.compress(data, compresslevel=6), len(data))
+        writer.close()
+
+    summary = {
+        'previous_manifest': previous_manifest,
+        'files': paths,
+        'added': stats['added'],
+        'changed': stats['changed'],
+        'removed': stats['removed'],
+        'unchanged': stats['unchanged'],
+        'duplicates': stats['duplicates'],
+        'upsert_chunks': len(writer.paths),
+    }
+    with open(os.path.join(output_dir, 'summary.json'), 'w') as f:
+        json.dump(summary, f, indent=2)
+    LOGGER.info("Compared %d cliques in %.0f seconds: %d added, %d changed, %d removed, %d unchanged.",
+                stats['added'] + stats['changed'] + stats['unchanged'], time.perf_counter() - start,
+                stats['added'], stats['changed'], stats['removed'], stats['unchanged'])
+    return summary
+
+
+def apply(delta_dir: str, solr_url: str, workers: int, batch_size: int, timeout: float, checkpoint: str) -> bool:
+    """ Apply a delta to an existing Solr collection. Returns True if it was applied completely. """
+    # The upserts already have IDs and curie_prefix, so we only need the uuid processor (which leaves existing IDs
+    # alone).
+    loader = Loader(solr_url, workers, 2 * workers, 60000, 'uuid', 5, timeout,
+                    Checkpoint(checkpoint, batch_size, solr_url))
+
+    # Deleting documents that have already been deleted does nothing, so we can do this again if we resume.
+    with open(os.path.join(delta_dir, 'deletes.txt'), 'r', encoding='utf-8') as f:
+        ids = [line.strip() for line in f if line.strip()]
+    loader.delete(ids, batch_size)
+
+    # The loader commits the deletions along with the upserts.
+    return loader.load(sorted(glob.glob(os.path.join(delta_dir, 'upserts-*.txt.gz'))), batch_size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Update a name_lookup collection from one Babel release to the next.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    diff_parser = subparsers.add_parser('diff', help="Work out what has changed since the previous release.")
+    diff_parser.add_argument('files', nargs='+', help="Synonym files or glob patterns for the new release.")
+    diff_parser.add_argument('output_dir', help="The directory to write the delta to.")
+    diff_parser.add_argument('--previous-manifest',
+                             help="The manifest.tsv.gz of the previous release. If not provided, every clique will "
+                                  "be treated as new.")
+    diff_parser.add_argument('--manifest-only', action='store_true',
+                             help="Only write the manifest, e.g. to record the release that a full build loaded.")
+    diff_parser.add_argument('--chunk-size', type=int, default=1024 * 1024 * 1024,
+                             help="The approximate uncompressed size of each upserts chunk in bytes.")
+
+    apply_parser = subparsers.add_parser('apply', help="Apply a delta to an existing Solr collection.")
+    apply_parser.add_argument('delta_dir', help="The directory that the delta was written to.")
+    apply_parser.add_argument('--solr-url', default='http://localhost:8983/solr/name_lookup',
+                              help="The Solr collection to update.")
+    apply_parser.add_argument('--workers', type=int, default=4, help="The number of batches to post at a time.")
+    apply_parser.add_argument('--batch-size', type=int, default=10000, help="The number of documents per batch.")
+    apply_parser.add_argument('--timeout', type=float, default=600, help="The timeout for each Solr request.")
+    apply_parser.add_argument('--checkpoint', default='delta-checkpoint.json',
+                              help="The file to record confirmed upsert batches in, so a failed update can be "
+                                   "resumed. This is deleted when the update finishes.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    if args.command == 'diff':
+        paths = []
+        for pattern in args.files:
+            matches = sorted(glob.glob(pattern))
+            if not matches:
+                parser.error(f"No files found matching '{pattern}'.")
+            paths.extend(matches)
+        diff(paths, args.output_dir, args.previous_manifest, args.chunk_size, args.manifest_only)
+    elif not apply(args.delta_dir, args.solr_url, args.workers, args.batch_size, args.timeout, args.checkpoint):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
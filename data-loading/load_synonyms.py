@@ -0,0 +1,362 @@
+#!/usr/bin/env python
+"""
+Load Babel synonym files into Solr.
+
+Synonym files are streamed in fixed-size batches of documents, which are posted to Solr by several worker threads,
+each with its own keep-alive connection. The queue of batches waiting to be posted is bounded, so we never read
+much further ahead than Solr can keep up with. Batches are committed by Solr with commitWithin, and a single hard
+commit is made at the end of the load.
+
+Every batch that Solr confirms is recorded in a checkpoint file. If the load fails, running the same command again
+will skip the confirmed batches and carry on from there. The checkpoint is deleted once the load has been committed.
+Each document is given an `id` made up of its file name and line number (unless it already has one), so a batch that
+was posted but not confirmed before the failure will overwrite its own documents when it is posted again rather than
+duplicating them.
+
+Synonym files are JSON Lines files (one Babel record per line), which may be gzipped. A file ending in `.json` is
+read as a JSON array of records instead, as in tests/data/test-synonyms.json.
+
+Usage:
+    python load_synonyms.py "data/synonyms/*.txt*" --workers 4 --batch-size 10000
+"""
+import argparse
+import glob
+import gzip
+import http.client
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import urllib.parse
+from typing import Dict, Iterator, List, Optional, Tuple
+
+try:
+    from tqdm import tqdm
+except ImportError:
+    tqdm = None
+
+LOGGER = logging.getLogger('load_synonyms')
+
+# The update processors to run on every document (see setup-and-load-solr.sh).
+DEFAULT_PROCESSORS = 'uuid,curie-prefix-clone,curie-prefix-regex'
+
+# HTTP status codes that indicate that Solr is temporarily unable to handle a batch.
+RETRYABLE_STATUS_CODES = {429, 502, 503, 504}
+
+
+def read_batches(path: str, batch_size: int) -> Iterator[Tuple[int, List[bytes], int]]:
+    """
+    Read a synonym file in batches of documents.
+
+    :return: An iterator of (batch number, documents as JSON bytes, number of bytes read from the file).
+    """
+    file_id = os.path.basename(path)
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        if path.removesuffix('.gz').endswith('.json'):
+            lines = (json.dumps(record).encode('utf-8') for record in json.load(f))
+        else:
+            lines = f
+
+        batch_number = 0
+        batch = []
+        bytes_read = 0
+        for line_number, line in enumerate(lines):
+            bytes_read += len(line)
+            line = line.strip()
+            if not line or line == b'{}':
+                continue
+            if not line.startswith(b'{"id":'):
+                line = b'{"id":' + json.dumps(f"{file_id}:{line_number}").encode('utf-8') + b',' + line[1:]
+            batch.append(line)
+            if len(batch) >= batch_size:
+                yield batch_number, batch, bytes_read
+                batch_number += 1
+                batch = []
+                bytes_read = 0
+        if batch or bytes_read:
+            yield batch_number, batch, bytes_read
+
+
+class Checkpoint:
+    """
+    The batches that Solr has confirmed for each file.
+
+    For each file, we record the number of batches that have all been confirmed (`confirmed`), any batches after
+    those that have been confirmed out of order (`out_of_order`), and whether the whole file has been loaded. A
+    checkpoint only applies to the Solr collection it was written for, and the record for a file is discarded if the
+    file's size or modification time has changed since. The checkpoint is deleted once a load has been committed, so
+    that loading into a new Solr starts from the beginning.
+    """
+
+    def __init__(self, path: Optional[str], batch_size: int, solr_url: str):
+        self.path = path
+        self.solr_url = solr_url
+        self.lock = threading.Lock()
+        self.files: Dict[str, Dict] = {}
+        if path and os.path.exists(path):
+            with open(path, 'r') as f:
+                state = json.load(f)
+            if state.get('solr_url') != solr_url:
+                LOGGER.warning("Ignoring checkpoint %s, which was written for %s rather than %s.", path,
+                               state.get('solr_url'), solr_url)
+            elif state['batch_size'] != batch_size:
+                raise ValueError(f"Checkpoint {path} was written with a batch size of {state['batch_size']}, "
+                                 f"but the batch size is now {batch_size}.")
+            else:
+                self.files = state['files']
+                LOGGER.info("Resuming from checkpoint %s.", path)
+        self.batch_size = batch_size
+
+    def file_state(self, path: str) -> Dict:
+        stat = os.stat(path)
+        state = self.files.get(path)
+        if state is not None and (state.get('size'), state.get('mtime')) != (stat.st_size, stat.st_mtime):
+            LOGGER.info("%s has changed since checkpoint %s was written, so it will be loaded again.", path,
+                        self.path)
+            state = None
+        if state is None:
+            state = {'size': stat.st_size, 'mtime': stat.st_mtime, 'confirmed': 0, 'out_of_order': [],
+                     'finished': False}
+            self.files[path] = state
+        return state
+
+    def is_confirmed(self, path: str, batch_number: int) -> bool:
+        state = self.file_state(path)
+        return batch_number < state['confirmed'] or batch_number in state['out_of_order']
+
+    def confirm(self, path: str, batch_number: int):
+        with self.lock:
+            state = self.file_state(path)
+            out_of_order = set(state['out_of_order'])
+            out_of_order.add(batch_number)
+            while state['confirmed'] in out_of_order:
+                out_of_order.remove(state['confirmed'])
+                state['confirmed'] += 1
+            state['out_of_order'] = sorted(out_of_order)
+            self.save()
+
+    def finish(self, path: str, batch_count: int):
+        with self.lock:
+            state = self.file_state(path)
+            state['finished'] = state['confirmed'] >= batch_count
+            self.save()
+
+    def save(self):
+        if not self.path:
+            return
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({'solr_url': self.solr_url, 'batch_size': self.batch_size, 'files': self.files}, f)
+        os.replace(temp_path, self.path)
+
+    def remove(self):
+        """ Delete the checkpoint file, once everything in it has been committed. """
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class Loader:
+    """ Posts batches of documents to Solr from a bounded queue, using several worker threads. """
+
+    def __init__(self, solr_url: str, workers: int, queue_size: int, commit_within: int, processors: str,
+                 max_retries: int, timeout: float, checkpoint: Checkpoint):
+        url = urllib.parse.urlsplit(solr_url.rstrip('/'))
+        self.host = url.hostname
+        self.port = url.port or 8983
+        self.collection_path = url.path
+        self.update_path = f"{url.path}/update/json/docs?" + urllib.parse.urlencode({
+            'processor': processors,
+            'uuid.fieldName': 'id',
+            'commitWithin': commit_within,
+        })
+        self.workers = workers
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.checkpoint = checkpoint
+        self.failed = threading.Event()
+        self.docs_loaded = 0
+        self.stats_lock = threading.Lock()
+        self.progress = None
+
+    def post(self, connection: http.client.HTTPConnection, path: str, body: bytes) -> Tuple[int, bytes]:
+        connection.request('POST', path, body=body, headers={'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        return response.status, response.read()
+
+    def worker(self):
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            path, batch_number, docs = item
+            # Whatever happens, we mark the batch as done, so that load() doesn't wait for it forever.
+            try:
+                if not self.failed.is_set():
+                    if self.post_batch(connection, path, batch_number, docs):
+                        self.checkpoint.confirm(path, batch_number)
+                        with self.stats_lock:
+                            self.docs_loaded += len(docs)
+                            if self.progress is not None:
+                                self.progress.set_postfix(docs=self.docs_loaded, refresh=False)
+                    else:
+                        self.failed.set()
+            except Exception:
+                LOGGER.exception("Batch %d of %s failed.", batch_number, path)
+                self.failed.set()
+            finally:
+                self.queue.task_done()
+        connection.close()
+
+    def post_batch(self, connection: http.client.HTTPConnection, path: str, batch_number: int,
+                   docs: List[bytes]) -> bool:
+        """ Post a batch of documents to Solr, retrying transient errors. Returns True if Solr confirmed it. """
+        body = b'\n'.join(docs)
+        for attempt in range(self.max_retries + 1):
+            try:
+                status, response = self.post(connection, self.update_path, body)
+                if status < 300:
+                    return True
+                error = f"HTTP {status}: {response[:1000].decode('utf-8', errors='replace')}"
+                if status not in RETRYABLE_STATUS_CODES:
+                    LOGGER.error("Solr rejected batch %d of %s: %s", batch_number, path, error)
+                    return False
+            except (OSError, http.client.HTTPException) as err:
+                error = f"{type(err).__name__}: {err}"
+                connection.close()
+            if attempt < self.max_retries:
+                delay = 2 ** attempt + random.random()
+                LOGGER.warning("Batch %d of %s failed (%s), retrying in %.1f seconds.", batch_number, path, error,
+                               delay)
+                time.sleep(delay)
+            else:
+                LOGGER.error("Batch %d of %s failed after %d attempts: %s", batch_number, path, attempt + 1, error)
+        return False
+
+    def delete(self, ids: List[str], batch_size: int):
+        """ Delete documents by ID, in batches. The deletions are committed by the next commit. """
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            for i in range(0, len(ids), batch_size):
+                body = json.dumps({'delete': ids[i:i + batch_size]}).encode('utf-8')
+                status, response = self.post(connection, f"{self.collection_path}/update", body)
+                if status >= 300:
+                    raise RuntimeError(f"Solr delete failed with HTTP {status}: {response[:1000]!r}")
+        finally:
+            connection.close()
+        LOGGER.info("Deleted %d documents.", len(ids))
+
+    def commit(self):
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            status, response = self.post(connection, f"{self.collection_path}/update?commit=true", b'[]')
+            if status >= 300:
+                raise RuntimeError(f"Solr commit failed with HTTP {status}: {response[:1000]!r}")
+        finally:
+            connection.close()
+
+    def load(self, paths: List[str], batch_size: int) -> bool:
+        """ Load a list of synonym files into Solr. Returns True if every batch was loaded. """
+        threads = [threading.Thread(target=self.worker, name=f'loader-{i}', daemon=True) for i in range(self.workers)]
+        for thread in threads:
+            thread.start()
+
+        total_bytes = sum(os.path.getsize(path) for path in paths)
+        if tqdm is not None and not any(path.endswith('.gz') for path in paths):
+            self.progress = tqdm(total=total_bytes, unit='B', unit_scale=True, unit_divisor=1024, smoothing=0.05)
+
+        start = time.perf_counter()
+        try:
+            for path in paths:
+                if self.checkpoint.file_state(path)['finished']:
+                    LOGGER.info("Skipping %s, which has already been loaded.", path)
+                    if self.progress is not None:
+                        self.progress.update(os.path.getsize(path))
+                    continue
+
+                LOGGER.info("Loading %s...", path)
+                batch_count = 0
+                for batch_number, docs, bytes_read in read_batches(path, batch_size):
+                    if self.failed.is_set():
+                        break
+                    batch_count = batch_number + 1
+                    if self.progress is not None:
+                        self.progress.update(bytes_read)
+                    if self.checkpoint.is_confirmed(path, batch_number) or not docs:
+                        continue
+                    # This blocks if the queue is full, so we don't read ahead of Solr.
+                    self.queue.put((path, batch_number, docs))
+
+                # Wait for this file's batches, so that we can mark it as finished.
+                self.queue.join()
+                if self.failed.is_set():
+                    break
+                self.checkpoint.finish(path, batch_count)
+                elapsed = time.perf_counter() - start
+                LOGGER.info("Loaded %s: %d documents so far in %.0f seconds (%.0f documents/second).", path,
+                            self.docs_loaded, elapsed, self.docs_loaded / elapsed if elapsed else 0)
+        finally:
+            for _ in threads:
+                self.queue.put(None)
+            for thread in threads:
+                thread.join()
+            if self.progress is not None:
+                self.progress.close()
+
+        if self.failed.is_set():
+            LOGGER.error("Load failed after %d documents; run the same command again to resume.", self.docs_loaded)
+            return False
+
+        LOGGER.info("Committing...")
+        self.commit()
+        self.checkpoint.remove()
+        elapsed = time.perf_counter() - start
+        LOGGER.info("Loaded %d documents from %d file(s) in %.0f seconds (%.0f documents/second, %.1f MB/second).",
+                    self.docs_loaded, len(paths), elapsed, self.docs_loaded / elapsed if elapsed else 0,
+                    total_bytes / 1024 / 1024 / elapsed if elapsed else 0)
+        return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load Babel synonym files into Solr.")
+    parser.add_argument('files', nargs='+', help="Synonym files or glob patterns to load.")
+    parser.add_argument('--solr-url', default='http://localhost:8983/solr/name_lookup',
+                        help="The Solr collection to load into.")
+    parser.add_argument('--workers', type=int, default=4, help="The number of batches to post to Solr at a time.")
+    parser.add_argument('--batch-size', type=int, default=10000, help="The number of documents in each batch.")
+    parser.add_argument('--queue-size', type=int,
+                        help="The number of batches to read ahead of Solr (default: twice the number of workers).")
+    parser.add_argument('--commit-within', type=int, default=60000,
+                        help="How soon (in milliseconds) Solr should commit each batch.")
+    parser.add_argument('--processors', default=DEFAULT_PROCESSORS,
+                        help="The Solr update processors to run on each document.")
+    parser.add_argument('--max-retries', type=int, default=5, help="How many times to retry a failed batch.")
+    parser.add_argument('--timeout', type=float, default=600, help="The timeout for each Solr request, in seconds.")
+    parser.add_argument('--checkpoint', default='load-checkpoint.json',
+                        help="The file to record confirmed batches in, so that a failed load can be resumed. "
+                             "This is deleted when the load finishes.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    paths = []
+    for pattern in args.files:
+        matches = sorted(glob.glob(pattern))
+        if not matches:
+            parser.error(f"No files found matching '{pattern}'.")
+        paths.extend(matches)
+
+    checkpoint = Checkpoint(args.checkpoint, args.batch_size, args.solr_url)
+    loader = Loader(args.solr_url, args.workers, args.queue_size or 2 * args.workers, args.commit_within,
+                    args.processors, args.max_retries, args.timeout, checkpoint)
+    if not loader.load(paths, args.batch_size):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+"""
+Preprocess Babel synonym files for loading into Solr.
+
+Synonym files are streamed in blocks of lines, which are processed in parallel on every core. Each record is
+rewritten with:
+- `id`: the CURIE, so that documents have the same ID every time they are loaded (and reloading a document
+  replaces it rather than duplicating it).
+- `names`: with leading and trailing whitespace removed, and blank and duplicate names dropped (keeping the first
+  occurrence). Names that only differ in case are kept, since they are returned by /lookup and /synonyms.
+- `curie_prefix`: the part of the CURIE before the first colon (e.g. `MONDO`).
+- `curie_suffix`: the numerical part of the CURIE after the colon (e.g. `5737` for `MONDO:0005737`), if it has one
+  and the record doesn't already have a `curie_suffix`.
+- `shortest_name_length`: recalculated from the deduplicated names. Records where this differs from the value in the
+  input are counted and reported.
+
+The processed records are written out as gzipped JSON Lines chunks of roughly the same (uncompressed) size, which
+replaces splitting the largest synonym files by line count. Since the processed records already have `id` and
+`curie_prefix`, they should be loaded with only the `uuid` update processor:
+    LOADER_PROCESSORS=uuid ./setup-and-load-solr.sh "data/preprocessed/*.txt.gz"
+
+Usage:
+    python preprocess_synonyms.py "data/synonyms/*.txt*" data/preprocessed
+"""
+import argparse
+import collections
+import glob
+import gzip
+import json
+import logging
+import multiprocessing
+import os
+import re
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+LOGGER = logging.getLogger('preprocess_synonyms')
+
+# The numerical part of a CURIE suffix, e.g. 0005737 in MONDO:0005737 or 123 in NCBIGene:123.
+CURIE_SUFFIX_RE = re.compile(r'^\d+$')
+
+
+def preprocess_record(record: Dict, stats: collections.Counter) -> Optional[Dict]:
+    """ Return a preprocessed record, or None if it should be skipped. """
+    curie = record.get('curie')
+    if not curie:
+        stats['records_without_curie'] += 1
+        return None
+
+    names = []
+    seen = set()
+    for name in record.get('names') or []:
+        name = name.strip()
+        if not name:
+            stats['blank_names'] += 1
+            continue
+        if name in seen:
+            stats['duplicate_names'] += 1
+            continue
+        seen.add(name)
+        names.append(name)
+    if not names:
+        stats['records_without_names'] += 1
+
+    # We put the id first, so that load_synonyms.py can see that it is already there. It is always the CURIE, even if
+    # the record already has an id.
+    processed = {'id': curie}
+    processed.update(record)
+    processed['id'] = curie
+    processed['names'] = names
+
+    prefix, _, suffix = curie.partition(':')
+    processed['curie_prefix'] = prefix
+    if 'curie_suffix' not in record and CURIE_SUFFIX_RE.match(suffix):
+        processed['curie_suffix'] = int(suffix)
+
+    shortest_name_length = min((len(name) for name in names), default=0)
+    if 'shortest_name_length' in record and record['shortest_name_length'] != shortest_name_length:
+        stats['shortest_name_length_mismatches'] += 1
+    processed['shortest_name_length'] = shortest_name_length
+
+    stats['records'] += 1
+    return processed
+
+
+def preprocess_block(lines: List[bytes]) -> Tuple[bytes, int, collections.Counter]:
+    """
+    Preprocess a block of JSON Lines records.
+
+    :return: The gzipped output, the size of the output before it was compressed, and statistics about the block.
+    """
+    stats = collections.Counter()
+    output = []
+    for line in lines:
+        if not line.strip():
+            continue
+        processed = preprocess_record(json.loads(line), stats)
+        if processed is not None:
+            output.append(json.dumps(processed, ensure_ascii=False, separators=(',', ':')))
+    data = ('\n'.join(output) + '\n').encode('utf-8') if output else b''
+
+    # Compressing each block separately produces a multi-member gzip file, which can be read like any other.
+    return gzip.compress(data, compresslevel=6), len(data), stats
+
+
+def read_blocks(path: str, block_lines: int) -> Iterator[List[bytes]]:
+    """ Read a synonym file (JSON Lines, or a JSON array if it ends in `.json`; either may be gzipped) in blocks. """
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        if path.removesuffix('.gz').endswith('.json'):
+            lines = (json.dumps(record).encode('utf-8') for record in json.load(f))
+        else:
+            lines = f
+        block = []
+        for line in lines:
+            block.append(line)
+            if len(block) >= block_lines:
+                yield block
+                block = []
+        if block:
+            yield block
+
+
+class ChunkWriter:
+    """ Writes gzipped blocks to numbered output files, starting a new file once a file is large enough. """
+
+    def __init__(self, output_dir: str, chunk_size: int, prefix: str = 'synonyms'):
+        self.output_dir = output_dir
+        self.prefix = prefix
+        self.chunk_size = chunk_size
+        self.chunk_number = 0
+        self.chunk_bytes = 0
+        self.file = None
+        self.paths = []
+
+    def write(self, compressed: bytes, size: int):
+        if not size:
+            return
+        if self.file is None or self.chunk_bytes >= self.chunk_size:
+            self.close()
+            path = os.path.join(self.output_dir, f"{self.prefix}-{self.chunk_number:05d}.txt.gz")
+            self.file = open(path, 'wb')
+            self.paths.append(path)
+            self.chunk_number += 1
+            self.chunk_bytes = 0
+        self.file.write(compressed)
+        self.chunk_bytes += size
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def preprocess(paths: List[str], output_dir: str, processes: int, block_lines: int, chunk_size: int) -> Dict:
+    """ Preprocess a list of synonym files into output_dir, and return statistics about them. """
+    os.makedirs(output_dir, exist_ok=True)
+    existing = glob.glob(os.path.join(output_dir, 'synonyms-*.txt.gz'))
+    if existing:
+        raise FileExistsError(f"{output_dir} already contains {len(existing)} preprocessed file(s).")
+
+    start = time.perf_counter()
+    stats = collections.Counter()
+    writer = ChunkWriter(output_dir, chunk_size)
+    # We keep a bounded number of blocks in progress, so that we don't read the input faster than we can process it,
+    # and write them out in order, so that the output is the same every time.
+    max_pending = processes * 2
+    with multiprocessing.Pool(processes) as pool:
+        pending = collections.deque()
+        for path in paths:
+            LOGGER.info("Preprocessing %s...", path)
+            for block in read_blocks(path, block_lines):
+                pending.append(pool.apply_async(preprocess_block, (block,)))
+                if len(pending) >= max_pending:
+                    compressed, size, block_stats = pending.popleft().get()
+                    writer.write(compressed, size)
+                    stats.update(block_stats)
+        while pending:
+            compressed, size, block_stats = pending.popleft().get()
+            writer.write(compressed, size)
+            stats.update(block_stats)
+    writer.close()
+
+    elapsed = time.perf_counter() - start
+    LOGGER.info("Preprocessed %d records from %d file(s) into %d chunk(s) in %.0f seconds (%.0f records/second).",
+                stats['records'], len(paths), len(writer.paths), elapsed, stats['records'] / elapsed if elapsed else 0)
+    for key, value in sorted(stats.items()):
+        LOGGER.info("  %s: %d", key, value)
+    return dict(stats, chunks=len(writer.paths))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Preprocess Babel synonym files for loading into Solr.")
+    parser.add_argument('files', nargs='+', help="Synonym files or glob patterns to preprocess.")
+    parser.add_argument('output_dir', help="The directory to write preprocessed chunks to.")
+    parser.add_argument('--processes', type=int, default=os.cpu_count(),
+                        help="The number of processes to use (default: the number of cores).")
+    parser.add_argument('--block-lines', type=int, default=10000,
+                        help="The number of records in each block of work.")
+    parser.add_argument('--chunk-size', type=int, default=1024 * 1024 * 1024,
+                        help="The approximate uncompressed size of each output chunk in bytes (default: 1 GiB).")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    paths = []
+    for pattern in args.files:
+        matches = sorted(glob.glob(pattern))
+        if not matches:
+            parser.error(f"No files found matching '{pattern}'.")
+        paths.extend(matches)
+
+    preprocess(paths, args.output_dir, args.processes, args.block_lines, args.chunk_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,11 @@
 
 SOLR_PORT=8983
 
+# The number of shards to split the collection into, and the number of replicas of each shard. More shards let Solr
+# search a large index in parallel; replicas need more than one Solr node to be useful.
+SOLR_SHARDS=${SOLR_SHARDS:-1}
+SOLR_REPLICAS=${SOLR_REPLICAS:-1}
+
 is_solr_up(){
     echo "Checking if solr is up on http://localhost:$SOLR_PORT/solr/admin/cores"
     http_code=`echo $(curl -s -o /dev/null -w "%{http_code}" "http://localhost:$SOLR_PORT/solr/admin/cores")`
@@ -18,7 +23,7 @@ wait_for_solr(){
 wait_for_solr
 
 # add collection
-curl -X POST 'http://localhost:8983/solr/admin/collections?action=CREATE&name=name_lookup&numShards=1&replicationFactor=1'
+curl -X POST "http://localhost:8983/solr/admin/collections?action=CREATE&name=name_lookup&numShards=${SOLR_SHARDS}&replicationFactor=${SOLR_REPLICAS}"
 
 # do not autocreate fields
 curl 'http://localhost:8983/solr/name_lookup/config' -d '{"set-user-property": {"update.autoCreateFields": "false"}}'
@@ -57,7 +62,36 @@ curl -X POST -H 'Content-type:application/json' --data-binary '{
     }
 }' 'http://localhost:8983/solr/name_lookup/schema'
 
-
+# add autocomplete text type: at index time, every token is also indexed as all of its prefixes (up to 25
+# characters long), so that we can look up incomplete words directly instead of expanding a wildcard.
+curl -X POST -H 'Content-type:application/json' --data-binary '{
+    "add-field-type" : {
+        "name": "autocomplete",
+        "class": "solr.TextField",
+        "positionIncrementGap": "100",
+        "indexAnalyzer": {
+            "tokenizer": {
+                "class": "solr.StandardTokenizerFactory"
+            },
+            "filters": [{
+                "class": "solr.LowerCaseFilterFactory"
+            }, {
+                "class": "solr.EdgeNGramFilterFactory",
+                "minGramSize": "1",
+                "maxGramSize": "25",
+                "preserveOriginal": "true"
+            }]
+        },
+        "queryAnalyzer": {
+            "tokenizer": {
+                "class": "solr.StandardTokenizerFactory"
+            },
+            "filters": [{
+                "class": "solr.LowerCaseFilterFactory"
+            }]
+        }
+    }
+}' 'http://localhost:8983/solr/name_lookup/schema'
 
 # add fields
 curl -X POST -H 'Content-type:application/json' --data-binary '{
@@ -81,6 +115,13 @@ curl -X POST -H 'Content-type:application/json' --data-binary '{
             "type":"string",
             "stored":true
         },
+        {
+            "name":"curie_prefix",
+            "type":"string",
+            "indexed":true,
+            "docValues":true,
+            "stored":true
+        },
         {
             "name":"preferred_name",
             "type":"LowerTextField",
@@ -93,6 +134,20 @@ curl -X POST -H 'Content-type:application/json' --data-binary '{
             "stored":false,
             "multiValued":false
         },
+        {
+            "name":"names_autocomplete",
+            "type":"autocomplete",
+            "indexed":true,
+            "stored":false,
+            "multiValued":true
+        },
+        {
+            "name":"preferred_name_autocomplete",
+            "type":"autocomplete",
+            "indexed":true,
+            "stored":false,
+            "multiValued":false
+        },
         {
             "name":"types",
             "type":"string",
@@ -141,15 +196,49 @@ curl -X POST -H 'Content-type:application/json' --data-binary '{
     }
 }' 'http://localhost:8983/solr/name_lookup/schema'
 
+# Add copy fields to copy names and preferred_name into their autocomplete fields.
+curl -X POST -H 'Content-type:application/json' --data-binary '{
+    "add-copy-field": [{
+      "source": "names",
+      "dest": "names_autocomplete"
+    }, {
+      "source": "preferred_name",
+      "dest": "preferred_name_autocomplete"
+    }]
+}' 'http://localhost:8983/solr/name_lookup/schema'
+
+# Set up update processors to fill in curie_prefix (e.g. "MONDO" for "MONDO:0005737") by copying
+# the curie field and then removing everything from the first colon onwards.
+curl -X POST -H 'Content-type:application/json' --data-binary '{
+    "add-updateprocessor": {
+        "name": "curie-prefix-clone",
+        "class": "solr.CloneFieldUpdateProcessorFactory",
+        "source": "curie",
+        "dest": "curie_prefix"
+    }
+}' 'http://localhost:8983/solr/name_lookup/config'
+curl -X POST -H 'Content-type:application/json' --data-binary '{
+    "add-updateprocessor": {
+        "name": "curie-prefix-regex",
+        "class": "solr.RegexReplaceProcessorFactory",
+        "fieldName": "curie_prefix",
+        "pattern": ":.*$",
+        "replacement": "",
+        "literalReplacement": true
+    }
+}' 'http://localhost:8983/solr/name_lookup/config'
+
 # add data
-for f in $1; do
-	echo "Loading $f..."
-	# curl -d @$f needs to load the entire file into memory before uploading it, whereas
-	# curl -X POST -T $f will stream it. See https://github.com/TranslatorSRI/NameResolution/issues/194
-	curl -H 'Content-Type: application/json' -X POST -T $f \
-	    'http://localhost:8983/solr/name_lookup/update/json/docs?processor=uuid&uuid.fieldName=id&commit=true'
-	sleep 30
-done
+# load_synonyms.py streams the synonym files to Solr in batches over several connections, lets Solr commit them
+# with commitWithin and makes a single commit at the end. If it fails, running this script again will resume the
+# load from the last batch that Solr confirmed; the checkpoint is deleted once the load has been committed.
+# Files produced by preprocess_synonyms.py already have curie_prefix filled in, so they should be loaded with
+# LOADER_PROCESSORS=uuid.
+python "$(dirname "$0")/load_synonyms.py" "$1" \
+    --workers "${LOADER_WORKERS:-4}" \
+    --batch-size "${LOADER_BATCH_SIZE:-10000}" \
+    --checkpoint "${LOADER_CHECKPOINT:-load-checkpoint.json}" \
+    --processors "${LOADER_PROCESSORS:-uuid,curie-prefix-clone,curie-prefix-regex}"
 echo "Check solr"
 curl -s --negotiate -u: 'localhost:8983/solr/name_lookup/query?q=*:*&rows=0'
 
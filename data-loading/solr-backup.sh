@@ -0,0 +1,61 @@
+#!/usr/bin/env bash
+#
+# solr-backup.sh
+#
+# Backs up every shard of the name_lookup collection with the replication handler of one core per shard, and
+# collects the snapshots into the directory structure that solr-restore/restore.sh expects:
+#   - With a single shard: data/var/solr/data/snapshot.backup (as before).
+#   - With more than one shard: data/var/solr/data/snapshot.backup_shard1, snapshot.backup_shard2, ...
+#
+# Usage:
+#   solr-backup.sh start     Start a backup of every shard.
+#   solr-backup.sh check     Report the backup status of every shard.
+#   solr-backup.sh collect   Move the completed snapshots into data/var/solr/data.
+
+SOLR_SERVER="http://localhost:8983"
+SOLR_DIR=${SOLR_DIR:-/var/solr}
+COLLECTION_NAME="name_lookup"
+
+# List the shard and core names of the collection on this Solr node, one core per shard (e.g. "shard1 name_lookup_shard1_replica_n1").
+shard_cores() {
+    curl -s "${SOLR_SERVER}/solr/admin/cores?action=STATUS&indexInfo=false" \
+        | grep -o "\"${COLLECTION_NAME}_shard[0-9]*_replica_[a-z]*[0-9]*\"" \
+        | tr -d '"' | sort -u \
+        | sed -E "s/^${COLLECTION_NAME}_(shard[0-9]+)_.*$/\1 &/" \
+        | sort -u -k1,1 -V
+}
+
+# The name of the backup of a shard: "backup" if there is only one shard, otherwise "backup_shardN".
+backup_name() {
+    if [ "$(shard_cores | wc -l)" -eq 1 ]; then
+        echo "backup"
+    else
+        echo "backup_$1"
+    fi
+}
+
+set -e
+case "$1" in
+    start)
+        shard_cores | while read -r shard core; do
+            echo "Starting backup of ${shard} from ${core}."
+            curl -s "${SOLR_SERVER}/solr/${core}/replication?command=backup&name=$(backup_name "${shard}")"
+        done
+        ;;
+    check)
+        shard_cores | while read -r shard core; do
+            echo "Backup status of ${shard} (${core}):"
+            curl -s "${SOLR_SERVER}/solr/${core}/replication?command=details"
+        done
+        ;;
+    collect)
+        mkdir -p data/var/solr/data
+        shard_cores | while read -r shard core; do
+            mv "${SOLR_DIR}/${core}/data/snapshot.$(backup_name "${shard}")" data/var/solr/data
+        done
+        ;;
+    *)
+        echo "Usage: $0 start|check|collect" >&2
+        exit 1
+        ;;
+esac
@@ -3,6 +3,8 @@
 # restore.sh
 #
 # Restores a Solr backup located in the Solr data directory (`$SOLR_DATA/var/solr/data/snapshot.backup`).
+# Backups of collections with more than one shard have a snapshot for each shard
+# (`snapshot.backup_shard1`, `snapshot.backup_shard2`, ...), which are restored into the same number of shards.
 #
 # To do this, it must:
 # - Initiate the restore.
@@ -17,9 +19,24 @@ set -xa
 # Configuration options
 SOLR_SERVER="http://localhost:8983"
 
+# The number of replicas of each shard. Replicas are added after the restore, and copy their shard from its leader.
+SOLR_REPLICAS=${SOLR_REPLICAS:-1}
+
+# NameRes searches the name_lookup collection. swap-collection.sh restores into a versioned collection instead
+# (e.g. name_lookup_2025sep1) and then points a name_lookup alias at it.
+COLLECTION_NAME=${COLLECTION_NAME:-name_lookup}
+
 # Please don't change these values unless you change NameRes appropriately!
-COLLECTION_NAME="name_lookup"
 BACKUP_NAME="backup"
+BACKUP_DIR=${BACKUP_DIR:-/var/solr/data/var/solr/data}
+
+# Documents are routed to shards by a hash of their ID, so a backup has to be restored into the same number of shards
+# as it was made from.
+SOLR_SHARDS=$(ls -d ${BACKUP_DIR}/snapshot.${BACKUP_NAME}_shard* 2>/dev/null | wc -l)
+if [ "$SOLR_SHARDS" -eq 0 ]; then
+  SOLR_SHARDS=1
+fi
+echo "Restoring ${SOLR_SHARDS} shard(s) with ${SOLR_REPLICAS} replica(s) each."
 
 # Step 1. Make sure the Solr service is up and running.
 HEALTH_ENDPOINT="${SOLR_SERVER}/solr/admin/cores?action=STATUS"
@@ -33,12 +50,12 @@ echo "SOLR is up and running at ${SOLR_SERVER}."
 
 # Step 2. Create the COLLECTION_NAME if it doesn't exist.
 
-EXISTS=$(wget -O - ${SOLR_SERVER}/solr/admin/collections?action=LIST | grep ${COLLECTION_NAME})
+EXISTS=$(wget -O - ${SOLR_SERVER}/solr/admin/collections?action=LIST | grep "\"${COLLECTION_NAME}\"")
 
 # create collection / shard if it doesn't exist.
 if [ -z "$EXISTS" ]
 then
-  wget -O- ${SOLR_SERVER}/solr/admin/collections?action=CREATE'&'name=${COLLECTION_NAME}'&'numShards=1'&'replicationFactor=1
+  wget -O- ${SOLR_SERVER}/solr/admin/collections?action=CREATE'&'name=${COLLECTION_NAME}'&'numShards=${SOLR_SHARDS}'&'replicationFactor=1
   sleep 3
 fi
 
@@ -50,17 +67,34 @@ wget --post-data '{"set-user-property": {"update.autoCreateFields": "false"}}' \
     -O- ${SOLR_SERVER}/solr/${COLLECTION_NAME}/config
 sleep 1
 
-# Restore data
-CORE_NAME=${COLLECTION_NAME}_shard1_replica_n1
-RESTORE_URL="${SOLR_SERVER}/solr/${CORE_NAME}/replication?command=restore&location=/var/solr/data/var/solr/data/&name=${BACKUP_NAME}"
-wget -O - "$RESTORE_URL"
-sleep 10
-RESTORE_STATUS=$(wget -q -O - ${SOLR_SERVER}/solr/${CORE_NAME}/replication?command=restorestatus 2>&1 | grep "success") >&2
-echo "Restore status: ${RESTORE_STATUS}"
-until [ ! -z "$RESTORE_STATUS" ] ; do
-  echo "Solr restore in progress. Note: if this takes too long please check solr health."
-  RESTORE_STATUS=$(wget -O - ${SOLR_SERVER}/solr/${CORE_NAME}/replication?command=restorestatus 2>&1 | grep "success") >&2
+# Restore data into one core of every shard.
+for SHARD_NUMBER in $(seq 1 ${SOLR_SHARDS}); do
+  SHARD=shard${SHARD_NUMBER}
+  if [ "$SOLR_SHARDS" -eq 1 ]; then
+    SHARD_BACKUP_NAME=${BACKUP_NAME}
+  else
+    SHARD_BACKUP_NAME=${BACKUP_NAME}_${SHARD}
+  fi
+  CORE_NAME=$(wget -q -O - "${SOLR_SERVER}/solr/admin/cores?action=STATUS&indexInfo=false" \
+    | grep -o "\"${COLLECTION_NAME}_${SHARD}_replica_[a-z]*[0-9]*\"" | tr -d '"' | sort | head -n 1)
+  echo "Restoring ${SHARD_BACKUP_NAME} into ${CORE_NAME}."
+
+  RESTORE_URL="${SOLR_SERVER}/solr/${CORE_NAME}/replication?command=restore&location=${BACKUP_DIR}/&name=${SHARD_BACKUP_NAME}"
+  wget -O - "$RESTORE_URL"
   sleep 10
+  RESTORE_STATUS=$(wget -q -O - ${SOLR_SERVER}/solr/${CORE_NAME}/replication?command=restorestatus 2>&1 | grep "success") >&2
+  echo "Restore status: ${RESTORE_STATUS}"
+  until [ ! -z "$RESTORE_STATUS" ] ; do
+    echo "Solr restore of ${SHARD} in progress. Note: if this takes too long please check solr health."
+    RESTORE_STATUS=$(wget -O - ${SOLR_SERVER}/solr/${CORE_NAME}/replication?command=restorestatus 2>&1 | grep "success") >&2
+    sleep 10
+  done
+  echo "Solr restore of ${SHARD} complete"
+
+  # Add the other replicas of this shard, which will copy the restored index from the core we restored it into.
+  for REPLICA in $(seq 2 ${SOLR_REPLICAS}); do
+    wget -O- ${SOLR_SERVER}/solr/admin/collections?action=ADDREPLICA'&'collection=${COLLECTION_NAME}'&'shard=${SHARD}
+  done
 done
 echo "Solr restore complete"
 
@@ -100,6 +134,37 @@ wget --post-data '{
     --header='Content-Type:application/json' \
     -O- ${SOLR_SERVER}/solr/${COLLECTION_NAME}/schema
 sleep 1
+# autocomplete type: every token is also indexed as all of its prefixes (up to 25 characters long).
+wget --post-data '{
+    "add-field-type" : {
+        "name": "autocomplete",
+        "class": "solr.TextField",
+        "positionIncrementGap": "100",
+        "indexAnalyzer": {
+            "tokenizer": {
+                "class": "solr.StandardTokenizerFactory"
+            },
+            "filters": [{
+                "class": "solr.LowerCaseFilterFactory"
+            }, {
+                "class": "solr.EdgeNGramFilterFactory",
+                "minGramSize": "1",
+                "maxGramSize": "25",
+                "preserveOriginal": "true"
+            }]
+        },
+        "queryAnalyzer": {
+            "tokenizer": {
+                "class": "solr.StandardTokenizerFactory"
+            },
+            "filters": [{
+                "class": "solr.LowerCaseFilterFactory"
+            }]
+        }
+    }}' \
+    --header='Content-Type:application/json' \
+    -O- ${SOLR_SERVER}/solr/${COLLECTION_NAME}/schema
+sleep 1
 wget --post-data '{
     "add-field": [
         {
@@ -120,6 +185,13 @@ wget --post-data '{
             "type":"string",
             "stored":true
         },
+        {
+            "name":"curie_prefix",
+            "type":"string",
+            "indexed":true,
+            "docValues":true,
+            "stored":true
+        },
         {
             "name": "preferred_name",
             "type": "LowerTextField",
@@ -132,6 +204,20 @@ wget --post-data '{
             "stored": false,
             "multiValued": false
         },
+        {
+            "name": "names_autocomplete",
+            "type": "autocomplete",
+            "indexed": true,
+            "stored": false,
+            "multiValued": true
+        },
+        {
+            "name": "preferred_name_autocomplete",
+            "type": "autocomplete",
+            "indexed": true,
+            "stored": false,
+            "multiValued": false
+        },
         {
             "name": "types",
             "type": "string",
@@ -181,6 +267,16 @@ wget --post-data '{
     }}' \
     --header='Content-Type:application/json' \
     -O- ${SOLR_SERVER}/solr/${COLLECTION_NAME}/schema
+wget --post-data '{
+    "add-copy-field" : [{
+      "source": "names",
+      "dest": "names_autocomplete"
+    }, {
+      "source": "preferred_name",
+      "dest": "preferred_name_autocomplete"
+    }]}' \
+    --header='Content-Type:application/json' \
+    -O- ${SOLR_SERVER}/solr/${COLLECTION_NAME}/schema
 sleep 1
 
 echo "Solr restore complete!"
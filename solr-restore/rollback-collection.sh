@@ -0,0 +1,37 @@
+#!/usr/bin/env bash
+#
+# rollback-collection.sh
+#
+# Switches the name_lookup alias back to the collection it pointed to before the last swap-collection.sh (or to the
+# collection given as an argument). Running it again switches forward again.
+#
+# Usage:
+#   bash rollback-collection.sh [COLLECTION]
+#
+# This script should only require the `wget` program.
+set -e
+
+# Configuration options
+SOLR_SERVER=${SOLR_SERVER:-http://localhost:8983}
+
+# Please don't change this value unless you change NameRes appropriately!
+ALIAS_NAME="name_lookup"
+
+ALIASES=$(wget -q -O - "${SOLR_SERVER}/solr/admin/collections?action=LISTALIASES")
+CURRENT_COLLECTION=$(echo "$ALIASES" | grep -o "\"${ALIAS_NAME}\": *\"[^\"]*\"" | cut -d'"' -f4 || true)
+TARGET_COLLECTION=${1:-$(echo "$ALIASES" | grep -o '"previous": *"[^"]*"' | cut -d'"' -f4 || true)}
+if [ -z "$TARGET_COLLECTION" ]; then
+  echo "No previous collection is recorded for ${ALIAS_NAME}; please specify one." >&2
+  exit 1
+fi
+if ! wget -q -O - "${SOLR_SERVER}/solr/admin/collections?action=LIST" | grep -q "\"${TARGET_COLLECTION}\""; then
+  echo "There is no ${TARGET_COLLECTION} collection to switch to." >&2
+  exit 1
+fi
+
+wget -q -O - "${SOLR_SERVER}/solr/admin/collections?action=CREATEALIAS&name=${ALIAS_NAME}&collections=${TARGET_COLLECTION}" > /dev/null
+if [ -n "$CURRENT_COLLECTION" ]; then
+  wget -q -O - "${SOLR_SERVER}/solr/admin/collections?action=ALIASPROP&name=${ALIAS_NAME}&property.previous=${CURRENT_COLLECTION}" > /dev/null
+fi
+echo "${ALIAS_NAME} now points to ${TARGET_COLLECTION} (it pointed to ${CURRENT_COLLECTION})."
+echo "NameRes will report the new collection once it next checks the index status (within STATUS_POLL_INTERVAL seconds)."
@@ -0,0 +1,121 @@
+#!/usr/bin/env bash
+#
+# swap-collection.sh
+#
+# Installs a new Babel index without downtime. Rather than restoring the new backup over the collection that NameRes
+# is searching, we:
+# - Restore it into a versioned collection (e.g. name_lookup_2025sep1) with restore.sh.
+# - Warm it up by sending it the queries in WARMUP_QUERIES (one per line).
+# - Check that it has at least MIN_DOCS_PERCENT percent as many documents as the collection it replaces.
+# - Switch the name_lookup alias (which NameRes searches) to it in a single step, recording the collection it
+#   replaced in the alias' `previous` property so that rollback-collection.sh can switch back to it.
+#
+# The collection that was replaced is kept, so that we can roll back to it. Once you are sure that you won't need it,
+# delete it with:
+#   wget -O - 'http://localhost:8983/solr/admin/collections?action=DELETE&name=name_lookup_2025jun1'
+#
+# Since name_lookup needs to be an alias, this can't be used on a Solr instance that already has a name_lookup
+# collection (i.e. one set up with restore.sh alone).
+#
+# Usage:
+#   BACKUP_DIR=/var/solr/data/2025sep1/var/solr/data bash swap-collection.sh 2025sep1
+#
+# This script should only require the `wget` program.
+set -e
+
+# Configuration options
+SOLR_SERVER=${SOLR_SERVER:-http://localhost:8983}
+SCRIPT_DIR=$(cd "$(dirname "$0")" && pwd)
+WARMUP_QUERIES=${WARMUP_QUERIES:-${SCRIPT_DIR}/warmup-queries.txt}
+MIN_DOCS_PERCENT=${MIN_DOCS_PERCENT:-95}
+
+# Please don't change this value unless you change NameRes appropriately!
+ALIAS_NAME="name_lookup"
+
+BABEL_VERSION="$1"
+if [ -z "$BABEL_VERSION" ]; then
+  echo "Usage: $0 BABEL_VERSION" >&2
+  exit 1
+fi
+NEW_COLLECTION="${ALIAS_NAME}_${BABEL_VERSION}"
+
+solr_get() {
+  wget -q -O - "${SOLR_SERVER}$1"
+}
+
+# The number of documents in a collection.
+num_found() {
+  solr_get "/solr/$1/select?q=*:*&rows=0" | grep -o '"numFound": *[0-9]*' | grep -o '[0-9]*$'
+}
+
+# The collection that the alias currently points to (if any).
+current_collection() {
+  solr_get "/solr/admin/collections?action=LISTALIASES" | grep -o "\"${ALIAS_NAME}\": *\"[^\"]*\"" | cut -d'"' -f4 \
+    || true
+}
+
+urlencode() {
+  local LC_ALL=C string="$1" encoded="" c i
+  for (( i = 0; i < ${#string}; i++ )); do
+    c="${string:i:1}"
+    case "$c" in
+      [a-zA-Z0-9.~_-]) encoded+="$c" ;;
+      *) encoded+=$(printf '%%%02X' "'$c") ;;
+    esac
+  done
+  echo "$encoded"
+}
+
+# Step 1. Make sure that name_lookup isn't a collection.
+if solr_get "/solr/admin/collections?action=LIST" | grep -q "\"${ALIAS_NAME}\""; then
+  echo "${ALIAS_NAME} is a collection rather than an alias, so it can't be switched to ${NEW_COLLECTION}." >&2
+  exit 1
+fi
+OLD_COLLECTION=$(current_collection)
+if [ "$OLD_COLLECTION" = "$NEW_COLLECTION" ]; then
+  echo "${ALIAS_NAME} already points to ${NEW_COLLECTION}." >&2
+  exit 1
+fi
+
+# Step 2. Restore the backup into the new collection.
+COLLECTION_NAME=${NEW_COLLECTION} bash "${SCRIPT_DIR}/restore.sh"
+
+# Step 3. Warm up the new collection with the same kind of queries as NameRes sends.
+if [ -f "$WARMUP_QUERIES" ]; then
+  echo "Warming up ${NEW_COLLECTION} with the queries in ${WARMUP_QUERIES}."
+  QUERY_FIELDS=$(urlencode "preferred_name_exactish^250 names_exactish^100 preferred_name^25 names^10")
+  PHRASE_FIELDS=$(urlencode "preferred_name_exactish^300 names_exactish^200 preferred_name^30 names^20")
+  SORT=$(urlencode "score DESC, clique_identifier_count DESC, curie_suffix ASC")
+  while IFS= read -r query; do
+    [ -z "$query" ] && continue
+    solr_get "/solr/${NEW_COLLECTION}/select?defType=edismax&q=$(urlencode "$query")&qf=${QUERY_FIELDS}&pf=${PHRASE_FIELDS}&sort=${SORT}&rows=10" \
+      > /dev/null || echo "  -- Warm-up query failed: ${query}"
+  done < "$WARMUP_QUERIES"
+fi
+
+# Step 4. Check the number of documents in the new collection.
+NEW_DOCS=$(num_found "$NEW_COLLECTION")
+if [ -z "$NEW_DOCS" ] || [ "$NEW_DOCS" -eq 0 ]; then
+  echo "${NEW_COLLECTION} has no documents, so we won't switch to it." >&2
+  exit 1
+fi
+if [ -n "$OLD_COLLECTION" ]; then
+  OLD_DOCS=$(num_found "$OLD_COLLECTION")
+  echo "${NEW_COLLECTION} has ${NEW_DOCS} documents; ${OLD_COLLECTION} has ${OLD_DOCS}."
+  if [ $(( NEW_DOCS * 100 )) -lt $(( ${OLD_DOCS:-0} * MIN_DOCS_PERCENT )) ]; then
+    echo "${NEW_COLLECTION} has fewer than ${MIN_DOCS_PERCENT}% of the documents in ${OLD_COLLECTION}, so we won't" \
+      "switch to it. Set MIN_DOCS_PERCENT=0 to switch anyway." >&2
+    exit 1
+  fi
+fi
+
+# Step 5. Switch the alias to the new collection, and remember the old one.
+solr_get "/solr/admin/collections?action=CREATEALIAS&name=${ALIAS_NAME}&collections=${NEW_COLLECTION}" > /dev/null
+if [ -n "$OLD_COLLECTION" ]; then
+  solr_get "/solr/admin/collections?action=ALIASPROP&name=${ALIAS_NAME}&property.previous=${OLD_COLLECTION}" > /dev/null
+fi
+echo "${ALIAS_NAME} now points to ${NEW_COLLECTION}."
+echo "NameRes will report the new collection once it next checks the index status (within STATUS_POLL_INTERVAL seconds)."
+if [ -n "$OLD_COLLECTION" ]; then
+  echo "Run rollback-collection.sh to switch back to ${OLD_COLLECTION}."
+fi
@@ -0,0 +1,91 @@
+import asyncio
+import time
+
+from api.cache import ResultCache, SingleFlight, invalidate_caches
+
+
+def test_lru_eviction():
+    """ The least recently used entry should be evicted once the cache is full. """
+    cache = ResultCache("test-lru", max_size=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache.stats()['evictions'] == 1
+
+
+def test_ttl_expiry():
+    """ Entries should expire after the TTL. """
+    cache = ResultCache("test-ttl", max_size=10, ttl=0.01)
+    cache.set('a', [])
+    assert cache.get('a') == []
+    time.sleep(0.02)
+    assert cache.get('a') is None
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+
+def test_index_change_invalidation():
+    """ All caches should be cleared when the index changes, but not when we first see an index. """
+    cache = ResultCache("test-version", max_size=10, ttl=60)
+    cache.set('a', 1)
+    invalidate_caches(None, {'version': 1})
+    assert cache.get('a') == 1
+    invalidate_caches({'version': 1}, {'version': 2})
+    assert cache.get('a') is None
+
+
+def test_single_flight():
+    """ Identical concurrent requests should share a single task, which isn't cancelled with any one of them. """
+    single_flight = SingleFlight("test-coalescing")
+    calls = []
+
+    async def search(key):
+        calls.append(key)
+        await asyncio.sleep(0.05)
+        return key.upper()
+
+    async def run():
+        first = asyncio.create_task(single_flight.run('a', lambda: search('a')))
+        await asyncio.sleep(0)
+        cancelled = asyncio.create_task(single_flight.run('a', lambda: search('a')))
+        results = [single_flight.run('a', lambda: search('a')) for _ in range(3)]
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        assert await asyncio.gather(first, *results) == ['A'] * 4
+
+        # Once the first request has finished, the next one starts a new search.
+        assert await single_flight.run('a', lambda: search('a')) == 'A'
+    asyncio.run(run())
+
+    assert calls == ['a', 'a']
+    assert single_flight.stats() == {'in_flight': 0, 'started': 2, 'coalesced': 4, 'cancelled': 0}
+
+
+def test_stale_results_after_index_change():
+    """ A search that finishes after the index changes shouldn't be cached or handed to new requests. """
+    cache = ResultCache("test-stale", max_size=10, ttl=60)
+    single_flight = SingleFlight("test-stale")
+    index = {'version': 1}
+
+    async def search():
+        generation = cache.generation
+        version = index['version']
+        await asyncio.sleep(0.05)
+        cache.set('a', version, generation)
+        return version
+
+    async def run():
+        old = asyncio.create_task(single_flight.run('a', search))
+        await asyncio.sleep(0.01)
+        index['version'] = 2
+        invalidate_caches({'version': 1}, {'version': 2})
+        new = asyncio.create_task(single_flight.run('a', search))
+        assert await asyncio.gather(old, new) == [1, 2]
+
+    asyncio.run(run())
+    assert cache.get('a') == 2
+    assert cache.stats()['stale'] == 1
@@ -0,0 +1,63 @@
+import gzip
+import json
+
+from delta_synonyms import diff
+
+
+def write_synonyms(path, records):
+    with open(path, 'w') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+    return str(path)
+
+
+def read_manifest(delta_dir):
+    with gzip.open(delta_dir / 'manifest.tsv.gz', 'rt') as f:
+        return [line.split('\t')[0] for line in f]
+
+
+def read_upserts(delta_dir):
+    return [json.loads(line) for path in sorted(delta_dir.glob('upserts-*.txt.gz'))
+            for line in gzip.decompress(path.read_bytes()).splitlines()]
+
+
+def test_diff(tmp_path):
+    """ Only added and changed cliques should be upserted, and removed cliques deleted. """
+    first = write_synonyms(tmp_path / 'first.txt', [
+        {'curie': 'TEST:1', 'names': ['unchanged']},
+        {'curie': 'TEST:2', 'names': ['changed']},
+        {'curie': 'TEST:3', 'names': ['removed']},
+    ])
+    summary = diff([first], str(tmp_path / 'first'), None, 1000, manifest_only=True)
+    assert (summary['added'], summary['changed'], summary['removed'], summary['unchanged']) == (3, 0, 0, 0)
+    assert summary['upsert_chunks'] == 0
+    assert not list((tmp_path / 'first').glob('upserts-*'))
+    assert sorted(read_manifest(tmp_path / 'first')) == ['TEST:1', 'TEST:2', 'TEST:3']
+
+    second = write_synonyms(tmp_path / 'second.txt', [
+        {'curie': 'TEST:1', 'names': ['unchanged']},
+        {'curie': 'TEST:2', 'names': ['changed', 'again']},
+        {'curie': 'TEST:4', 'names': ['added']},
+    ])
+    summary = diff([second], str(tmp_path / 'second'), str(tmp_path / 'first' / 'manifest.tsv.gz'), 1000)
+    assert (summary['added'], summary['changed'], summary['removed'], summary['unchanged']) == (1, 1, 1, 1)
+    assert summary['duplicates'] == 0
+    assert sorted(record['id'] for record in read_upserts(tmp_path / 'second')) == ['TEST:2', 'TEST:4']
+    assert (tmp_path / 'second' / 'deletes.txt').read_text() == 'TEST:3\n'
+    assert sorted(read_manifest(tmp_path / 'second')) == ['TEST:1', 'TEST:2', 'TEST:4']
+    with open(tmp_path / 'second' / 'summary.json') as f:
+        assert json.load(f) == summary
+
+
+def test_diff_duplicates(tmp_path):
+    """ A CURIE that appears more than once in a release should only be upserted once, with its last record. """
+    synonyms = write_synonyms(tmp_path / 'synonyms.txt', [
+        {'curie': 'TEST:1', 'names': ['first']},
+        {'curie': 'TEST:2', 'names': ['other']},
+        {'curie': 'TEST:1', 'names': ['second']},
+    ])
+    summary = diff([synonyms], str(tmp_path / 'delta'), None, 1000)
+    assert (summary['added'], summary['duplicates']) == (2, 1)
+    upserts = {record['id']: record['names'] for record in read_upserts(tmp_path / 'delta')}
+    assert upserts == {'TEST:1': ['second'], 'TEST:2': ['other']}
+    assert sorted(read_manifest(tmp_path / 'delta')) == ['TEST:1', 'TEST:2']
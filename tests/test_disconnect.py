@@ -0,0 +1,73 @@
+import asyncio
+
+from api.cache import SingleFlight
+from api.disconnect import CancelOnDisconnectMiddleware
+
+
+def run_request(app, path: str, disconnect_after: float):
+    """ Send a request to an ASGI application, disconnecting after a delay, and return the messages it sends. """
+    sent = []
+
+    async def run():
+        messages = [{'type': 'http.request', 'body': b'{}', 'more_body': False}]
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            await asyncio.sleep(disconnect_after)
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        await CancelOnDisconnectMiddleware(app)({'type': 'http', 'path': path}, receive, send)
+    asyncio.run(run())
+    return sent
+
+
+def test_cancel_on_disconnect():
+    """ A lookup should be cancelled if the client disconnects before it is answered, but not otherwise. """
+    cancelled = []
+
+    async def slow_app(scope, receive, send):
+        assert (await receive())['body'] == b'{}'
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(scope['path'])
+            raise
+
+    sent = run_request(slow_app, '/bulk-lookup', disconnect_after=0.01)
+    assert cancelled == ['/bulk-lookup']
+    assert sent[0]['status'] == 499
+
+    async def fast_app(scope, receive, send):
+        await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+        await send({'type': 'http.response.body', 'body': b'[]'})
+
+    sent = run_request(fast_app, '/lookup', disconnect_after=0.01)
+    assert [message.get('status') for message in sent] == [200, None]
+
+
+def test_single_flight_cancellation():
+    """ A shared task should only be cancelled once every request waiting for it has been. """
+    single_flight = SingleFlight("test-cancellation")
+
+    async def search():
+        await asyncio.sleep(10)
+
+    async def run():
+        first = asyncio.create_task(single_flight.run('a', search))
+        second = asyncio.create_task(single_flight.run('a', search))
+        await asyncio.sleep(0.01)
+        task = single_flight.in_flight['a']
+
+        first.cancel()
+        await asyncio.sleep(0.01)
+        assert not task.done()
+
+        second.cancel()
+        await asyncio.sleep(0.01)
+        assert task.cancelled()
+        assert single_flight.stats()['cancelled'] == 1
+    asyncio.run(run())
@@ -0,0 +1,48 @@
+import json
+from pathlib import Path
+
+from api.backends.memory import InMemoryIndex
+from api.exact_match import build_table, ExactMatchTable
+
+TEST_SYNONYMS = str(Path(__file__).parent / 'data' / 'test-synonyms.json')
+
+
+def test_exact_match_table(tmp_path):
+    """ The exact match table should rank exact matches in the same order as a full search of the in-memory backend. """
+    table_path = str(tmp_path / 'exact-match.bin')
+    build_table(table_path, [TEST_SYNONYMS])
+    table = ExactMatchTable(table_path)
+    index = InMemoryIndex.load([TEST_SYNONYMS])
+
+    with open(TEST_SYNONYMS) as f:
+        records = json.load(f)
+    names = {name.lower() for record in records for name in record['names'] + [record['preferred_name']]}
+    assert table.name_count == len(names)
+
+    for name in names:
+        matches = table.lookup(name)
+        assert matches is not None
+        ranked = [index.docs[doc_number]['curie'] for doc_number, _ in index.search(name, False, ((), (), (), ()))]
+        assert [doc['curie'] for doc, _ in matches] == ranked[:len(matches)]
+
+    # Names are matched case-insensitively, so the table only contains lowercased names.
+    assert table.lookup('Alzheimer disease') is None
+    assert table.lookup('not a name in the test data') is None
+
+    table.close()
+
+
+def test_exact_match_table_index_check(tmp_path):
+    """ A table should only be used while the index it was built for is being served. """
+    table_path = str(tmp_path / 'exact-match.bin')
+    build_table(table_path, [TEST_SYNONYMS], {'collection': 'name_lookup_2025sep1', 'babel_version': '2025sep1'})
+    table = ExactMatchTable(table_path)
+    assert not table.enabled
+
+    table.check_index(None, {'collection': 'name_lookup_2025sep1', 'babel_version': '2025sep1'})
+    assert table.enabled
+    table.check_index({'collection': 'name_lookup_2025sep1', 'babel_version': '2025sep1'},
+                      {'collection': 'name_lookup_2025oct1', 'babel_version': '2025oct1'})
+    assert not table.enabled
+
+    table.close()
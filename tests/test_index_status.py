@@ -0,0 +1,86 @@
+import asyncio
+
+from api import index_status
+from api.index_status import IndexStatusPoller
+
+
+class FakeBackend:
+    def __init__(self):
+        self.index = {'collection': 'name_lookup_1', 'version': 1, 'numDocs': 10}
+        self.calls = 0
+
+    async def index_status(self):
+        self.calls += 1
+        if isinstance(self.index, Exception):
+            raise self.index
+        return self.index
+
+
+def test_index_change_events(monkeypatch):
+    """ Subscribers should be told when the index is first seen and whenever it changes, but not otherwise. """
+    backend = FakeBackend()
+
+    async def get_backend():
+        return backend
+    monkeypatch.setattr(index_status, 'get_backend', get_backend)
+
+    async def run():
+        poller = IndexStatusPoller(interval=60)
+        events = []
+
+        def subscriber(previous, current):
+            events.append((previous['numDocs'] if previous else None, current['numDocs']))
+        poller.subscribe(subscriber)
+
+        await poller.poll()
+        await poller.poll()
+        assert events == [(None, 10)]
+
+        # A failed poll (or a missing index) keeps the last index we saw.
+        backend.index = ConnectionError("Solr is down")
+        await poller.poll()
+        assert poller.index['numDocs'] == 10
+        assert poller.stats()['last_error'] == "Solr is down"
+        backend.index = None
+        await poller.poll()
+        assert poller.index is None
+
+        backend.index = {'collection': 'name_lookup_1', 'version': 2, 'numDocs': 12}
+        await poller.poll()
+        assert events == [(None, 10), (10, 12)]
+        assert poller.stats()['changes'] == 1
+
+        # Without a background task, latest() only checks the index status once it is out of date.
+        calls = backend.calls
+        assert (await poller.latest())['numDocs'] == 12
+        assert backend.calls == calls
+    asyncio.run(run())
+
+
+def test_degraded_status(monkeypatch):
+    """ The index status should be reported as degraded if the last poll failed or hasn't happened for a while. """
+    backend = FakeBackend()
+
+    async def get_backend():
+        return backend
+    monkeypatch.setattr(index_status, 'get_backend', get_backend)
+
+    async def run():
+        poller = IndexStatusPoller(interval=60)
+        await poller.poll()
+        assert poller.degraded() is None
+
+        backend.index = ConnectionError("Solr is down")
+        await poller.poll()
+        assert poller.degraded() == "The last index status check failed: Solr is down"
+
+        backend.index = {'collection': 'name_lookup_1', 'version': 1, 'numDocs': 10}
+        await poller.poll()
+        assert poller.degraded() is None
+        poller.checked_at -= 4 * 60
+        assert poller.degraded() == "The index status was last checked 240 seconds ago."
+
+        backend.index = {'collection': 'name_lookup_1', 'version': 1, 'numDocs': 5, 'missing_shards': ['shard2']}
+        await poller.poll()
+        assert poller.degraded().startswith("No replica of shard2 could be reached")
+    asyncio.run(run())
@@ -0,0 +1,144 @@
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from load_synonyms import Checkpoint, Loader, read_batches
+
+SOLR_URL = 'http://localhost:8983/solr/name_lookup'
+
+
+class StubSolr:
+    """ An in-process HTTP server that records the documents posted to it, and rejects those in `reject`. """
+
+    def __init__(self):
+        self.docs = []
+        self.commits = 0
+        self.reject = set()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                status = 200
+                if '/update/json/docs' in self.path:
+                    docs = [json.loads(line) for line in body.splitlines()]
+                    if any(doc['id'] in stub.reject for doc in docs):
+                        status = 400
+                    else:
+                        stub.docs.extend(docs)
+                elif 'commit=true' in self.path:
+                    stub.commits += 1
+                self.send_response(status)
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write(b'{}')
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}/solr/name_lookup'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub_solr():
+    stub = StubSolr()
+    yield stub
+    stub.close()
+
+
+def write_synonyms(path, count: int):
+    with open(path, 'w') as f:
+        for i in range(count):
+            f.write(json.dumps({'curie': f'TEST:{i}', 'names': [f'name {i}']}) + '\n')
+
+
+def load(stub: StubSolr, paths, checkpoint_path, batch_size: int = 2) -> bool:
+    loader = Loader(stub.url, 2, 4, 1000, 'uuid', 0, 10, Checkpoint(checkpoint_path, batch_size, stub.url))
+    return loader.load(paths, batch_size)
+
+
+def test_read_batches(tmp_path):
+    """ Documents should be given deterministic file:line IDs, unless they already have one. """
+    path = tmp_path / 'synonyms.txt'
+    path.write_text('{"curie":"A:1"}\n\n{}\n{"id":"custom","curie":"A:2"}\n{"curie":"A:3"}\n')
+    batches = list(read_batches(str(path), 2))
+    assert [batch_number for batch_number, _, _ in batches] == [0, 1]
+    assert [json.loads(doc)['id'] for _, docs, _ in batches for doc in docs] == \
+        ['synonyms.txt:0', 'custom', 'synonyms.txt:4']
+    assert sum(bytes_read for _, _, bytes_read in batches) == path.stat().st_size
+    assert list(read_batches(str(path), 2)) == batches
+
+
+def test_checkpoint(tmp_path):
+    """ Batches confirmed out of order should be recorded until every batch before them has been confirmed. """
+    synonyms = str(tmp_path / 'synonyms.txt')
+    write_synonyms(synonyms, 10)
+    checkpoint_path = str(tmp_path / 'checkpoint.json')
+
+    checkpoint = Checkpoint(checkpoint_path, 2, SOLR_URL)
+    checkpoint.confirm(synonyms, 0)
+    checkpoint.confirm(synonyms, 2)
+    checkpoint.confirm(synonyms, 3)
+    assert checkpoint.file_state(synonyms)['confirmed'] == 1
+    assert checkpoint.file_state(synonyms)['out_of_order'] == [2, 3]
+    assert checkpoint.is_confirmed(synonyms, 2) and not checkpoint.is_confirmed(synonyms, 1)
+    checkpoint.confirm(synonyms, 1)
+    assert checkpoint.file_state(synonyms)['confirmed'] == 4
+    assert checkpoint.file_state(synonyms)['out_of_order'] == []
+
+    # The checkpoint is resumed with the same Solr URL and batch size...
+    assert Checkpoint(checkpoint_path, 2, SOLR_URL).file_state(synonyms)['confirmed'] == 4
+    with pytest.raises(ValueError):
+        Checkpoint(checkpoint_path, 3, SOLR_URL)
+    # ...but ignored for a different Solr.
+    assert Checkpoint(checkpoint_path, 2, 'http://other:8983/solr/name_lookup').file_state(synonyms)['confirmed'] == 0
+
+    # A file that has changed is loaded again.
+    with open(synonyms, 'a') as f:
+        f.write('{"curie":"TEST:10"}\n')
+    assert Checkpoint(checkpoint_path, 2, SOLR_URL).file_state(synonyms)['confirmed'] == 0
+
+
+def test_resume_load(tmp_path, stub_solr):
+    """ A failed load should resume from the batches Solr confirmed, and remove its checkpoint once committed. """
+    synonyms = str(tmp_path / 'synonyms.txt')
+    write_synonyms(synonyms, 10)
+    checkpoint_path = str(tmp_path / 'checkpoint.json')
+
+    stub_solr.reject = {'synonyms.txt:6'}
+    assert not load(stub_solr, [synonyms], checkpoint_path)
+    assert stub_solr.commits == 0
+    with open(checkpoint_path) as f:
+        assert not json.load(f)['files'][synonyms]['finished']
+
+    # Every document is posted exactly once.
+    stub_solr.reject = set()
+    assert load(stub_solr, [synonyms], checkpoint_path)
+    assert stub_solr.commits == 1
+    assert sorted(doc['id'] for doc in stub_solr.docs) == sorted(f'synonyms.txt:{i}' for i in range(10))
+    assert not os.path.exists(checkpoint_path)
+
+
+def test_checkpoint_error(tmp_path, stub_solr, monkeypatch):
+    """ A load should fail rather than hang if a worker can't record a confirmed batch. """
+    synonyms = str(tmp_path / 'synonyms.txt')
+    write_synonyms(synonyms, 10)
+
+    def disk_full(self):
+        raise OSError(28, "No space left on device")
+    monkeypatch.setattr(Checkpoint, 'save', disk_full)
+
+    results = []
+    thread = threading.Thread(target=lambda: results.append(load(stub_solr, [synonyms], None)), daemon=True)
+    thread.start()
+    thread.join(timeout=10)
+    assert results == [False]
@@ -0,0 +1,82 @@
+import collections
+import gzip
+import json
+from pathlib import Path
+
+from preprocess_synonyms import ChunkWriter, preprocess, preprocess_block, preprocess_record
+
+TEST_SYNONYMS = str(Path(__file__).parent / 'data' / 'test-synonyms.json')
+
+
+def test_preprocess_record():
+    """ Records should be given their CURIE as their ID, and names should only lose blanks and exact duplicates. """
+    stats = collections.Counter()
+    record = preprocess_record({
+        'id': 'something-else',
+        'curie': 'MONDO:0005737',
+        'names': ['Ebola', ' ebola ', 'Ebola ', '', 'EBOLA', 'ebola hemorrhagic fever'],
+        'shortest_name_length': 4,
+    }, stats)
+    assert next(iter(record)) == 'id'
+    assert record['id'] == 'MONDO:0005737'
+    assert record['names'] == ['Ebola', 'ebola', 'EBOLA', 'ebola hemorrhagic fever']
+    assert record['curie_prefix'] == 'MONDO'
+    assert record['curie_suffix'] == 5737
+    assert record['shortest_name_length'] == 5
+    assert stats == {'records': 1, 'blank_names': 1, 'duplicate_names': 1, 'shortest_name_length_mismatches': 1}
+
+
+def test_preprocess_record_curies():
+    """ curie_suffix should only be filled in for numerical suffixes, and never replace an existing one. """
+    stats = collections.Counter()
+    assert 'curie_suffix' not in preprocess_record({'curie': 'UMLS:C0001', 'names': ['a']}, stats)
+    assert preprocess_record({'curie': 'NCBIGene:123', 'names': ['a'], 'curie_suffix': 7}, stats)['curie_suffix'] == 7
+    assert preprocess_record({'curie': 'NCBIGene:123', 'names': ['a']}, stats)['curie_prefix'] == 'NCBIGene'
+    assert preprocess_record({'names': ['a']}, stats) is None
+    assert preprocess_record({'curie': 'A:1', 'names': [' ']}, stats)['shortest_name_length'] == 0
+    assert stats['records_without_curie'] == 1
+    assert stats['records_without_names'] == 1
+    assert stats['shortest_name_length_mismatches'] == 0
+
+
+def test_preprocess_test_synonyms():
+    """ Preprocessing the test data should only drop exact duplicate names. """
+    with open(TEST_SYNONYMS) as f:
+        records = json.load(f)
+    stats = collections.Counter()
+    for record in records:
+        processed = preprocess_record(record, stats)
+        assert processed['names'] == list(dict.fromkeys(name.strip() for name in record['names'] if name.strip()))
+    assert stats['records'] == len(records)
+
+
+def test_chunk_writer(tmp_path):
+    """ A new chunk should be started once a chunk reaches the chunk size, and empty blocks skipped. """
+    writer = ChunkWriter(str(tmp_path), chunk_size=10)
+    for data in [b'a' * 6, b'', b'b' * 6, b'c' * 3]:
+        writer.write(gzip.compress(data), len(data))
+    writer.close()
+    assert [Path(path).name for path in writer.paths] == ['synonyms-00000.txt.gz', 'synonyms-00001.txt.gz']
+    with gzip.open(writer.paths[0]) as f:
+        assert f.read() == b'a' * 6 + b'b' * 6
+    with gzip.open(writer.paths[1]) as f:
+        assert f.read() == b'c' * 3
+
+
+def test_preprocess_deterministic(tmp_path):
+    """ Preprocessing the same files should always produce the same chunks, however many processes are used. """
+    outputs = []
+    for processes in (1, 3):
+        output_dir = tmp_path / f'output-{processes}'
+        stats = preprocess([TEST_SYNONYMS], str(output_dir), processes, block_lines=10, chunk_size=20000)
+        assert stats['chunks'] > 1
+        outputs.append({path.name: gzip.decompress(path.read_bytes()) for path in sorted(output_dir.iterdir())})
+    assert outputs[0] == outputs[1]
+
+    lines = b''.join(outputs[0].values()).splitlines()
+    assert [json.loads(line)['id'] for line in lines] == [record['curie'] for record in json.load(open(TEST_SYNONYMS))]
+
+    # A block is compressed separately, but decompresses to the same records.
+    compressed, size, _ = preprocess_block([json.dumps(record).encode() for record in json.load(open(TEST_SYNONYMS))])
+    assert gzip.decompress(compressed).splitlines() == lines
+    assert size == sum(len(line) + 1 for line in lines)
@@ -1,4 +1,5 @@
 import logging
+import time
 
 from api.server import app
 from fastapi.testclient import TestClient
@@ -54,6 +55,26 @@ def test_type_subsetting():
     syns = response.json()
     assert len(syns) == 57
 
+def test_prefix_filters():
+    client = TestClient(app)
+    # There are 31 alzheimer results: 29 MONDO, 1 CHEBI and 1 HP.
+    params = {'string': 'alzheimer', 'limit': 100, 'only_prefixes': 'MONDO'}
+    response = client.get("/lookup", params=params)
+    syns = response.json()
+    assert len(syns) == 29
+    assert all(syn['curie'].startswith('MONDO:') for syn in syns)
+
+    params = {'string': 'alzheimer', 'limit': 100, 'only_prefixes': 'CHEBI|HP'}
+    response = client.get("/lookup", params=params)
+    syns = response.json()
+    assert sorted(syn['curie'].split(':')[0] for syn in syns) == ['CHEBI', 'HP']
+
+    params = {'string': 'alzheimer', 'limit': 100, 'exclude_prefixes': 'MONDO|HP'}
+    response = client.get("/lookup", params=params)
+    syns = response.json()
+    assert len(syns) == 1
+    assert syns[0]['curie'].startswith('CHEBI:')
+
 def test_offset():
     client = TestClient(app)
     #There are 31 total.  If we say, start at 20 and give me then next 100 , we should get 11
@@ -71,7 +92,8 @@ def test_hyphens():
     response = client.post("/lookup", params=params)
     syns = response.json()
 
-    assert len(syns) == 1
+    # This is an autocomplete search, so "beta" also matches MONDO:0011561 (see test_autocomplete).
+    assert len(syns) == 2
     assert syns[0]["curie"] == 'CHEBI:74925'
 
     #no hyphen
@@ -97,10 +119,22 @@ def test_autocomplete():
     params = {'string': 'beta-secretase', 'autocomplete': 'true'}
     response = client.post("/lookup", params=params)
     syns = response.json()
-    assert len(syns) == 1
+    # Autocomplete matches every prefix of every token, so "beta" also matches MONDO:0011561.
+    assert len(syns) == 2
     #do we get a preferred name and type?
     assert syns[0]["label"] == 'BACE1 inhibitor'
     assert syns[0]["types"] == ["biolink:NamedThing"]
+    assert syns[1]['curie'] == 'MONDO:0011561'
+
+    # Incomplete words should only be matched in autocomplete mode.
+    params = {'string': 'alzhei', 'autocomplete': 'true', 'limit': 100}
+    response = client.post("/lookup", params=params)
+    syns = response.json()
+    assert len(syns) == 31
+    params = {'string': 'alzhei', 'autocomplete': 'false', 'limit': 100}
+    response = client.post("/lookup", params=params)
+    syns = response.json()
+    assert len(syns) == 0
 
     # Should also work with an incomplete search.
     params = {'string': 'beta-secretase', 'autocomplete': 'false'}
@@ -140,8 +174,8 @@ def test_autocomplete():
     # assert syns[0]["label"] == 'antiparkinson agent'
     # assert syns[0]["types"] == ["biolink:NamedThing"]
 
-    # But now we only get beta-secretase.
-    assert len(syns) == 1
+    # But now we only get the beta-secretase inhibitor, along with MONDO:0011561 (which matches "beta", see above).
+    assert len(syns) == 2
     assert syns[0]['curie'] == 'CHEBI:74925'
     assert syns[0]["label"] == 'BACE1 inhibitor'
     assert syns[0]["types"] == ["biolink:NamedThing"]
@@ -191,6 +225,20 @@ def test_bulk_lookup():
     assert results['Parkinson'][0]['label'] == "Parkinson disease"
 
 
+def test_bulk_lookup_duplicates():
+    """ Repeated strings in a bulk lookup should only be looked up once, and results should be in input order. """
+    client = TestClient(app)
+    params = {
+        'strings': ['Parkinson', 'beta-secretase', 'Parkinson'],
+        'limit': 100,
+    }
+    response = client.post("/bulk-lookup", json=params)
+    results = response.json()
+    assert list(results.keys()) == ['Parkinson', 'beta-secretase']
+    assert len(results['Parkinson']) == 34
+    assert len(results['beta-secretase']) == 2
+
+
 def test_synonyms():
     """
     Test the /synonyms endpoints -- these are used to look up all the information we know about a preferred CURIE.
@@ -223,3 +271,115 @@ def test_synonyms():
     mondo_0000828_results = results['MONDO:0000828']
     assert mondo_0000828_results['curie'] == 'MONDO:0000828'
     assert mondo_0000828_results['preferred_name'] == 'juvenile-onset Parkinson disease'
+
+
+def test_fields_and_max_synonyms():
+    """ Check that we can choose the fields to return and cap the number of synonyms. """
+    client = TestClient(app)
+    response = client.get("/lookup", params={'string': 'alzheimer', 'fields': ['label', 'synonyms'], 'max_synonyms': 1})
+    syns = response.json()
+    assert len(syns) == 10
+    for syn in syns:
+        assert set(syn.keys()) == {'curie', 'label', 'synonyms'}
+        assert len(syn['synonyms']) <= 1
+
+    response = client.post("/bulk-lookup", json={'strings': ['alzheimer'], 'fields': ['types'], 'max_synonyms': 0})
+    results = response.json()
+    assert set(results['alzheimer'][0].keys()) == {'curie', 'types'}
+
+    response = client.get("/synonyms", params={
+        'preferred_curies': ['MONDO:0000828'],
+        'fields': ['preferred_name', 'names'],
+        'max_synonyms': 1,
+    })
+    results = response.json()
+    assert results['MONDO:0000828']['preferred_name'] == 'juvenile-onset Parkinson disease'
+    assert len(results['MONDO:0000828']['names']) == 1
+    assert 'types' not in results['MONDO:0000828']
+
+    # Only stored fields can be requested, not Solr transformers or function queries.
+    response = client.get("/synonyms", params={'preferred_curies': ['MONDO:0000828'], 'fields': ['[explain]']})
+    assert response.status_code == 422
+    response = client.post("/synonyms", json={'preferred_curies': ['MONDO:0000828'], 'fields': ['names,score']})
+    assert response.status_code == 422
+
+
+def test_projected_lookup_schema():
+    """ Fields that can be left out of a lookup result with `fields` shouldn't be required in the OpenAPI schema. """
+    client = TestClient(app)
+    schema = client.get("/openapi.json").json()
+    assert schema['components']['schemas']['LookupResult']['required'] == ['curie']
+
+
+def test_index_headers():
+    """ Every response should say which Babel version it came from. """
+    client = TestClient(app)
+    status = client.get("/status").json()
+    response = client.get("/lookup", params={'string': 'alzheimer'})
+    assert response.headers['X-Babel-Version'] == status['babel_version']
+
+
+def test_ready():
+    """ Without a query log, NameRes should be ready as soon as it has started up. """
+    with TestClient(app) as client:
+        for _ in range(100):
+            response = client.get("/ready")
+            if response.status_code == 200:
+                break
+            time.sleep(0.01)
+        assert response.status_code == 200
+        assert response.json()['ready']
+
+
+def test_health():
+    """ The liveness probe should always succeed. """
+    client = TestClient(app)
+    assert client.get("/health").json() == {'status': 'ok'}
+
+
+def test_overloaded(monkeypatch):
+    """ When too many requests are waiting for Solr, lookups should be rejected quickly with a Retry-After header. """
+    from api import server
+    from api.solr import SolrOverloaded
+
+    async def overloaded(*args):
+        raise SolrOverloaded("Too many requests are waiting for Solr.")
+    monkeypatch.setattr(server, 'search_lookup', overloaded)
+
+    client = TestClient(app)
+    response = client.get("/lookup", params={'string': 'an uncached string'})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    response = client.post("/bulk-lookup", json={'strings': ['another uncached string']})
+    assert response.status_code == 503
+
+
+def test_overloaded_bulk_lookup(monkeypatch):
+    """ A bulk lookup rejected because Solr is overloaded should stop sending queries for its other strings. """
+    import asyncio
+    import httpx
+    from api import server
+    from api.solr import SolrOverloaded
+
+    calls = []
+    finished = []
+
+    async def search_lookup(string_lc, *args):
+        calls.append(string_lc)
+        if len(calls) == 3:
+            raise SolrOverloaded("Too many requests are waiting for Solr.")
+        await asyncio.sleep(0.2)
+        finished.append(string_lc)
+        return []
+    monkeypatch.setattr(server, 'search_lookup', search_lookup)
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://nameres') as client:
+            response = await client.post("/bulk-lookup", json={'strings': [f"overloaded {i}" for i in range(30)]})
+            assert response.status_code == 503
+            calls_at_response = len(calls)
+            await asyncio.sleep(0.4)
+            assert len(calls) == calls_at_response
+            assert finished == []
+    asyncio.run(run())
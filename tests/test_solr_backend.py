@@ -0,0 +1,72 @@
+import asyncio
+
+import httpx
+
+from api import solr
+from api.backends import solr as solr_backend
+from api.solr import SolrClient
+
+CLUSTER_STATUS = {'cluster': {'collections': {'name_lookup': {'shards': {
+    'shard1': {'replicas': {'core_node1': {'core': 'name_lookup_shard1_replica_n1', 'leader': 'true',
+                                           'node_name': 'solr-1:8983_solr'}}},
+    'shard2': {'replicas': {'core_node2': {'core': 'name_lookup_shard2_replica_n2', 'leader': 'true',
+                                           'node_name': 'solr-2:8983_solr'}}},
+}}}}}
+
+
+def core_status(*names):
+    return {'status': {name: {'startTime': '2025-01-01T00:00:00Z', 'index': {'numDocs': 10, 'version': 1}}
+                       for name in names}}
+
+
+def use_mock_solr(monkeypatch, local_cores: tuple):
+    """
+    Answer Solr requests with CLUSTER_STATUS, where node solr-1 can be reached but solr-2 can't, and the node we are
+    connected to has these cores.
+    """
+    monkeypatch.setattr(solr, 'SOLR_RETRY_BACKOFF', 0)
+
+    async def handler(request):
+        if request.url.host == 'solr-2':
+            raise httpx.ConnectError("Name or service not known", request=request)
+        if request.url.path == '/solr/admin/collections':
+            return httpx.Response(200, json=CLUSTER_STATUS)
+        if request.url.host == 'solr-1':
+            return httpx.Response(200, json=core_status('name_lookup_shard1_replica_n1'))
+        return httpx.Response(200, json=core_status(*local_cores))
+
+    client = SolrClient(['http://solr'])
+    client.endpoints[0].client = httpx.AsyncClient(base_url='http://solr', transport=httpx.MockTransport(handler))
+
+    async def get_solr_client():
+        return client
+    monkeypatch.setattr(solr_backend, 'get_solr_client', get_solr_client)
+
+
+def test_collection_cores_unreachable_node(monkeypatch):
+    """ Cores on a node we can't reach should be looked for on the node we are connected to instead. """
+    use_mock_solr(monkeypatch, ('name_lookup_shard1_replica_n1', 'name_lookup_shard2_replica_n2'))
+    cores, shards = asyncio.run(solr_backend.collection_cores('name_lookup'))
+    assert [(core['name'], core['shard'], core['leader']) for core in cores] == [
+        ('name_lookup_shard1_replica_n1', 'shard1', True),
+        ('name_lookup_shard2_replica_n2', 'shard2', True),
+    ]
+    assert shards == ['shard1', 'shard2']
+
+
+def test_index_status_missing_shard(monkeypatch):
+    """ A shard with no replica that we can reach should be reported as missing. """
+    use_mock_solr(monkeypatch, ('name_lookup_shard1_replica_n1',))
+    index = asyncio.run(solr_backend.SolrBackend().index_status())
+    assert index['shards'] == 1
+    assert index['numDocs'] == 10
+    assert index['missing_shards'] == ['shard2']
+
+
+def test_solr_filters_escaping():
+    """ Filter values should be escaped, so that they can't end their quoted term early. """
+    assert solr_backend.solr_filters(('Disease',), ('A"B', 'MONDO'), ('C\\',), ()) == (
+        'types:"Disease"',
+        '{!cache=false}filter(curie_prefix:"A\\"B") OR filter(curie_prefix:"MONDO")',
+        '{!cache=false cost=200}*:* -curie_prefix:"C\\\\"',
+    )
@@ -0,0 +1,138 @@
+import asyncio
+import time
+
+import httpx
+
+from api import solr
+from api.deadlines import DeadlineExceeded, _deadline
+from api.solr import SolrClient, SolrOverloaded
+
+
+def mock_client(handlers: dict) -> SolrClient:
+    """ Create a SolrClient whose nodes are answered by the async handlers in this dictionary (by base URL). """
+    client = SolrClient(list(handlers))
+    for endpoint in client.endpoints:
+        endpoint.client = httpx.AsyncClient(base_url=endpoint.base_url,
+                                            transport=httpx.MockTransport(handlers[endpoint.base_url]))
+    return client
+
+
+def answer(name: str, delay: float = 0):
+    async def handler(request):
+        await asyncio.sleep(delay)
+        return httpx.Response(200, json={'node': name})
+    return handler
+
+
+async def refuse(request):
+    raise httpx.ConnectError("Connection refused", request=request)
+
+
+def test_least_outstanding_routing():
+    """ Requests should go to the healthy node with the fewest outstanding requests. """
+    async def run():
+        client = mock_client({'http://a': answer('a'), 'http://b': answer('b'), 'http://c': answer('c')})
+        a, b, c = client.endpoints
+        a.outstanding = 2
+        c.healthy = False
+        assert (await client.get('/select')).json()['node'] == 'b'
+
+        # If no node is healthy, we still try one of them.
+        a.healthy = b.healthy = False
+        b.outstanding = 1
+        assert (await client.get('/select')).json()['node'] == 'c'
+        await client.aclose()
+    asyncio.run(run())
+
+
+def test_retry_on_another_node(monkeypatch):
+    """ A request that can't connect to one node should be retried on another. """
+    monkeypatch.setattr(solr, 'SOLR_RETRY_BACKOFF', 0)
+
+    async def run():
+        client = mock_client({'http://a': refuse, 'http://b': answer('b')})
+        client.endpoints[1].outstanding = 1
+        assert (await client.get('/select')).json()['node'] == 'b'
+        assert client.retries == 1
+        await client.aclose()
+    asyncio.run(run())
+
+
+def test_hedging(monkeypatch):
+    """ A slow search should be hedged to a second node, whose answer is used if it comes back first. """
+    monkeypatch.setattr(solr, 'SOLR_HEDGING', True)
+
+    async def run():
+        client = mock_client({'http://slow': answer('slow', delay=0.2), 'http://fast': answer('fast')})
+        client.hedge_delay = 0.01
+        client.endpoints[1].outstanding = 1
+        assert (await client.post('/select', json={}, hedge=True)).json()['node'] == 'fast'
+        assert client.hedged_requests == 1
+        assert client.hedges_won == 1
+
+        # Requests that aren't searches are never hedged.
+        client.endpoints[1].outstanding = 5
+        assert (await client.get('/admin', hedge=False)).json()['node'] == 'slow'
+        assert client.hedged_requests == 1
+        await client.aclose()
+    asyncio.run(run())
+
+
+def test_load_shedding(monkeypatch):
+    """ Requests beyond the concurrency limit should wait in a bounded queue, and be rejected once it is full. """
+    monkeypatch.setattr(solr, 'SOLR_MAX_CONCURRENT_REQUESTS', 1)
+    monkeypatch.setattr(solr, 'SOLR_MAX_QUEUED_REQUESTS', 1)
+
+    async def run():
+        client = mock_client({'http://a': answer('a', delay=0.05)})
+        first = asyncio.create_task(client.get('/select'))
+        queued = asyncio.create_task(client.get('/select'))
+        await asyncio.sleep(0.01)
+        assert client.stats()['queued'] == 1
+        try:
+            await client.get('/select')
+            assert False, "Expected the request to be rejected."
+        except SolrOverloaded:
+            pass
+        assert [response.json()['node'] for response in await asyncio.gather(first, queued)] == ['a', 'a']
+        assert client.stats()['shed'] == 1
+        await client.aclose()
+    asyncio.run(run())
+
+
+def test_deadline(monkeypatch):
+    """ A request should give up on Solr when its deadline passes, without blaming the Solr node. """
+    monkeypatch.setattr(solr, 'SOLR_RETRY_BACKOFF', 0)
+
+    async def run():
+        client = mock_client({'http://a': answer('a', delay=1), 'http://b': answer('b', delay=1)})
+        client.start_health_checks = lambda: None
+        _deadline.set(time.monotonic() + 0.05)
+        start = time.monotonic()
+        try:
+            await client.get('/select')
+            assert False, "Expected the deadline to pass."
+        except DeadlineExceeded:
+            pass
+        assert time.monotonic() - start < 0.5
+        assert client.retries == 0
+        assert all(endpoint.healthy for endpoint in client.endpoints)
+        await client.aclose()
+    asyncio.run(run())
+
+
+def test_hedging_limit(monkeypatch):
+    """ A search shouldn't be hedged if that would go over SOLR_MAX_CONCURRENT_REQUESTS. """
+    monkeypatch.setattr(solr, 'SOLR_HEDGING', True)
+    monkeypatch.setattr(solr, 'SOLR_MAX_CONCURRENT_REQUESTS', 1)
+
+    async def run():
+        client = mock_client({'http://slow': answer('slow', delay=0.05), 'http://fast': answer('fast')})
+        client.hedge_delay = 0.01
+        client.endpoints[1].outstanding = 1
+        assert (await client.post('/select', json={}, hedge=True)).json()['node'] == 'slow'
+        assert client.hedged_requests == 0
+        assert client.hedges_skipped == 1
+        assert not client.semaphore.locked()
+        await client.aclose()
+    asyncio.run(run())
@@ -0,0 +1,63 @@
+import asyncio
+
+from api import warmup
+from api.warmup import QueryLog, WarmUp, read_query_log
+
+
+def key(string_lc: str) -> tuple:
+    return (string_lc, False, False, 0, 10, ((), ('MONDO',), (), ()), None, None)
+
+
+def test_query_log(tmp_path, monkeypatch):
+    """ Lookups should only be written to the query log once they have been sampled often enough. """
+    monkeypatch.setattr(warmup, 'QUERY_LOG_SAMPLE_RATE', 1.0)
+    monkeypatch.setattr(warmup, 'QUERY_LOG_MIN_COUNT', 2)
+    path = str(tmp_path / 'query-log.jsonl')
+
+    query_log = QueryLog(path)
+    query_log.record(key('alzheimer'))
+    query_log.record(key('alzheimer'))
+    query_log.record(key('rare'))
+    query_log.record(key('x' * 200))
+    query_log.flush()
+    assert read_query_log(path) == {key('alzheimer'): 2}
+
+    # Counts that weren't written are kept until they have been sampled often enough, and merged with the file.
+    query_log.record(key('rare'))
+    query_log.record(key('alzheimer'))
+    query_log.flush()
+    assert read_query_log(path) == {key('alzheimer'): 3, key('rare'): 2}
+
+
+def test_warm_up(tmp_path, monkeypatch):
+    """ Warming up should replay the most frequent lookups, without recording them again. """
+    monkeypatch.setattr(warmup, 'QUERY_LOG_SAMPLE_RATE', 1.0)
+    monkeypatch.setattr(warmup, 'QUERY_LOG_MIN_COUNT', 1)
+    path = str(tmp_path / 'query-log.jsonl')
+    query_log = QueryLog(path)
+    for _ in range(3):
+        query_log.record(key('alzheimer'))
+    query_log.record(key('diabetes'))
+    query_log.flush()
+    monkeypatch.setattr(warmup, 'QUERY_LOG_PATH', path)
+    monkeypatch.setattr(warmup, 'QUERY_LOG', query_log)
+
+    replayed = []
+
+    async def lookup(string, autocomplete, highlighting, offset, limit, biolink_types, only_prefixes,
+                     exclude_prefixes, only_taxa, fields, max_synonyms):
+        warmup.record_lookup(key(string))
+        replayed.append((string, only_prefixes))
+        return []
+
+    async def run():
+        warm_up = WarmUp()
+        assert not warm_up.ready
+        warm_up.start(lookup, 'test')
+        await warm_up.task
+        return warm_up
+
+    warm_up = asyncio.run(run())
+    assert warm_up.ready
+    assert replayed == [('alzheimer', 'MONDO'), ('diabetes', 'MONDO')]
+    assert not query_log.counts